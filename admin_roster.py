@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+ذاكرة مؤقتة لمشرفي المجموعات
+قائمة المشرفين تُجلب باستدعاء get_chat_administrators واحد لكل مجموعة، وتُلغى عند ترقية عضو أو تنزيله
+(تحديثات chat_member) أو بعد انتهاء مهلة صلاحيتها، فيُجاب عن التحقق من الصلاحيات من الذاكرة
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Tuple
+
+from telegram import ChatMember
+
+logger = logging.getLogger(__name__)
+
+ADMIN_STATUSES = (ChatMember.ADMINISTRATOR, ChatMember.OWNER)
+
+
+class AdminRoster:
+    """معرفات مشرفي كل مجموعة مع مهلة صلاحية وحد أقصى لعدد المجموعات المخزنة"""
+
+    def __init__(self, ttl: float = 600.0, max_chats: int = 10000):
+        self._ttl = ttl
+        self._max_chats = max_chats
+        # chat_id -> (معرفات المشرفين، وقت الجلب)
+        self._rosters: "OrderedDict[int, Tuple[FrozenSet[int], float]]" = OrderedDict()
+        # جلب جارٍ لكل مجموعة، حتى لا تُرسل عدة طلبات متزامنة لنفس المجموعة
+        self._loading: Dict[int, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def is_admin(self, bot, chat_id: int, user_id: int) -> bool:
+        """هل المستخدم مشرف أو مالك المجموعة؟"""
+        return user_id in await self.get(bot, chat_id)
+
+    async def get(self, bot, chat_id: int) -> FrozenSet[int]:
+        """معرفات مشرفي المجموعة، من الذاكرة إن كانت صالحة"""
+        entry = self._rosters.get(chat_id)
+        if entry is not None and time.monotonic() - entry[1] < self._ttl:
+            self.hits += 1
+            self._rosters.move_to_end(chat_id)
+            return entry[0]
+
+        task = self._loading.get(chat_id)
+        if task is None:
+            self.misses += 1
+            task = self._loading[chat_id] = asyncio.create_task(self._load(bot, chat_id))
+            task.add_done_callback(lambda done: self._finished(chat_id, done))
+        # shield: إلغاء أحد المنتظرين لا يلغي الجلب على الباقين
+        return await asyncio.shield(task)
+
+    async def _load(self, bot, chat_id: int) -> FrozenSet[int]:
+        started = time.monotonic()
+        members = await bot.get_chat_administrators(chat_id)
+        admins = frozenset(member.user.id for member in members)
+        # تحديث وصل أثناء الجلب يُلغي النتيجة، فلا تُخزن (لكنها تُعاد للمنتظرين)
+        if self._loading.get(chat_id) is asyncio.current_task():
+            self._rosters[chat_id] = (admins, started)
+            self._rosters.move_to_end(chat_id)
+            if len(self._rosters) > self._max_chats:
+                self._rosters.popitem(last=False)
+        return admins
+
+    def _finished(self, chat_id: int, task: asyncio.Task):
+        if self._loading.get(chat_id) is task:
+            del self._loading[chat_id]
+
+    def observe(self, chat_member_updated):
+        """إلغاء قائمة المجموعة إذا دخل عضو إلى المشرفين أو خرج منهم"""
+        if chat_member_updated is None:
+            return
+        old_status = chat_member_updated.old_chat_member.status
+        new_status = chat_member_updated.new_chat_member.status
+        if old_status != new_status and (old_status in ADMIN_STATUSES or new_status in ADMIN_STATUSES):
+            self.invalidate(chat_member_updated.chat.id)
+
+    def invalidate(self, chat_id: int):
+        """حذف قائمة المجموعة لتُجلب من جديد عند التحقق التالي"""
+        self._rosters.pop(chat_id, None)
+        # الجلب الجاري قد يسبق التغيير، فلا تُخزن نتيجته
+        self._loading.pop(chat_id, None)
+
+    def snapshot(self) -> dict:
+        return {"chats": len(self._rosters), "hits": self.hits, "misses": self.misses}
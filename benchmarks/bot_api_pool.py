@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+أثر حجم مجمع الاتصالات وبقاء الاتصال على طلبات Bot API المتزامنة
+    python benchmarks/bot_api_pool.py [requests] [latency_ms]
+
+خادم Bot API محلي (HTTP/1.1 مع keep-alive) يرد على كل طلب بعد زمن ثابت، ويُرسل إليه requests طلب
+sendMessage معاً (مثل موجة انضمام) عبر InstrumentedRequest بأحجام مجمع مختلفة، مع قياس انتظار المجمع
+وانتهاء مهلته (1 ثانية كما في الإعداد الافتراضي، ثم 10 ثوانٍ) وعدد الاتصالات التي فتحها الخادم.
+الخادم في عملية منفصلة؛ على جهاز بمعالج واحد يصبح العميل نفسه (httpx) هو الحد عند الأحجام الكبيرة.
+"""
+
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import statistics
+import sys
+import time
+from collections import Counter
+
+from telegram.ext import ExtBot
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot_request import InstrumentedRequest  # noqa: E402
+
+logging.disable(logging.CRITICAL)
+
+GET_ME = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+
+
+class StandInBotAPI:
+    """خادم HTTP بسيط يحاكي Bot API بزمن رد ثابت"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self._message_id = 0
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                request_line, *header_lines = head.decode().split("\r\n")
+                headers = dict(line.split(": ", 1) for line in header_lines if ": " in line)
+                length = int(headers.get("Content-Length", headers.get("content-length", 0)))
+                if length:
+                    await reader.readexactly(length)
+                endpoint = request_line.split()[1].rsplit("/", 1)[-1]
+                if endpoint == "getMe":
+                    result = GET_ME
+                else:
+                    await asyncio.sleep(self.latency)
+                    self._message_id += 1
+                    result = {"message_id": self._message_id, "date": 0, "chat": {"id": -100123, "type": "group"}}
+                body = json.dumps({"ok": True, "result": result}).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    + f"Content-Length: {len(body)}\r\n\r\n".encode() + body
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+def serve(latency: float, port, connections):
+    """الخادم في عملية منفصلة حتى لا يشارك البوت حلقة الأحداث"""
+    async def main():
+        api = StandInBotAPI(latency)
+
+        async def handle(reader, writer):
+            connections.value += 1
+            await api.handle(reader, writer)
+
+        server = await asyncio.start_server(handle, "127.0.0.1", 0, backlog=1024)
+        port.value = server.sockets[0].getsockname()[1]
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(main())
+
+
+async def run(url: str, connections, requests: int, pool_size: int, keepalive: float, pool_timeout: float = 1.0):
+    request = InstrumentedRequest(connection_pool_size=pool_size, keepalive_expiry=keepalive, pool_timeout=pool_timeout)
+    bot = ExtBot("1:bench", base_url=url, request=request)
+    async with bot:
+        connections.value = 0
+        latencies = []
+
+        async def call(index):
+            started = time.perf_counter()
+            await bot.send_message(-100123, f"captcha {index}")
+            latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(call(index) for index in range(requests)), return_exceptions=True)
+        elapsed = time.perf_counter() - started
+        # دفعة ثانية بعد توقف قصير: هل بقيت الاتصالات مفتوحة؟
+        await asyncio.sleep(0.2)
+        second_connections = connections.value
+        await asyncio.gather(*(call(index) for index in range(pool_size)), return_exceptions=True)
+        reconnects = connections.value - second_connections
+
+    errors = Counter(type(result).__name__ for result in results if isinstance(result, Exception))
+    stats = request.snapshot()
+    latencies.sort()
+    print(
+        f"pool {pool_size:4d} keepalive {keepalive:4.1f}s pool timeout {pool_timeout:4.1f}s: {elapsed:6.2f}s, "
+        f"p50 {statistics.median(latencies) * 1000:7.1f} ms, p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:7.1f} ms, "
+        f"pool waits {stats['waited']} (avg {stats['avg_wait_ms']:.0f} ms, max {stats['max_wait_ms']:.0f} ms), "
+        f"pool timeouts {stats['pool_timeouts']}, failed {sum(errors.values())}, "
+        f"connections {second_connections}, reconnects after idle {reconnects}/{pool_size}"
+    )
+
+
+async def main(requests: int, latency: float):
+    context = multiprocessing.get_context("spawn")
+    port, connections = context.Value("i", 0), context.Value("i", 0)
+    server = context.Process(target=serve, args=(latency, port, connections), daemon=True)
+    server.start()
+    while not port.value:
+        await asyncio.sleep(0.05)
+    url = f"http://127.0.0.1:{port.value}/bot"
+    print(f"{requests} concurrent sendMessage calls, {latency * 1000:.0f} ms server latency")
+    try:
+        for pool_size in (1, 8, 32, 128, 256):
+            await run(url, connections, requests, pool_size, keepalive=30)
+        # keepalive_expiry أقصر من فترة الخمول: كل دفعة تفتح اتصالاتها من جديد
+        await run(url, connections, requests, 256, keepalive=0.1)
+        # مجمع صغير مع مهلة انتظار أطول: لا يُفقد أي طلب
+        await run(url, connections, requests, 32, keepalive=30, pool_timeout=10)
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 500,
+        float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.05,
+    ))
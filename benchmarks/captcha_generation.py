@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+كلفة توليد سؤال كابتشا لكل انضمام: المولد القديم (random لكل سؤال) مقابل السحب من CaptchaPool
+
+    python benchmarks/captcha_generation.py [count]
+
+تشمل الكلفة بناء لوحة الأزرار كما يفعل new_member_handler.
+"""
+
+import os
+import random
+import sys
+import time
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from captcha_pool import CaptchaPool, generate_batch  # noqa: E402
+
+import numpy as np  # noqa: E402
+
+
+def legacy_math_captcha():
+    """المولد السابق كما كان في main.py"""
+    num1 = random.randint(1, 10)
+    num2 = random.randint(1, 10)
+    operation = random.choice(["+", "-", "*"])
+    if operation == "+":
+        answer = num1 + num2
+        question = f"كم يساوي {num1} + {num2}؟"
+    elif operation == "-":
+        if num1 < num2:
+            num1, num2 = num2, num1
+        answer = num1 - num2
+        question = f"كم يساوي {num1} - {num2}؟"
+    else:
+        answer = num1 * num2
+        question = f"كم يساوي {num1} × {num2}؟"
+    return question, answer
+
+
+def legacy_options(correct_answer):
+    options = [correct_answer]
+    seen_options = {correct_answer}
+    while len(options) < 4:
+        wrong_answer = correct_answer + random.choice([-1, 1]) * random.randint(1, 10)
+        if wrong_answer not in seen_options and wrong_answer >= 0:
+            options.append(wrong_answer)
+            seen_options.add(wrong_answer)
+        else:
+            for _ in range(10):
+                wrong_answer = random.randint(max(0, correct_answer - 15), correct_answer + 15)
+                if wrong_answer not in seen_options and wrong_answer >= 0:
+                    options.append(wrong_answer)
+                    seen_options.add(wrong_answer)
+                    break
+    random.shuffle(options)
+    return options
+
+
+def keyboard(user_id, options):
+    return InlineKeyboardMarkup(
+        [[InlineKeyboardButton(str(option), callback_data=f"captcha_{user_id}_{option}")] for option in options]
+    )
+
+
+def per_captcha_us(generate, count: int) -> float:
+    start = time.perf_counter()
+    for user_id in range(count):
+        generate(user_id)
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def batch_us(count: int) -> float:
+    rng = np.random.default_rng()
+    start = time.perf_counter()
+    generate_batch(count, rng)
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def legacy(user_id):
+    question, correct_answer = legacy_math_captcha()
+    return question, keyboard(user_id, legacy_options(correct_answer))
+
+
+def main(count: int):
+    pool = CaptchaPool()
+
+    def pooled(user_id):
+        question, correct_answer, options = pool.pop()
+        return question, keyboard(user_id, options)
+
+    results = [
+        ("legacy question+options", per_captcha_us(lambda _: legacy_options(legacy_math_captcha()[1]), count)),
+        ("batch generation (amortised)", batch_us(count)),
+        ("pool pop", per_captcha_us(lambda _: pool.pop(), count)),
+        ("legacy + keyboard", per_captcha_us(legacy, count)),
+        ("pool + keyboard", per_captcha_us(pooled, count)),
+    ]
+    for name, cost in results:
+        print(f"{name:>30}: {cost:7.2f} µs per captcha")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+الزمن حتى وصول الكابتشا لرسالة انضمام واحدة فيها عدة أعضاء جدد
+    python benchmarks/join_fanout.py [members] [latency_ms]
+
+يشغّل new_member_handler من main.py مع بوت وهمي يضيف زمن رحلة ثابت لكل استدعاء، ويقارنه بالحلقة
+السابقة (restrict_chat_member ثم send_message لكل عضو على التوالي). عضو من كل 25 يفشل تقييده
+لإظهار أن الفشل الجزئي لا يوقف الباقين.
+"""
+
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+logging.disable(logging.CRITICAL)
+# رسالة الانضمام الكبيرة يجب ألا تُعامل كموجة (raid)
+os.environ.setdefault("RAID_JOIN_THRESHOLD", str(10 ** 9))
+
+import main  # noqa: E402
+
+CHAT_ID = -100123
+FAILING_EVERY = 25
+
+
+class SlowBot:
+    """بوت وهمي بزمن رحلة ثابت يسجل وقت إرسال كل كابتشا"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.delivered = []
+        self._message_id = 0
+        self._started = 0.0
+
+    def start(self):
+        self.delivered.clear()
+        self._started = time.perf_counter()
+
+    async def restrict_chat_member(self, chat_id, user_id, permissions):
+        await asyncio.sleep(self.latency)
+        if user_id % FAILING_EVERY == 0:
+            raise RuntimeError("Not enough rights to restrict/unrestrict chat member")
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.delivered.append(time.perf_counter() - self._started)
+        self._message_id += 1
+        return SimpleNamespace(message_id=self._message_id)
+
+    async def delete_message(self, chat_id, message_id):
+        await asyncio.sleep(self.latency)
+
+
+def join_update(members: int):
+    users = [
+        SimpleNamespace(id=user_id, is_bot=False, username=f"user{user_id}", first_name="user",
+                        mention_html=lambda user_id=user_id: f"user{user_id}")
+        for user_id in range(1, members + 1)
+    ]
+    return SimpleNamespace(
+        effective_chat=SimpleNamespace(id=CHAT_ID),
+        message=SimpleNamespace(new_chat_members=users),
+        chat_member=None,
+    )
+
+
+async def sequential(bot, update):
+    """الحلقة السابقة: رحلتان متتاليتان لكل عضو"""
+    for user in update.message.new_chat_members:
+        try:
+            await bot.restrict_chat_member(chat_id=CHAT_ID, user_id=user.id, permissions=None)
+            await bot.send_message(chat_id=CHAT_ID, text="captcha")
+        except Exception:
+            pass
+
+
+def report(name: str, bot: SlowBot, elapsed: float, members: int):
+    delivered = sorted(bot.delivered)
+    pending = len(main.pending_users.get(CHAT_ID, {})) if name != "sequential" else len(delivered)
+    print(
+        f"{name:>26}: handler {elapsed * 1000:8.1f} ms, first captcha {delivered[0] * 1000:7.1f} ms, "
+        f"median {statistics.median(delivered) * 1000:7.1f} ms, last {delivered[-1] * 1000:8.1f} ms, "
+        f"{pending}/{members} pending"
+    )
+
+
+async def bench(members: int, latency: float):
+    print(f"{members} new members in one message, {latency * 1000:.0f} ms per Bot API call, "
+          f"every {FAILING_EVERY}th restrict fails")
+    bot = SlowBot(latency)
+    update = join_update(members)
+
+    bot.start()
+    start = time.perf_counter()
+    await sequential(bot, update)
+    report("sequential", bot, time.perf_counter() - start, members)
+
+    main.chat_registry.set_enabled(CHAT_ID, True)
+    context = SimpleNamespace(bot=bot)
+    for limit in (1, 5, 10, 25):
+        main.new_member_limiter = main.ChatLimiter(limit)
+        main.pending_users.clear()
+        main.kick_scheduler.cancel_chat(CHAT_ID)
+        bot.start()
+        start = time.perf_counter()
+        await main.new_member_handler(update, context)
+        report(f"fan-out (limit {limit})", bot, time.perf_counter() - start, members)
+    await main.kick_scheduler.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(bench(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 50,
+        float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.05,
+    ))
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+كلفة إلغاء مواعيد الطرد لمجموعة واحدة (تعطيل الحماية) مع 100 ألف كابتشا معلقة موزعة على 10 آلاف مجموعة
+
+    python benchmarks/kick_cancel.py [entries] [chats]
+
+يقارن الفهرس لكل مجموعة في DeadlineScheduler بالطريقتين السابقتين:
+مفاتيح kick_tasks النصية مع المرور بـ startswith، ومفاتيح (chat_id, user_id) في قاموس واحد مع المرور على الكل.
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kick_scheduler import DeadlineScheduler  # noqa: E402
+
+CANCELLED_CHATS = 1000
+
+
+class StringKeyTasks:
+    """kick_tasks كما كان: f"{chat_id}_{user_id}" -> مهمة"""
+
+    def __init__(self):
+        self.tasks = {}
+
+    def schedule(self, chat_id, user_id):
+        self.tasks[f"{chat_id}_{user_id}"] = None
+
+    def cancel_chat(self, chat_id):
+        prefix = f"{chat_id}_"
+        keys = [key for key in self.tasks if key.startswith(prefix)]
+        for key in keys:
+            del self.tasks[key]
+        return len(keys)
+
+
+class FlatTupleKeys:
+    """DeadlineScheduler السابق: (chat_id, user_id) -> seq في قاموس واحد"""
+
+    def __init__(self):
+        self.live = {}
+
+    def schedule(self, chat_id, user_id):
+        self.live[(chat_id, user_id)] = 0
+
+    def cancel_chat(self, chat_id):
+        keys = [key for key in self.live if key[0] == chat_id]
+        for key in keys:
+            del self.live[key]
+        return len(keys)
+
+
+async def noop(batch):
+    pass
+
+
+def measure(name, schedule, cancel_chat, entries, chats):
+    start = time.perf_counter()
+    for index in range(entries):
+        schedule(-(index % chats) - 1, 10 ** 6 + index)
+    scheduled = time.perf_counter() - start
+
+    start = time.perf_counter()
+    cancelled = sum(cancel_chat(-chat) for chat in range(1, CANCELLED_CHATS + 1))
+    elapsed = time.perf_counter() - start
+    assert cancelled == CANCELLED_CHATS * (entries // chats), cancelled
+    print(
+        f"{name:>28}: schedule {scheduled / entries * 1e6:6.2f} µs/entry, "
+        f"cancel_chat {elapsed / CANCELLED_CHATS * 1e6:10.1f} µs/chat"
+    )
+
+
+async def main(entries: int, chats: int):
+    print(f"{entries} pending entries over {chats} chats, cancelling {CANCELLED_CHATS} chats")
+    legacy = StringKeyTasks()
+    measure("string keys + startswith", legacy.schedule, legacy.cancel_chat, entries, chats)
+    flat = FlatTupleKeys()
+    measure("flat (chat_id, user_id) keys", flat.schedule, flat.cancel_chat, entries, chats)
+
+    scheduler = DeadlineScheduler(noop)
+    deadline = time.time() + 3600
+    measure(
+        "per-chat index",
+        lambda chat_id, user_id: scheduler.schedule(chat_id, user_id, 0, deadline=deadline),
+        scheduler.cancel_chat,
+        entries,
+        chats,
+    )
+    await scheduler.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 100000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 10000,
+    ))
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+خادم RESP محلي بسيط يحاكي أوامر Redis التي يستخدمها RedisStateBackend فقط
+لتجربة المخزن الشبكي وقياسه دون خادم Redis حقيقي
+
+    python benchmarks/kv_standin.py [port]
+"""
+
+import asyncio
+import sys
+from collections import defaultdict
+
+
+class KeyValueStandIn:
+    """HSET و HDEL و HGETALL و SADD و SREM و SMEMBERS و DEL و PING، مع HELLO (RESP2/RESP3) وتجاهل أوامر CLIENT"""
+
+    def __init__(self):
+        self._hashes = defaultdict(dict)
+        self._sets = defaultdict(set)
+        self.commands = 0
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # redis-py يبدأ بـ HELLO 3 ويتوقع أنواع RESP3 (map و set) بعدها
+        connection = {"protocol": 2}
+        try:
+            while True:
+                command = await self._read_command(reader)
+                if command is None:
+                    break
+                self.commands += 1
+                writer.write(self._execute(command, connection))
+                # الرد على كل أوامر الـ pipeline المقروءة قبل الانتظار
+                if not reader._buffer:
+                    await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _read_command(reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        count = int(line[1:])
+        parts = []
+        for _ in range(count):
+            size = int((await reader.readline())[1:])
+            parts.append((await reader.readexactly(size + 2))[:-2])
+        return parts
+
+    def _execute(self, command, connection: dict) -> bytes:
+        name, args = command[0].upper(), command[1:]
+        resp3 = connection["protocol"] == 3
+        if name == b"PING":
+            return b"+PONG\r\n"
+        if name == b"HELLO":
+            if args:
+                connection["protocol"] = int(args[0])
+            info = [b"server", b"kv-standin", b"version", b"7.0.0", b"proto", connection["protocol"]]
+            return _array(info, b"%" if connection["protocol"] == 3 else b"*")
+        if name in (b"CLIENT", b"SELECT"):
+            return b"+OK\r\n"
+        if name == b"HSET":
+            fields = self._hashes[args[0]]
+            added = 0
+            for field, value in zip(args[1::2], args[2::2]):
+                added += field not in fields
+                fields[field] = value
+            return _integer(added)
+        if name == b"HDEL":
+            fields = self._hashes.get(args[0], {})
+            removed = sum(fields.pop(field, None) is not None for field in args[1:])
+            if not fields:
+                self._hashes.pop(args[0], None)
+            return _integer(removed)
+        if name == b"HGETALL":
+            fields = self._hashes.get(args[0], {})
+            return _array([item for pair in fields.items() for item in pair], b"%" if resp3 else b"*")
+        if name == b"SADD":
+            members = self._sets[args[0]]
+            before = len(members)
+            members.update(args[1:])
+            return _integer(len(members) - before)
+        if name == b"SREM":
+            members = self._sets.get(args[0], set())
+            before = len(members)
+            members.difference_update(args[1:])
+            return _integer(before - len(members))
+        if name == b"SMEMBERS":
+            return _array(list(self._sets.get(args[0], ())), b"~" if resp3 else b"*")
+        if name == b"DEL":
+            return _integer(sum((self._hashes.pop(key, None) is not None) + (self._sets.pop(key, None) is not None)
+                                for key in args))
+        return b"-ERR unknown command '" + name + b"'\r\n"
+
+
+def _integer(value: int) -> bytes:
+    return b":%d\r\n" % value
+
+
+def _array(items, kind: bytes = b"*") -> bytes:
+    # في map (%) يكون العدد للأزواج لا للعناصر
+    count = len(items) // 2 if kind == b"%" else len(items)
+    return kind + b"%d\r\n" % count + b"".join(
+        _integer(item) if isinstance(item, int) else b"$%d\r\n%s\r\n" % (len(item), item) for item in items
+    )
+
+
+async def start(host: str = "127.0.0.1", port: int = 0):
+    """تشغيل الخادم؛ تُرجع (server, url)"""
+    standin = KeyValueStandIn()
+    server = await asyncio.start_server(standin.handle, host, port)
+    port = server.sockets[0].getsockname()[1]
+    return server, f"redis://{host}:{port}/0"
+
+
+async def serve_forever(port: int):
+    server, url = await start(port=port)
+    print(f"listening on {url}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    asyncio.run(serve_forever(int(sys.argv[1]) if len(sys.argv) > 1 else 6390))
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""
+دفعة طلبات صادرة تتجاوز حدود Telegram: بلا مجدول مقابل OutboundScheduler
+    python benchmarks/outbound_burst.py [speed]
+
+خادم Bot API محاكى داخل العملية (BaseRequest) يطبق حدود Telegram: SPEED×30 طلب في الثانية للبوت كله،
+و 20 رسالة لكل مجموعة خلال 60/SPEED ثانية، ويرد بـ 429 (retry_after) عند تجاوزها، ويفشل 2% من الطلبات بخطأ شبكة.
+الدفعة تشبه انتهاء موجة انضمام: طرد 300 عضو، 40 رسالة في المجموعة نفسها، و 100 رد في محادثات خاصة.
+ثم إذاعة جارية (BROADCAST رسالة خاصة بـ bulk) يبدأ أثناءها طرد KICKS عضو: يُقاس متى ينتهي الطرد.
+الحدود والمعدلات مضروبة في speed (الافتراضي 10) حتى يستغرق القياس ثوانٍ بدلاً من دقائق.
+"""
+
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import sys
+import time
+from collections import Counter, deque
+
+from telegram.error import NetworkError
+from telegram.ext import ExtBot
+from telegram.request import BaseRequest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from outbound import OutboundScheduler  # noqa: E402
+
+logging.disable(logging.CRITICAL)
+
+GROUP_ID = -100123
+KICKS = 300
+GROUP_MESSAGES = 40
+PRIVATE_MESSAGES = 100
+NETWORK_FAILURE_RATE = 0.02
+BROADCAST = 600
+
+
+class StandInBotAPI(BaseRequest):
+    """Bot API محاكى بحدود Telegram للمعدل"""
+
+    def __init__(self, speed: float):
+        self._global_limit = 30 * speed
+        self._group_window = 60 / speed
+        self._global = deque()
+        self._groups = {}
+        self._message_id = 0
+        self.responses = Counter()
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _limited(self, chat_id, sends: bool) -> float:
+        now = time.monotonic()
+        while self._global and self._global[0] <= now - 1:
+            self._global.popleft()
+        if len(self._global) >= self._global_limit:
+            return 1
+        if sends and chat_id is not None and chat_id < 0:
+            window = self._groups.setdefault(chat_id, deque())
+            while window and window[0] <= now - self._group_window:
+                window.popleft()
+            if len(window) >= 20:
+                return window[0] + self._group_window - now
+            window.append(now)
+        self._global.append(now)
+        return 0
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        await asyncio.sleep(0.002)
+        endpoint = url.rsplit("/", 1)[-1]
+        parameters = request_data.parameters if request_data else {}
+        if endpoint == "getMe":
+            return 200, json.dumps({"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}}).encode()
+        if random.random() < NETWORK_FAILURE_RATE:
+            self.responses["network error"] += 1
+            raise NetworkError("connection reset by stand-in")
+        chat_id = int(parameters["chat_id"]) if "chat_id" in parameters else None
+        sends = endpoint.startswith("send")
+        retry_after = self._limited(chat_id, sends)
+        if retry_after:
+            self.responses["429"] += 1
+            seconds = max(1, math.ceil(retry_after))
+            return 429, json.dumps({
+                "ok": False, "error_code": 429, "description": f"Too Many Requests: retry after {seconds}",
+                "parameters": {"retry_after": seconds},
+            }).encode()
+        self.responses["200"] += 1
+        if sends:
+            self._message_id += 1
+            result = {"message_id": self._message_id, "date": 0, "chat": {"id": chat_id, "type": "group" if chat_id < 0 else "private"}}
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+async def burst(bot):
+    calls = (
+        [bot.ban_chat_member(GROUP_ID, user_id) for user_id in range(1, KICKS + 1)]
+        + [bot.send_message(GROUP_ID, f"message {index}") for index in range(GROUP_MESSAGES)]
+        + [bot.send_message(user_id, "reply") for user_id in range(1, PRIVATE_MESSAGES + 1)]
+    )
+    started = time.perf_counter()
+    results = await asyncio.gather(*calls, return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    failures = Counter(type(result).__name__ for result in results if isinstance(result, Exception))
+    return elapsed, len(results) - sum(failures.values()), failures
+
+
+async def run(name: str, speed: float, rate_limiter):
+    random.seed(1)
+    api = StandInBotAPI(speed)
+    bot = ExtBot("1:bench", request=api, get_updates_request=StandInBotAPI(speed), rate_limiter=rate_limiter)
+    async with bot:
+        elapsed, delivered, failures = await burst(bot)
+    total = KICKS + GROUP_MESSAGES + PRIVATE_MESSAGES
+    detail = ", ".join(f"{error}={count}" for error, count in sorted(failures.items())) or "none"
+    print(f"{name:>16}: {delivered}/{total} delivered in {elapsed:6.2f}s, failed: {detail}; "
+          f"API responses: {dict(api.responses)}")
+    if rate_limiter is not None:
+        stats = rate_limiter.snapshot()
+        print(f"{'':>16}  peak queue {stats['peak_waiting']}, throttled {stats['throttled']} "
+              f"({stats['throttle_seconds']:.1f}s total), RetryAfter {stats['retry_after']}, "
+              f"network retries {stats['network_retries']}")
+
+
+async def broadcast_and_kicks(speed: float):
+    random.seed(1)
+    scheduler = OutboundScheduler(global_rate=30 * speed, group_rate=20 / 60 * speed, private_rate=speed, backoff=0.05)
+    bot = ExtBot("1:bench", request=StandInBotAPI(speed), get_updates_request=StandInBotAPI(speed), rate_limiter=scheduler)
+    async with bot:
+        started = time.perf_counter()
+
+        async def timed(calls):
+            await asyncio.gather(*calls, return_exceptions=True)
+            return time.perf_counter() - started
+
+        broadcast = asyncio.create_task(timed(
+            bot.send_message(user_id, "broadcast", rate_limit_args={"bulk": True}) for user_id in range(1, BROADCAST + 1)
+        ))
+        await asyncio.sleep(0.5)
+        kicks = await timed(bot.ban_chat_member(GROUP_ID, user_id) for user_id in range(1, KICKS + 1))
+        broadcast_done = await broadcast
+    minimum = KICKS / (30 * speed)
+    print(f"broadcast of {BROADCAST} + {KICKS} bans from t=0.5s: bans done at {kicks:.2f}s "
+          f"(at least {0.5 + minimum:.2f}s at the global rate), broadcast done at {broadcast_done:.2f}s")
+
+
+async def main(speed: float):
+    print(f"{KICKS} bans + {GROUP_MESSAGES} group messages + {PRIVATE_MESSAGES} private messages, limits x{speed:g}")
+    await run("no scheduler", speed, None)
+    await run("OutboundScheduler", speed, OutboundScheduler(
+        global_rate=30 * speed, group_rate=20 / 60 * speed, private_rate=speed, backoff=0.05,
+    ))
+    await broadcast_and_kicks(speed)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(float(sys.argv[1]) if len(sys.argv) > 1 else 10))
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+ذاكرة pending_users لكل عضو معلق: قاموس لكل سجل مقابل PendingRecord
+    python benchmarks/pending_memory.py [entries] [chats]
+
+يبني pending_users كما يبنيه new_member_handler (ملايين الأعضاء موزعين على آلاف المجموعات،
+بأسماء تتكرر كما في موجات الحسابات الوهمية) ويقيس الذاكرة المحجوزة بـ tracemalloc.
+"""
+
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pending_record import PendingRecord  # noqa: E402
+
+# عدد الأسماء المختلفة؛ حسابات موجات الانضمام كثيراً ما تحمل أسماء متكررة
+DISTINCT_NAMES = 5000
+
+
+def names(entries: int):
+    # أسماء تُبنى وقت التشغيل كما تصل من تحديثات Telegram (غير مشتركة تلقائياً)
+    return ["".join(("user", str(index % DISTINCT_NAMES))) for index in range(entries)]
+
+
+def dict_records(entries: int, chats: int, usernames):
+    pending = {}
+    deadline = time.time() + 300
+    for index in range(entries):
+        pending.setdefault(-(index % chats) - 1, {})[10 ** 6 + index] = {
+            "join_time": datetime.now(),
+            "username": usernames[index],
+            "message_id": 100000 + index,
+            "deadline": deadline,
+        }
+    return pending
+
+
+def slotted_records(entries: int, chats: int, usernames):
+    pending = {}
+    deadline = int(time.time()) + 300
+    for index in range(entries):
+        record = PendingRecord(usernames[index], deadline)
+        record.message_id = 100000 + index
+        pending.setdefault(-(index % chats) - 1, {})[10 ** 6 + index] = record
+    return pending
+
+
+def measure(name: str, build, entries: int, chats: int):
+    gc.collect()
+    tracemalloc.start()
+    usernames = names(entries)
+    baseline = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    pending = build(entries, chats, usernames)
+    elapsed = time.perf_counter() - start
+    del usernames
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(
+        f"{name:>14}: {size / 2 ** 20:8.1f} MiB, {size / entries:6.0f} B/pending user "
+        f"(names before build {baseline / 2 ** 20:.1f} MiB), build {elapsed:.2f}s"
+    )
+    del pending
+
+
+def main(entries: int, chats: int):
+    print(f"{entries} pending users over {chats} chats, {DISTINCT_NAMES} distinct names")
+    measure("dict records", dict_records, entries, chats)
+    measure("PendingRecord", slotted_records, entries, chats)
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 1000000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 10000,
+    )
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+عدد استدعاءات Bot API لموجة انضمام: كابتشا لكل عضو مقابل وضع الدفعة (raid)
+
+    python benchmarks/raid_api_calls.py [members]
+
+يشغّل new_member_handler و expire_captchas من main.py مع بوت وهمي يعدّ الاستدعاءات،
+ولا يحل أي عضو الكابتشا (أسوأ حالة: كل الحسابات وهمية وتُطرد عند انتهاء المهلة).
+"""
+
+import asyncio
+import logging
+import os
+import sys
+from collections import Counter
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+logging.disable(logging.CRITICAL)
+
+import main  # noqa: E402
+
+CHAT_ID = -100123
+
+
+class CountingBot:
+    """بوت وهمي يسجل كل استدعاء API"""
+
+    def __init__(self):
+        self.calls = Counter()
+        self._message_id = 0
+
+    def __getattr__(self, method):
+        async def call(*args, **kwargs):
+            self.calls[method] += 1
+            self._message_id += 1
+            # get_chat_member: العضو ما زال مقيداً (لم يحل الكابتشا)
+            return SimpleNamespace(
+                message_id=self._message_id, permissions=None, status=main.ChatMember.RESTRICTED, can_send_messages=False
+            )
+        return call
+
+
+def join_update(user_id: int):
+    user = SimpleNamespace(
+        id=user_id, is_bot=False, username=f"user{user_id}", first_name="user", mention_html=lambda: f"user{user_id}"
+    )
+    return SimpleNamespace(
+        effective_chat=SimpleNamespace(id=CHAT_ID),
+        message=None,
+        chat_member=SimpleNamespace(new_chat_member=SimpleNamespace(status=main.ChatMember.MEMBER, user=user)),
+    )
+
+
+async def run_raid(members: int, raid_threshold: int):
+    bot = CountingBot()
+    main.application = SimpleNamespace(bot=bot)
+    main.pending_users.clear()
+    main.chat_registry.set_enabled(CHAT_ID, True)
+    main.raid_guard._monitor._threshold = raid_threshold
+    main.raid_guard._monitor._joins.clear()
+    context = SimpleNamespace(bot=bot)
+
+    for user_id in range(1, members + 1):
+        await main.new_member_handler(join_update(user_id), context)
+    join_calls = sum(bot.calls.values())
+
+    # انتهاء جميع المهل دون أن يحل أحد الكابتشا
+    entries = []
+    while True:
+        batch = main.kick_scheduler._pop_due(float("inf"))
+        if not batch:
+            break
+        entries.extend(batch)
+    await main.expire_captchas(entries)
+    return join_calls, bot.calls
+
+
+async def bench(members: int):
+    for name, threshold in (("per-user", 10 ** 9), ("raid", 10)):
+        join_calls, calls = await run_raid(members, threshold)
+        detail = ", ".join(f"{method}={count}" for method, count in sorted(calls.items()))
+        print(f"{name:>9}: {join_calls:6d} calls at join time, {sum(calls.values()):6d} in total ({detail})")
+
+
+if __name__ == "__main__":
+    asyncio.run(bench(int(sys.argv[1]) if len(sys.argv) > 1 else 500))
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+إنتاجية معالجة الانضمامات موزعة على 1 و 2 و 4 و 8 عمال (عمليات منفصلة)
+
+    python benchmarks/shard_throughput.py [updates] [sqlite|redis|memory]
+
+عملية الاستقبال توزع تحديثات chat_member عبر ShardRouter كما في main.py مع BOT_WORKERS،
+وكل عامل يشغّل new_member_handler من main.py مع بوت وهمي (دون شبكة) ويحفظ الكابتشا المعلقة
+في المخزن المشترك: ملف SQLite بوضع WAL أو خادم kv_standin محلي بدلاً من Redis.
+الزمن يبدأ بعد جاهزية جميع العمال (استيراد main) وينتهي بعد كتابة آخر دفعة في المخزن.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from telegram import Update  # noqa: E402
+
+import kv_standin  # noqa: E402
+from sharding import ShardRouter  # noqa: E402
+
+CHATS = 1000
+WORKER_COUNTS = (1, 2, 4, 8)
+
+
+class SilentBot:
+    """بوت وهمي يرد فوراً على كل استدعاء"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def __getattr__(self, method):
+        async def call(*args, **kwargs):
+            self.calls += 1
+            return SimpleNamespace(message_id=self.calls)
+        return call
+
+
+def join_payload(update_id: int, chat_id: int, user_id: int) -> dict:
+    user = {"id": user_id, "is_bot": False, "first_name": "user", "username": f"user{user_id}"}
+    return {
+        "update_id": update_id,
+        "chat_member": {
+            "chat": {"id": chat_id, "type": "supergroup", "title": "bench"},
+            "from": user,
+            "date": 0,
+            "old_chat_member": {"status": "left", "user": user},
+            "new_chat_member": {"status": "member", "user": user},
+        },
+    }
+
+
+def run_worker(shard: int, shards: int, updates, results, backend_url: str):
+    os.environ["STATE_BACKEND"] = backend_url
+    logging.disable(logging.CRITICAL)
+    import main
+
+    asyncio.run(worker(main, shard, shards, updates, results))
+
+
+async def worker(main, shard: int, shards: int, updates, results):
+    bot = SilentBot()
+    main.application = SimpleNamespace(bot=bot)
+    main.SHARD, main.SHARDS = shard, shards
+    # كابتشا لكل عضو، دون وضع موجات الانضمام
+    main.raid_guard._monitor._threshold = 10 ** 9
+    for chat_id in range(1, CHATS + 1):
+        main.chat_registry.set_enabled(-chat_id, True)
+    await main.pending_store.open()
+    context = SimpleNamespace(bot=bot)
+    loop = asyncio.get_running_loop()
+    results.put(("ready", shard))
+
+    processed = 0
+    while True:
+        data = await loop.run_in_executor(None, updates.get)
+        if data is None:
+            break
+        await main.new_member_handler(Update.de_json(data, None), context)
+        processed += 1
+    await main.pending_store.stop()
+    results.put(("done", processed))
+
+
+def run(workers: int, updates, backend_url: str) -> float:
+    context = multiprocessing.get_context("spawn")
+    queues = [context.Queue(10000) for _ in range(workers)]
+    results = context.Queue()
+    processes = [
+        context.Process(target=run_worker, args=(shard, workers, queues[shard], results, backend_url))
+        for shard in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    for _ in processes:
+        results.get()
+
+    router = ShardRouter(queues)
+    start = time.perf_counter()
+    for update in updates:
+        while not router.put(update):
+            time.sleep(0.001)
+    router.close()
+    processed = sum(results.get()[1] for _ in processes)
+    elapsed = time.perf_counter() - start
+    for process in processes:
+        process.join()
+    assert processed == len(updates), (processed, len(updates))
+    return elapsed
+
+
+def start_standin() -> str:
+    """خادم kv_standin في خيط مستقل بحلقة أحداث خاصة به"""
+    loop = asyncio.new_event_loop()
+    server, url = loop.run_until_complete(kv_standin.start())
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return url
+
+
+def main(count: int, backend: str):
+    updates = [
+        Update.de_json(join_payload(index, -(index % CHATS + 1), 10 ** 6 + index), None) for index in range(count)
+    ]
+    directory = tempfile.mkdtemp()
+    try:
+        print(f"{count} joins over {CHATS} chats, backend={backend}, cpus={os.cpu_count()}")
+        for workers in WORKER_COUNTS:
+            if backend == "sqlite":
+                url = f"sqlite:///{os.path.join(directory, f'state-{workers}.db')}"
+            elif backend == "redis":
+                url = start_standin()
+            else:
+                url = "memory://"
+            elapsed = run(workers, updates, url)
+            print(f"{workers} worker(s): {elapsed:6.2f}s, {count / elapsed:8.0f} updates/s")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 20000,
+        sys.argv[2] if len(sys.argv) > 2 else "sqlite",
+    )
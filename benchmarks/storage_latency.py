@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+زمن عمليات التخزين عبر SQLiteRepository مقابل MongoRepository
+
+    python benchmarks/storage_latency.py [rounds]
+    MONGO_URI=mongodb://... python benchmarks/storage_latency.py
+
+نفس العمليات التي يستدعيها البوت (كتابة دفعة أحداث الكابتشا والعدادات، تحديث المستخدمين والمجموعات،
+get_stats، get_all_chats، is_activating_admin) على بيانات مسبقة التعبئة.
+يُقاس Mongo فقط إذا حُدد MONGO_URI، وتُستخدم قاعدة مؤقتة تُحذف بعد القياس.
+"""
+
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlite_storage import SQLiteRepository  # noqa: E402
+from storage import MongoRepository  # noqa: E402
+
+logging.disable(logging.CRITICAL)
+
+CHATS = 10000
+USERS = 100000
+EVENTS = 200000
+BATCH = 500
+STATUSES = ("success", "kicked", "timeout")
+
+
+def events(count: int, offset: int = 0):
+    now = datetime.now()
+    return [
+        {"user_id": offset + i, "chat_id": -((offset + i) % CHATS) - 1, "status": STATUSES[i % 3], "timestamp": now}
+        for i in range(count)
+    ]
+
+
+async def populate(repository):
+    for start in range(0, EVENTS, 10000):
+        await repository.insert_captcha_events(events(10000, start))
+    now = datetime.now()
+    await repository.upsert_fields(
+        "chats", "chat_id",
+        {-i: {"chat_title": f"chat {i}", "protection_enabled": i % 2 == 0, "activating_admin_id": i, "last_activity": now}
+         for i in range(1, CHATS + 1)},
+    )
+    for start in range(0, USERS, 10000):
+        await repository.upsert_fields(
+            "users", "user_id",
+            {i: {"username": f"user{i}", "first_name": "user", "last_interaction": now} for i in range(start, start + 10000)},
+        )
+
+
+async def timed(operation, rounds: int):
+    samples = []
+    for round_ in range(rounds):
+        start = time.perf_counter()
+        await operation(round_)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return statistics.mean(samples), samples[len(samples) // 2], samples[int(len(samples) * 0.99) - 1]
+
+
+async def bench(name: str, repository, rounds: int):
+    await populate(repository)
+    now = datetime.now()
+    operations = [
+        ("insert 500 captcha events", lambda r: repository.insert_captcha_events(events(BATCH, EVENTS + r * BATCH))),
+        ("increment counters", lambda r: repository.increment_counters({-(r % CHATS) - 1: {"success": 1}, "global": {"success": 1}})),
+        ("upsert 100 users", lambda r: repository.upsert_fields(
+            "users", "user_id", {i: {"username": f"u{r}", "last_interaction": now} for i in range(r * 100, r * 100 + 100)})),
+        ("upsert 1 chat", lambda r: repository.upsert_fields("chats", "chat_id", {-(r % CHATS) - 1: {"last_activity": now}})),
+        ("get_stats(chat_id)", lambda r: repository.get_stats(chat_id=-(r % CHATS) - 1)),
+        ("get_stats(hours=24)", lambda r: repository.get_stats(hours=24)),
+        ("get_counters(chat_id)", lambda r: repository.get_counters(-(r % CHATS) - 1)),
+        ("get_all_chats", lambda r: repository.get_all_chats()),
+        ("is_activating_admin", lambda r: repository.is_activating_admin(r % CHATS * 2)),
+        ("is_protection_enabled", lambda r: repository.is_protection_enabled(-(r % CHATS) - 1)),
+    ]
+    print(f"\n{name}: {CHATS} chats, {USERS} users, {EVENTS} events")
+    print(f"{'operation':>28} {'avg ms':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for label, operation in operations:
+        # الاستعلامات الكاملة على السجل أبطأ بكثير، فتُكرر مرات أقل
+        count = max(5, rounds // 20) if "hours" in label or "all" in label else rounds
+        avg, p50, p99 = await timed(operation, count)
+        print(f"{label:>28} {avg:9.3f} {p50:9.3f} {p99:9.3f}")
+
+
+async def main(rounds: int):
+    directory = tempfile.mkdtemp()
+    sqlite = SQLiteRepository(os.path.join(directory, "bench.db"))
+    await bench("SQLite (WAL)", sqlite, rounds)
+    sqlite.shutdown()
+
+    mongo_uri = os.environ.get("MONGO_URI")
+    if not mongo_uri:
+        print("\nMONGO_URI not set; skipping MongoDB.")
+        return
+    from pymongo import MongoClient
+
+    client = MongoClient(mongo_uri)
+    database_name = f"storage_latency_{os.getpid()}"
+    database = client[database_name]
+    database.chats.create_index("chat_id", unique=True)
+    database.users.create_index("user_id", unique=True)
+    database.chats.create_index([("activating_admin_id", 1), ("protection_enabled", 1)])
+    database.captcha_stats.create_index("chat_id")
+    database.captcha_stats.create_index("timestamp")
+    mongo = MongoRepository(lambda: database)
+    try:
+        await bench("MongoDB", mongo, rounds)
+    finally:
+        mongo.shutdown()
+        client.drop_database(database_name)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 200))
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+إنتاجية معالجة التحديثات حسب عدد المحادثات: معالجة تسلسلية مقابل المعالجة المقسمة حسب المحادثة
+
+    python benchmarks/update_concurrency.py [updates] [workers]
+
+يقيس UpdateQueue (مسار الويب هوك في main.py) و ChatOrderedUpdateProcessor (مسار polling في protection_bot.py)،
+ويتحقق من أن تحديثات كل محادثة عولجت بترتيب وصولها ودون تداخل.
+"""
+
+import asyncio
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from update_processor import ChatOrderedUpdateProcessor  # noqa: E402
+from update_queue import UpdateQueue  # noqa: E402
+
+# زمن معالجة محاكى لكل تحديث (استدعاء قاعدة بيانات + Telegram API)
+HANDLER_LATENCY = 0.02
+
+
+class FakeApplication:
+    """يسجل ترتيب معالجة تحديثات كل محادثة ويتحقق من عدم تداخلها"""
+
+    def __init__(self):
+        self.order = {}
+        self._in_progress = set()
+
+    async def process_update(self, update):
+        chat_id = update.effective_chat.id
+        assert chat_id not in self._in_progress, f"concurrent updates for chat {chat_id}"
+        self._in_progress.add(chat_id)
+        await asyncio.sleep(HANDLER_LATENCY)
+        self._in_progress.discard(chat_id)
+        self.order.setdefault(chat_id, []).append(update.update_id)
+
+    def check_order(self, total: int):
+        assert sum(len(ids) for ids in self.order.values()) == total
+        assert all(ids == sorted(ids) for ids in self.order.values()), "updates processed out of order"
+
+
+def make_updates(total: int, chats: int) -> list:
+    return [
+        SimpleNamespace(update_id=i, effective_chat=SimpleNamespace(id=-random.randrange(chats) - 1))
+        for i in range(total)
+    ]
+
+
+async def run_sequential(updates: list, workers: int) -> FakeApplication:
+    app = FakeApplication()
+    for update in updates:
+        await app.process_update(update)
+    return app
+
+
+async def run_queue(updates: list, workers: int) -> FakeApplication:
+    app = FakeApplication()
+    queue = UpdateQueue(app, workers=workers, max_size=len(updates))
+    queue.start()
+    for update in updates:
+        queue.put(update)
+    await queue.stop(timeout=600)
+    return app
+
+
+async def run_processor(updates: list, workers: int) -> FakeApplication:
+    app = FakeApplication()
+    processor = ChatOrderedUpdateProcessor(workers=workers)
+    # كما يفعل Application مع concurrent_updates: مهمة لكل تحديث بترتيب الوصول
+    tasks = [asyncio.create_task(processor.process_update(update, app.process_update(update))) for update in updates]
+    await asyncio.gather(*tasks)
+    return app
+
+
+async def main(total: int, workers: int):
+    modes = [("sequential", run_sequential), ("queue", run_queue), ("processor", run_processor)]
+    print(f"{total} updates, {HANDLER_LATENCY * 1000:.0f}ms per update, {workers} workers\n")
+    print(f"{'chats':>6}" + "".join(f"{name:>14}" for name, _ in modes) + "   (updates/s)")
+    for chats in (1, 10, 100, 1000):
+        updates = make_updates(total, chats)
+        row = f"{chats:>6}"
+        for name, run in modes:
+            # التسلسلي (ومحادثات قليلة) لا يتجاوز 1/HANDLER_LATENCY لكل محادثة؛ تكفي عينة صغيرة
+            sample = updates[:200] if name == "sequential" else updates[: max(200, chats * 50)]
+            start = time.perf_counter()
+            app = await run(sample, workers)
+            elapsed = time.perf_counter() - start
+            app.check_order(len(sample))
+            row += f"{len(sample) / elapsed:14.1f}"
+        print(row)
+
+
+if __name__ == "__main__":
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    asyncio.run(main(total, workers))
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+مقارنة زمن استجابة الويب هوك: مسار Flask القديم مقابل مدخل ASGI الجديد
+
+    python benchmarks/webhook_latency.py [requests] [concurrency]
+
+يحاكي مسار Flask السلوك القديم (معالجة التحديث داخل الطلب)، بينما يضع مدخل ASGI التحديث في
+application.update_queue أو في UpdateQueue المحدود مع عماله.
+يحتاج إلى httpx و uvicorn؛ مسار Flask يُقاس فقط إذا كانت flask مثبتة (pip install flask)،
+فهي ليست من متطلبات البوت.
+"""
+
+import asyncio
+import os
+import statistics
+import sys
+import threading
+import time
+
+import httpx
+import uvicorn
+from telegram import Update
+
+try:
+    from flask import Flask, request
+except ImportError:
+    Flask = None
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from update_queue import UpdateQueue  # noqa: E402
+from webhook_server import WebhookApp  # noqa: E402
+
+# زمن معالجة محاكى لكل تحديث (استدعاء قاعدة بيانات + Telegram API)
+HANDLER_LATENCY = 0.02
+
+UPDATE = {
+    "update_id": 1,
+    "message": {
+        "message_id": 1,
+        "date": 0,
+        "chat": {"id": -100123, "type": "supergroup", "title": "bench"},
+        "from": {"id": 42, "is_bot": False, "first_name": "bench"},
+        "text": "/start",
+    },
+}
+
+
+class FakeApplication:
+    """بديل Application: طابور تحديثات ومعالجة تستغرق HANDLER_LATENCY"""
+
+    def __init__(self):
+        self.bot = None
+        self.update_queue: asyncio.Queue = asyncio.Queue()
+
+    async def process_update(self, update):
+        await asyncio.sleep(HANDLER_LATENCY)
+
+    async def consume(self):
+        while True:
+            await self.process_update(await self.update_queue.get())
+
+
+def start_flask(port: int):
+    flask_app = Flask(__name__)
+    fake = FakeApplication()
+
+    @flask_app.route("/webhook", methods=["POST"])
+    async def webhook_handler():
+        update = Update.de_json(request.get_json(force=True), fake.bot)
+        await fake.process_update(update)
+        return "", 200
+
+    thread = threading.Thread(
+        target=flask_app.run, kwargs={"host": "127.0.0.1", "port": port, "debug": False}, daemon=True
+    )
+    thread.start()
+
+
+def start_asgi(port: int, queued: bool = False):
+    async def run():
+        fake = FakeApplication()
+        if queued:
+            updates = UpdateQueue(fake, workers=8)
+            updates.start()
+        else:
+            updates = None
+            consumer = asyncio.create_task(fake.consume())
+        config = uvicorn.Config(WebhookApp(fake, "/webhook", updates), host="127.0.0.1", port=port, log_level="warning")
+        await uvicorn.Server(config).serve()
+
+    # الخادم في خيط مستقل بحلقة أحداثه الخاصة كما في البوت الحقيقي، بعيداً عن حلقة العميل
+    thread = threading.Thread(target=asyncio.run, args=(run(),), daemon=True)
+    thread.start()
+
+
+async def measure(url: str, total: int, concurrency: int) -> list:
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    async with httpx.AsyncClient() as client:
+        # الانتظار حتى يبدأ الخادم
+        for _ in range(50):
+            try:
+                await client.post(url, json=UPDATE)
+                break
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+
+        async def one():
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post(url, json=UPDATE)
+                latencies.append(time.perf_counter() - start)
+                response.raise_for_status()
+
+        await asyncio.gather(*(one() for _ in range(total)))
+    return latencies
+
+
+def report(name: str, latencies: list, elapsed: float):
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(
+        f"{name:>6}: {len(latencies) / elapsed:8.1f} req/s  "
+        f"p50 {statistics.median(latencies) * 1000:7.2f}ms  p95 {p95 * 1000:7.2f}ms"
+    )
+
+
+async def main(total: int, concurrency: int):
+    if Flask is not None:
+        start_flask(18081)
+        start = time.perf_counter()
+        flask_latencies = await measure("http://127.0.0.1:18081/webhook", total, concurrency)
+        report("flask", flask_latencies, time.perf_counter() - start)
+    else:
+        print(" flask: skipped (flask is not installed)")
+
+    start_asgi(18082)
+    start = time.perf_counter()
+    asgi_latencies = await measure("http://127.0.0.1:18082/webhook", total, concurrency)
+    report("asgi", asgi_latencies, time.perf_counter() - start)
+
+    start_asgi(18083, queued=True)
+    start = time.perf_counter()
+    queued_latencies = await measure("http://127.0.0.1:18083/webhook", total, concurrency)
+    report("queued", queued_latencies, time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    asyncio.run(main(total, concurrency))
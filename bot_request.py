@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+اتصالات HTTP إلى Telegram Bot API
+HTTPXRequest بإعدادات قابلة للضبط (حجم المجمع، مدة بقاء الاتصال، HTTP/2، مهلة لكل طريقة)،
+مع قياس زمن انتظار مكان في مجمع الاتصالات
+"""
+
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Optional
+
+import httpx
+from telegram.error import TimedOut
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+
+def parse_method_timeouts(spec: str) -> Dict[str, float]:
+    """"sendPhoto=20,banChatMember=10" -> {"sendPhoto": 20.0, "banChatMember": 10.0}"""
+    timeouts = {}
+    for item in filter(None, (part.strip() for part in (spec or "").split(","))):
+        method, _, seconds = item.partition("=")
+        timeouts[method.strip()] = float(seconds)
+    return timeouts
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest يقيس انتظار مكان في المجمع ويطبق مهلة قراءة/كتابة خاصة ببعض الطرق"""
+
+    def __init__(self, connection_pool_size: int = 256, keepalive_expiry: float = 30.0,
+                 method_timeouts: Dict[str, float] = None, pool_timeout: Optional[float] = 1.0, **kwargs):
+        super().__init__(
+            connection_pool_size=connection_pool_size,
+            pool_timeout=pool_timeout,
+            httpx_kwargs={"limits": httpx.Limits(
+                max_connections=connection_pool_size,
+                max_keepalive_connections=connection_pool_size,
+                keepalive_expiry=keepalive_expiry,
+            )},
+            **kwargs,
+        )
+        self._pool_size = connection_pool_size
+        self._pool_timeout = pool_timeout
+        self._method_timeouts = method_timeouts or {}
+        # عدد الطلبات الجارية لا يتجاوز حجم المجمع، فالانتظار هنا هو انتظار المجمع نفسه (ويُقاس)
+        self._slots = asyncio.Semaphore(connection_pool_size)
+        self.requests = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.waited = 0
+        self.wait_seconds = 0.0
+        self.max_wait = 0.0
+        self.pool_timeouts = 0
+
+    async def do_request(self, url, method, request_data=None, read_timeout=HTTPXRequest.DEFAULT_NONE,
+                         write_timeout=HTTPXRequest.DEFAULT_NONE, connect_timeout=HTTPXRequest.DEFAULT_NONE,
+                         pool_timeout=HTTPXRequest.DEFAULT_NONE):
+        timeout = self._method_timeouts.get(url.rsplit("/", 1)[-1])
+        if timeout is not None:
+            if read_timeout is self.DEFAULT_NONE:
+                read_timeout = timeout
+            if write_timeout is self.DEFAULT_NONE:
+                write_timeout = timeout
+        if pool_timeout is self.DEFAULT_NONE:
+            pool_timeout = self._pool_timeout
+
+        self.requests += 1
+        if self._slots.locked():
+            started = time.perf_counter()
+            try:
+                await asyncio.wait_for(self._slots.acquire(), pool_timeout)
+            except asyncio.TimeoutError:
+                self.pool_timeouts += 1
+                raise TimedOut(
+                    "Pool timeout: All connections in the connection pool are occupied. "
+                    "Request was *not* sent to Telegram."
+                ) from None
+            wait = time.perf_counter() - started
+            self.waited += 1
+            self.wait_seconds += wait
+            self.max_wait = max(self.max_wait, wait)
+        else:
+            await self._slots.acquire()
+
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            return await super().do_request(
+                url, method, request_data, read_timeout, write_timeout, connect_timeout, pool_timeout
+            )
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+    def snapshot(self) -> dict:
+        return {
+            "pool_size": self._pool_size,
+            "requests": self.requests,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "waited": self.waited,
+            "avg_wait_ms": self.wait_seconds / self.waited * 1000 if self.waited else 0.0,
+            "max_wait_ms": self.max_wait * 1000,
+            "pool_timeouts": self.pool_timeouts,
+        }
+
+
+def request_from_env(prefix: str, pool_size: int, read_timeout: float) -> InstrumentedRequest:
+    """InstrumentedRequest من متغيرات البيئة {prefix}_POOL_SIZE و {prefix}_KEEPALIVE و {prefix}_HTTP2
+    و {prefix}_CONNECT_TIMEOUT و {prefix}_READ_TIMEOUT و {prefix}_WRITE_TIMEOUT و {prefix}_POOL_TIMEOUT
+    و {prefix}_METHOD_TIMEOUTS ("sendPhoto=20,banChatMember=10")"""
+    def setting(name, default):
+        return os.environ.get(f"{prefix}_{name}", default)
+
+    http_version = "2" if setting("HTTP2", "0").lower() in ("1", "true", "yes") else "1.1"
+    if http_version == "2":
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logger.warning(f"{prefix}_HTTP2 is set but h2 is not installed; using HTTP/1.1.")
+            http_version = "1.1"
+    return InstrumentedRequest(
+        connection_pool_size=int(setting("POOL_SIZE", pool_size)),
+        keepalive_expiry=float(setting("KEEPALIVE", 30)),
+        method_timeouts=parse_method_timeouts(setting("METHOD_TIMEOUTS", "")),
+        http_version=http_version,
+        connect_timeout=float(setting("CONNECT_TIMEOUT", 5)),
+        read_timeout=float(setting("READ_TIMEOUT", read_timeout)),
+        write_timeout=float(setting("WRITE_TIMEOUT", 5)),
+        pool_timeout=float(setting("POOL_TIMEOUT", 1)),
+    )
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+"""
+محرك الرسائل الإذاعية
+مجموعة عمال محدودة يحكمها دلو رموز عام وآخر لكل محادثة حسب حدود Telegram
+"""
+
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Iterable, List
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+from rate_limit import TokenBucket, retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+# أخطاء BadRequest التي تعني أن الهدف لن يستقبل رسائل مستقبلاً
+PERMANENT_ERRORS = (
+    "chat not found",
+    "user is deactivated",
+    "peer_id_invalid",
+    "bot was blocked",
+    "bot was kicked",
+    "have no rights to send",
+)
+
+SENT, FAILED, UNREACHABLE = "sent", "failed", "unreachable"
+
+
+def is_permanent_failure(error: Exception) -> bool:
+    """هل يعني الخطأ أن الهدف يجب حذفه من الإذاعات القادمة؟"""
+    if isinstance(error, Forbidden):
+        return True
+    if isinstance(error, BadRequest):
+        message = error.message.lower()
+        return any(marker in message for marker in PERMANENT_ERRORS)
+    return False
+
+
+class BroadcastEngine:
+    """إرسال رسالة إلى عدد كبير من المحادثات بالتوازي ضمن حدود Telegram"""
+
+    def __init__(self, global_rate: float = 25.0, workers: int = 8, max_retries: int = 3,
+                 private_rate: float = 1.0, group_rate: float = 20 / 60):
+        self._max_rate = global_rate
+        self._global = TokenBucket(global_rate)
+        self._workers = workers
+        self._max_retries = max_retries
+        self._private_rate = private_rate
+        self._group_rate = group_rate
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            # المعرفات السالبة مجموعات (20 رسالة في الدقيقة)، والموجبة محادثات خاصة (رسالة في الثانية)
+            rate = self._group_rate if chat_id < 0 else self._private_rate
+            bucket = self._chat_buckets[chat_id] = TokenBucket(rate, capacity=1)
+        return bucket
+
+    def _slow_down(self, seconds: float):
+        # تخفيض ضربي للمعدل بعد كل RetryAfter، ثم زيادة تدريجية مع كل إرسال ناجح
+        self._global.pause(seconds)
+        self._global.rate = max(1.0, self._global.rate / 2)
+
+    def _speed_up(self):
+        if self._global.rate < self._max_rate:
+            self._global.rate = min(self._max_rate, self._global.rate + 0.1)
+
+    async def send(self, bot, chat_id: int, text: str) -> str:
+        """إرسال رسالة واحدة مع إعادة المحاولة؛ تُرجع SENT أو FAILED أو UNREACHABLE"""
+        for attempt in range(self._max_retries + 1):
+            await self._global.acquire()
+            await self._chat_bucket(chat_id).acquire()
+            try:
+                # طلبات الإذاعة تأخذ من حد المجدول العام ما تتركه طلبات الحماية
+                await bot.send_message(chat_id, text, rate_limit_args={"bulk": True})
+                self._speed_up()
+                return SENT
+            except RetryAfter as e:
+                seconds = retry_after_seconds(e)
+                logger.warning(f"Flood control during broadcast, pausing for {seconds}s.")
+                self._slow_down(seconds)
+            except (Forbidden, BadRequest) as e:
+                if is_permanent_failure(e):
+                    return UNREACHABLE
+                logger.error(f"خطأ في إرسال رسالة إذاعية إلى {chat_id}: {e}")
+                return FAILED
+            except NetworkError as e:
+                logger.warning(f"Network error broadcasting to {chat_id} (attempt {attempt + 1}): {e}")
+                await asyncio.sleep(min(2 ** attempt, 30))
+            except Exception as e:
+                logger.error(f"خطأ في إرسال رسالة إذاعية إلى {chat_id}: {e}")
+                return FAILED
+        return FAILED
+
+    async def run(self, bot, targets: Iterable[int], text: str) -> dict:
+        """إرسال text إلى جميع الأهداف؛ تُرجع عدد الناجحة والفاشلة وقائمة الأهداف غير الصالحة"""
+        result = {"total": 0, SENT: 0, FAILED: 0, UNREACHABLE: []}
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self._workers * 4)
+
+        async def produce():
+            for chat_id in targets:
+                result["total"] += 1
+                await queue.put(chat_id)
+            for _ in range(self._workers):
+                await queue.put(None)
+
+        async def work():
+            while True:
+                chat_id = await queue.get()
+                if chat_id is None:
+                    return
+                outcome = await self.send(bot, chat_id, text)
+                if outcome == UNREACHABLE:
+                    result[UNREACHABLE].append(chat_id)
+                else:
+                    result[outcome] += 1
+
+        await asyncio.gather(produce(), *(work() for _ in range(self._workers)))
+        self._chat_buckets.clear()
+        return result
+
+
+class BroadcastJobs:
+    """مهام إذاعة دائمة في broadcast_jobs: الأهداف تُقرأ على دفعات ويُحفظ آخر معرف بعد كل دفعة لاستئنافها"""
+
+    # kind -> (المجموعة، حقل المعرف، شرط الاستهداف)
+    TARGETS = {
+        "users": ("users", "user_id", {"unreachable": {"$ne": True}}),
+        "chats": ("chats", "chat_id", {"protection_enabled": True, "unreachable": {"$ne": True}}),
+    }
+
+    def __init__(self, repository, engine: BroadcastEngine, batch_size: int = 500, upserters: dict = None):
+        self._repository = repository
+        self._engine = engine
+        self._batch_size = batch_size
+        # المجموعة -> CoalescingUpserter الخاص بها، لإسقاط القيم المعروفة لمن صار غير متاح
+        self._upserters = upserters or {}
+        self._tasks: Dict[object, asyncio.Task] = {}
+
+    async def ensure_indexes(self):
+        """فهارس المعرفات التي تُقرأ الأهداف بترتيبها"""
+        def create(db):
+            for collection, key_field, _ in self.TARGETS.values():
+                db[collection].create_index(key_field)
+            db.broadcast_jobs.create_index("status")
+        await self._repository.run("broadcast_jobs.create_index", create)
+
+    async def start(self, bot, kind: str, text: str, requested_by: int):
+        """إنشاء مهمة إذاعة جديدة وتشغيلها في الخلفية؛ تُرجع معرف المهمة"""
+        job = {
+            "kind": kind,
+            "text": text,
+            "requested_by": requested_by,
+            "status": "running",
+            "last_id": None,
+            SENT: 0,
+            FAILED: 0,
+            UNREACHABLE: 0,
+            "created_at": datetime.now(),
+            "updated_at": datetime.now(),
+        }
+        job_id = await self._repository.run("broadcast_jobs.insert_one", lambda db: db.broadcast_jobs.insert_one(job).inserted_id)
+        if job_id is None:
+            return None
+        job["_id"] = job_id
+        self._spawn(bot, job)
+        return job_id
+
+    async def resume_all(self, bot):
+        """استئناف المهام التي لم تكتمل قبل إعادة التشغيل من آخر نقطة حفظ"""
+        jobs = await self._repository.run(
+            "broadcast_jobs.find", lambda db: list(db.broadcast_jobs.find({"status": "running"})), default=[]
+        )
+        for job in jobs:
+            if job["_id"] not in self._tasks:
+                logger.info(f"Resuming broadcast job {job['_id']} after {job.get('last_id')}.")
+                self._spawn(bot, job)
+
+    async def recent(self, limit: int = 5) -> List[dict]:
+        """آخر المهام مع تقدمها"""
+        return await self._repository.run(
+            "broadcast_jobs.find",
+            lambda db: list(db.broadcast_jobs.find({}, {"text": 0}).sort("created_at", -1).limit(limit)),
+            default=[],
+        )
+
+    def _spawn(self, bot, job: dict):
+        job_id = job["_id"]
+        task = asyncio.create_task(self._run(bot, job))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+
+    async def _next_batch(self, job: dict):
+        collection, key_field, query = self.TARGETS[job["kind"]]
+        query = dict(query)
+        if job.get("last_id") is not None:
+            query[key_field] = {"$gt": job["last_id"]}
+        return await self._repository.run(
+            f"{collection}.find",
+            lambda db: [doc[key_field] for doc in db[collection]
+                        .find(query, {key_field: 1, "_id": 0})
+                        .sort(key_field, 1)
+                        .limit(self._batch_size)],
+        )
+
+    async def _checkpoint(self, job: dict, fields: dict, counts: dict = None):
+        update = {"$set": dict(fields, updated_at=datetime.now())}
+        if counts:
+            update["$inc"] = counts
+        await self._repository.run(
+            "broadcast_jobs.update_one", lambda db: db.broadcast_jobs.update_one({"_id": job["_id"]}, update)
+        )
+
+    async def _run(self, bot, job: dict):
+        collection, key_field, _ = self.TARGETS[job["kind"]]
+        while True:
+            batch = await self._next_batch(job)
+            if batch is None:
+                # خطأ في قاعدة البيانات؛ المحاولة مجدداً دون فقدان التقدم
+                await asyncio.sleep(5)
+                continue
+            if not batch:
+                break
+
+            result = await self._engine.run(bot, batch, job["text"])
+            await self._repository.mark_unreachable(collection, key_field, result[UNREACHABLE])
+            upserter = self._upserters.get(collection)
+            if upserter is not None:
+                # أول تفاعل لاحق يُكتب كاملاً فيُعيد unreachable إلى False
+                upserter.forget(result[UNREACHABLE])
+            counts = {SENT: result[SENT], FAILED: result[FAILED], UNREACHABLE: len(result[UNREACHABLE])}
+            for name, count in counts.items():
+                job[name] += count
+            job["last_id"] = batch[-1]
+            await self._checkpoint(job, {"last_id": job["last_id"]}, counts)
+
+        job["status"] = "done"
+        await self._checkpoint(job, {"status": "done"})
+        try:
+            await bot.send_message(
+                job["requested_by"],
+                f"✅ اكتملت الإذاعة: تم الإرسال إلى {job[SENT]} هدف، "
+                f"فشل {job[FAILED]}، وتم استبعاد {job[UNREACHABLE]} هدف غير متاح.",
+            )
+        except Exception as e:
+            logger.error(f"Failed to report broadcast job {job['_id']} completion: {e}")
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+مخزون أسئلة كابتشا جاهزة
+الأسئلة وإجاباتها وخياراتها تُولّد على دفعات بعمليات مصفوفات NumPy، ويُعاد ملء المخزون في الخلفية
+فلا يكلف الانضمام سوى سحب سؤال جاهز
+"""
+
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# (نص السؤال، الإجابة الصحيحة، الخيارات الأربعة مرتبة عشوائياً)
+Captcha = Tuple[str, int, List[int]]
+
+MIN_OPERAND, MAX_OPERAND = 1, 10
+OPERATORS = ("+", "-", "×")
+OPTIONS_COUNT = 4
+# الإجابات الخاطئة تبعد عن الصحيحة بين 1 و 10 في أي اتجاه
+DISTRACTOR_OFFSETS = np.array([offset for offset in range(-10, 11) if offset != 0])
+
+_SPAN = MAX_OPERAND - MIN_OPERAND + 1
+# نص كل سؤال ممكن مفهرس بـ (العملية، العدد الأول، العدد الثاني)
+QUESTIONS = [
+    f"كم يساوي {num1} {operator} {num2}؟"
+    for operator in OPERATORS
+    for num1 in range(MIN_OPERAND, MAX_OPERAND + 1)
+    for num2 in range(MIN_OPERAND, MAX_OPERAND + 1)
+]
+
+
+def generate_batch(count: int, rng: np.random.Generator) -> List[Captcha]:
+    """توليد count سؤالاً دفعة واحدة دون حلقات إعادة محاولة"""
+    num1 = rng.integers(MIN_OPERAND, MAX_OPERAND + 1, count)
+    num2 = rng.integers(MIN_OPERAND, MAX_OPERAND + 1, count)
+    operation = rng.integers(0, len(OPERATORS), count)
+
+    # الطرح دائماً من العدد الأكبر حتى تبقى الإجابة موجبة
+    swap = (operation == 1) & (num1 < num2)
+    num1, num2 = np.where(swap, num2, num1), np.where(swap, num1, num2)
+    answers = np.select([operation == 0, operation == 1], [num1 + num2, num1 - num2], num1 * num2)
+
+    # ترتيب عشوائي للإزاحات في كل صف، مع تأخير ما يعطي إجابة سالبة؛ الإزاحات الموجبة وحدها عشر فتكفي دائماً
+    candidates = answers[:, None] + DISTRACTOR_OFFSETS
+    keys = rng.random(candidates.shape) + (candidates < 0)
+    picked = np.argsort(keys, axis=1)[:, : OPTIONS_COUNT - 1]
+    options = np.column_stack([answers, np.take_along_axis(candidates, picked, axis=1)])
+    # موضع عشوائي للإجابة الصحيحة
+    options = np.take_along_axis(options, np.argsort(rng.random(options.shape), axis=1), axis=1)
+
+    question_index = (operation * _SPAN + (num1 - MIN_OPERAND)) * _SPAN + (num2 - MIN_OPERAND)
+    return [
+        (QUESTIONS[index], answer, row)
+        for index, answer, row in zip(question_index.tolist(), answers.tolist(), options.tolist())
+    ]
+
+
+class CaptchaPool:
+    """مخزون أسئلة جاهزة يُعاد ملؤه بدفعات batch_size عند نزوله تحت low_watermark"""
+
+    def __init__(self, batch_size: int = 1024, low_watermark: int = 256, seed: int = None):
+        self._batch_size = batch_size
+        self._low_watermark = low_watermark
+        self._rng = np.random.default_rng(seed)
+        # مولد NumPy غير آمن بين الخيوط: التوليد في الخلفية والتوليد الفوري عند نفاد المخزون يتناوبان عليه
+        self._rng_lock = threading.Lock()
+        self._ready: deque = deque()
+        self._refill_scheduled = False
+        self.generated = 0
+
+    def __len__(self) -> int:
+        return len(self._ready)
+
+    def pop(self) -> Captcha:
+        """سحب سؤال جاهز؛ يُولّد دفعة فوراً فقط إذا نفد المخزون"""
+        if not self._ready:
+            self.refill()
+        captcha = self._ready.popleft()
+        if len(self._ready) < self._low_watermark and not self._refill_scheduled:
+            self._schedule_refill()
+        return captcha
+
+    def refill(self):
+        """توليد دفعة جديدة وإضافتها إلى المخزون"""
+        self._add(self._generate())
+
+    def _generate(self) -> List[Captcha]:
+        with self._rng_lock:
+            return generate_batch(self._batch_size, self._rng)
+
+    def _add(self, batch: List[Captcha]):
+        self._ready.extend(batch)
+        self.generated += len(batch)
+
+    def _schedule_refill(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.refill()
+            return
+        # التوليد في خيط من مجمع الحلقة حتى لا يحجب معالجة التحديثات، ودفعة واحدة فقط في كل مرة
+        self._refill_scheduled = True
+        loop.run_in_executor(None, self._generate).add_done_callback(self._refilled)
+
+    def _refilled(self, future: asyncio.Future):
+        self._refill_scheduled = False
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            logger.error(f"Captcha pool refill failed: {future.exception()}")
+            return
+        self._add(future.result())
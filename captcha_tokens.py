@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+بيانات أزرار الكابتشا الموقعة (HMAC)
+كل زر يحمل المستخدم والمهلة وعدد المحاولات والخيار والتزاماً بالإجابة الصحيحة، فيمكن لأي نسخة من البوت
+التحقق من الإجابة دون الرجوع إلى pending_users أو أي حالة مشتركة
+"""
+
+import base64
+import hashlib
+import hmac
+import struct
+from typing import List, NamedTuple, Optional
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+PREFIX = "captcha_"
+# user_id, expires_at, attempts, option, commitment
+_BODY = struct.Struct(">qIBH8s")
+_CHAT = struct.Struct(">q")
+_COMMITMENT = struct.Struct(">qqIH")
+TAG_SIZE = 10
+# 33 بايت تصبح 44 حرفاً في base64 دون حشو، و 52 مع البادئة (حد Telegram هو 64 بايت)
+TOKEN_SIZE = _BODY.size + TAG_SIZE
+
+
+class CaptchaToken(NamedTuple):
+    user_id: int
+    expires_at: int
+    attempts: int
+    option: int
+    correct: bool
+
+
+def derive_secret(bot_token: str, secret: str = None) -> bytes:
+    """مفتاح التوقيع: CAPTCHA_SECRET إن وُجد، وإلا مشتق من توكن البوت (مشترك بين جميع النسخ)"""
+    if secret:
+        return secret.encode()
+    return hashlib.sha256(b"captcha-callback:" + (bot_token or "").encode()).digest()
+
+
+class CaptchaSigner:
+    """إصدار بيانات أزرار الكابتشا والتحقق منها"""
+
+    def __init__(self, secret: bytes):
+        self._secret = secret
+
+    def _mac(self, label: bytes, data: bytes, size: int) -> bytes:
+        return hmac.new(self._secret, label + data, hashlib.sha256).digest()[:size]
+
+    def _commitment(self, chat_id: int, user_id: int, expires_at: int, answer: int) -> bytes:
+        # الالتزام لا يكشف الإجابة دون المفتاح، فلا يمكن معرفة الزر الصحيح من بيانات الأزرار
+        return self._mac(b"answer", _COMMITMENT.pack(chat_id, user_id, expires_at, answer), 8)
+
+    def issue(self, chat_id: int, user_id: int, correct_answer: int, options: List[int],
+              expires_at: float, attempts: int = 0) -> List[str]:
+        """بيانات زر لكل خيار، بنفس ترتيب options"""
+        expires_at = int(expires_at)
+        commitment = self._commitment(chat_id, user_id, expires_at, correct_answer)
+        tokens = []
+        for option in options:
+            body = _BODY.pack(user_id, expires_at, attempts, option, commitment)
+            tag = self._mac(b"token", _CHAT.pack(chat_id) + body, TAG_SIZE)
+            tokens.append(PREFIX + base64.urlsafe_b64encode(body + tag).decode())
+        return tokens
+
+    def keyboard(self, chat_id: int, user_id: int, correct_answer: int, options: List[int],
+                 expires_at: float, attempts: int = 0) -> InlineKeyboardMarkup:
+        """لوحة أزرار الكابتشا الموقعة"""
+        tokens = self.issue(chat_id, user_id, correct_answer, options, expires_at, attempts)
+        return InlineKeyboardMarkup(
+            [[InlineKeyboardButton(str(option), callback_data=token)] for option, token in zip(options, tokens)]
+        )
+
+    def verify(self, chat_id: int, data: str) -> Optional[CaptchaToken]:
+        """فك بيانات الزر والتحقق من توقيعها؛ تُرجع None إذا كانت مزورة أو تالفة"""
+        if not data or not data.startswith(PREFIX):
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(data[len(PREFIX):])
+        except (ValueError, TypeError):
+            return None
+        if len(raw) != TOKEN_SIZE:
+            return None
+        body, tag = raw[:_BODY.size], raw[_BODY.size:]
+        if not hmac.compare_digest(tag, self._mac(b"token", _CHAT.pack(chat_id) + body, TAG_SIZE)):
+            return None
+        user_id, expires_at, attempts, option, commitment = _BODY.unpack(body)
+        correct = hmac.compare_digest(commitment, self._commitment(chat_id, user_id, expires_at, option))
+        return CaptchaToken(user_id, expires_at, attempts, option, correct)
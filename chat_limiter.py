@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+"""
+حد للعمليات المتزامنة لكل مجموعة
+يُستخدم لتوزيع العمل على أعضاء رسالة انضمام واحدة (تقييد + رسالة كابتشا لكل عضو) بالتوازي
+دون أن تستهلك مجموعة واحدة كل اتصالات Bot API، ويُحذف حد المجموعة عند انتهاء آخر عملية فيها
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, List
+
+
+class ChatLimiter:
+    """سيمافور لكل مجموعة يُنشأ عند الحاجة"""
+
+    def __init__(self, limit: int = 10):
+        self._limit = limit
+        # chat_id -> [السيمافور، عدد العمليات الجارية أو المنتظرة]
+        self._chats: Dict[int, List] = {}
+
+    @asynccontextmanager
+    async def slot(self, chat_id: int):
+        """حجز مكان من حد المجموعة طوال الكتلة"""
+        entry = self._chats.get(chat_id)
+        if entry is None:
+            entry = self._chats[chat_id] = [asyncio.Semaphore(self._limit), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chats[chat_id]
+
+    def __len__(self) -> int:
+        return len(self._chats)
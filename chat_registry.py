@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+سجل حالة الحماية للمجموعات
+يُحمّل دفعة واحدة عند بدء التشغيل، مع بحث كسول للمجموعات غير المعروفة وتخزين سلبي لنتائجها
+وفهرس المشرفين الذين فعّلوا الحماية، للإجابة عن /start وقوائم المشرفين دون استعلام
+"""
+
+import logging
+import time
+from array import array
+from bisect import bisect_left
+from typing import Dict, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class ChatRegistry:
+    """معرفات المجموعات المحمية في مصفوفة مرتبة مضغوطة (8 بايت لكل مجموعة) مع طبقة تغييرات صغيرة"""
+
+    def __init__(self, repository, negative_ttl: float = 600.0, max_overlay: int = 1024, max_negative: int = 50000):
+        self._repository = repository
+        self._negative_ttl = negative_ttl
+        self._max_overlay = max_overlay
+        self._max_negative = max_negative
+        # معرفات المجموعات المفعلة، مرتبة للبحث الثنائي
+        self._enabled = array("q")
+        # تغييرات منذ آخر دمج: chat_id -> مفعلة أم لا
+        self._overlay: Dict[int, bool] = {}
+        # مجموعات غير مفعلة أو غير موجودة في قاعدة البيانات: chat_id -> وقت انتهاء التخزين
+        self._negative: Dict[int, float] = {}
+        self._loading = False
+
+    async def warm_up(self):
+        """تحميل جميع المجموعات المفعلة دفعة واحدة في مصفوفة مرتبة"""
+        self._loading = True
+        try:
+            enabled = await self._repository.load_enabled_chats()
+        finally:
+            self._loading = False
+        if enabled is None:
+            logger.error("Failed to warm up chat registry; falling back to lazy lookups.")
+            return
+        self._enabled = enabled
+        # التغييرات التي وصلت أثناء التحميل أحدث من نتيجة الاستعلام
+        self._compact()
+        logger.info(f"Chat registry loaded {len(self._enabled)} protected chats.")
+
+    async def is_enabled(self, chat_id: int) -> bool:
+        """هل الحماية مفعلة في المجموعة؟"""
+        enabled = self._overlay.get(chat_id)
+        if enabled is not None:
+            return enabled
+        if self._in_base(chat_id):
+            return True
+
+        expires_at = self._negative.get(chat_id)
+        if expires_at is not None and expires_at > time.time():
+            return False
+
+        # بحث كسول لمجموعة واحدة (مثلاً فعّلتها نسخة أخرى من البوت بعد التحميل)
+        enabled = await self._repository.is_protection_enabled(chat_id)
+        if enabled is None:
+            # فشل الاستعلام ليس نتيجة سلبية: لا يُخزن، والانضمام التالي يعيد المحاولة
+            return False
+        if enabled:
+            self._set(chat_id, True)
+        else:
+            self._remember_negative(chat_id)
+        return enabled
+
+    def set_enabled(self, chat_id: int, enabled: bool):
+        """تسجيل تغيير حالة الحماية بعد تفعيلها أو تعطيلها"""
+        self._negative.pop(chat_id, None)
+        self._set(chat_id, enabled)
+
+    def _in_base(self, chat_id: int) -> bool:
+        i = bisect_left(self._enabled, chat_id)
+        return i < len(self._enabled) and self._enabled[i] == chat_id
+
+    def _set(self, chat_id: int, enabled: bool):
+        self._overlay[chat_id] = enabled
+        if len(self._overlay) >= self._max_overlay and not self._loading:
+            self._compact()
+
+    def _compact(self):
+        if not self._overlay:
+            return
+        ids = set(self._enabled)
+        for chat_id, enabled in self._overlay.items():
+            if enabled:
+                ids.add(chat_id)
+            else:
+                ids.discard(chat_id)
+        self._enabled = array("q", sorted(ids))
+        self._overlay.clear()
+
+    def _remember_negative(self, chat_id: int):
+        now = time.time()
+        if len(self._negative) >= self._max_negative:
+            self._negative = {key: expires_at for key, expires_at in self._negative.items() if expires_at > now}
+            if len(self._negative) >= self._max_negative:
+                self._negative.clear()
+        self._negative[chat_id] = now + self._negative_ttl
+
+
+class ActivatingAdminIndex:
+    """فهرس عكسي: معرف المشرف -> المجموعات المحمية التي فعّلها، يُحمّل عند بدء التشغيل ويُحدّث مع update_chat_info"""
+
+    def __init__(self, repository):
+        self._repository = repository
+        # admin_id -> المجموعات المحمية التي فعّلها
+        self._chats: Dict[int, Set[int]] = {}
+        # chat_id -> المشرف الذي فعّلها (للمجموعات المحمية فقط)
+        self._admin_of: Dict[int, int] = {}
+        self._loaded = False
+        # تغييرات وصلت أثناء التحميل، تُطبق فوق نتيجة الاستعلام
+        self._pending: Optional[List[tuple]] = None
+
+    async def warm_up(self):
+        """تحميل جميع أزواج (المجموعة، المشرف) للمجموعات المحمية في استعلام واحد"""
+        self._pending = []
+        try:
+            pairs = await self._repository.load_activating_admins()
+        finally:
+            pending, self._pending = self._pending, None
+        if pairs is None:
+            logger.error("Failed to load activating admins; falling back to database lookups.")
+            return
+        self._chats.clear()
+        self._admin_of.clear()
+        for chat_id, admin_id in pairs:
+            self._add(chat_id, admin_id)
+        for change in pending:
+            self.update(*change)
+        self._loaded = True
+        logger.info(f"Activating admin index loaded {len(self._admin_of)} chats for {len(self._chats)} admins.")
+
+    def update(self, chat_id: int, protection_enabled: bool = None, admin_id: int = None):
+        """تطبيق تغيير في db.chats (نفس حقول update_chat_info)"""
+        if self._pending is not None:
+            self._pending.append((chat_id, protection_enabled, admin_id))
+        if protection_enabled is False:
+            self._discard(chat_id)
+        elif admin_id is not None and (protection_enabled or chat_id in self._admin_of):
+            self._discard(chat_id)
+            self._add(chat_id, admin_id)
+
+    async def is_activating_admin(self, user_id: int) -> bool:
+        """هل فعّل المستخدم الحماية في مجموعة ما؟ من الذاكرة إن كان الفهرس محملاً"""
+        if self._loaded:
+            return user_id in self._chats
+        return await self._repository.is_activating_admin(user_id)
+
+    def chats_of(self, user_id: int) -> Set[int]:
+        """المجموعات المحمية التي فعّلها المستخدم"""
+        return set(self._chats.get(user_id, ()))
+
+    def _add(self, chat_id: int, admin_id: int):
+        self._admin_of[chat_id] = admin_id
+        self._chats.setdefault(admin_id, set()).add(chat_id)
+
+    def _discard(self, chat_id: int):
+        admin_id = self._admin_of.pop(chat_id, None)
+        if admin_id is None:
+            return
+        chats = self._chats[admin_id]
+        chats.discard(chat_id)
+        if not chats:
+            del self._chats[admin_id]
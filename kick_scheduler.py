@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+مجدول مواعيد طرد الأعضاء الذين لم يحلوا الكابتشا
+مهمة واحدة تدير جميع المهل بدلاً من مهمة asyncio لكل عضو جديد
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# (deadline, chat_id, user_id, message_id)
+KickEntry = Tuple[float, int, int, int]
+
+
+class DeadlineScheduler:
+    """كومة (heap) مواعيد يقودها حلقة واحدة، مع إلغاء O(1) للعضو و O(أعضاء المجموعة) للمجموعة وإطلاق المهل على دفعات"""
+
+    def __init__(self, on_expire: Callable[[List[KickEntry]], Awaitable[None]], max_batch: int = 100,
+                 max_in_flight: int = 4):
+        self._on_expire = on_expire
+        self._max_batch = max_batch
+        self._max_in_flight = max_in_flight
+        # عناصر الكومة: (deadline, seq, chat_id, user_id, message_id)
+        self._heap: List[Tuple[float, int, int, int, int]] = []
+        # chat_id -> user_id -> رقم التسلسل الصالح؛ الإلغاء يحذف المفتاح فقط وتُهمل العناصر القديمة عند سحبها
+        self._live: Dict[int, Dict[int, int]] = {}
+        self._count = 0
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        # الدفعات الجارية: دفعة بطيئة (طلبات API متأخرة) لا تؤخر سحب الدفعات المستحقة بعدها
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._batches: Set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, key: Tuple[int, int]) -> bool:
+        chat = self._live.get(key[0])
+        return chat is not None and key[1] in chat
+
+    @property
+    def in_flight(self) -> int:
+        """عدد دفعات الطرد الجارية"""
+        return len(self._batches)
+
+    def pending_in(self, chat_id: int) -> int:
+        """عدد مواعيد الطرد القائمة في المجموعة"""
+        return len(self._live.get(chat_id, ()))
+
+    def schedule(self, chat_id: int, user_id: int, message_id: int, delay: float = None, deadline: float = None):
+        """جدولة طرد العضو بعد delay ثانية (أو عند الوقت المطلق deadline)"""
+        if deadline is None:
+            deadline = time.time() + delay
+        seq = next(self._seq)
+        chat = self._live.get(chat_id)
+        if chat is None:
+            chat = self._live[chat_id] = {}
+        if user_id not in chat:
+            self._count += 1
+        chat[user_id] = seq
+        earliest = not self._heap or deadline < self._heap[0][0]
+        heapq.heappush(self._heap, (deadline, seq, chat_id, user_id, message_id))
+        self._ensure_running()
+        if earliest:
+            self._wakeup.set()
+
+    def cancel(self, chat_id: int, user_id: int) -> bool:
+        """إلغاء موعد الطرد للعضو، يعيد True إذا كان هناك موعد قائم"""
+        chat = self._live.get(chat_id)
+        if chat is None or chat.pop(user_id, None) is None:
+            return False
+        if not chat:
+            del self._live[chat_id]
+        self._count -= 1
+        self._maybe_compact()
+        return True
+
+    def cancel_chat(self, chat_id: int) -> int:
+        """إلغاء جميع مواعيد الطرد في المجموعة"""
+        chat = self._live.pop(chat_id, None)
+        if chat is None:
+            return 0
+        self._count -= len(chat)
+        self._maybe_compact()
+        return len(chat)
+
+    def start(self):
+        """تشغيل حلقة المجدول في حلقة الأحداث الحالية"""
+        self._ensure_running()
+
+    async def stop(self):
+        """إيقاف حلقة المجدول وانتظار الدفعات الجارية (المواعيد القائمة تبقى في الذاكرة)"""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        self._task = None
+        if self._batches:
+            await asyncio.gather(*self._batches, return_exceptions=True)
+
+    def _ensure_running(self):
+        loop = asyncio.get_running_loop()
+        # قد تكون المهمة السابقة مرتبطة بحلقة أحداث أُغلقت، فنعيد إنشاءها في الحلقة الحالية
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._wakeup = asyncio.Event()
+            self._slots = asyncio.Semaphore(self._max_in_flight)
+            self._task = loop.create_task(self._run())
+
+    def _is_live(self, seq: int, chat_id: int, user_id: int) -> bool:
+        chat = self._live.get(chat_id)
+        return chat is not None and chat.get(user_id) == seq
+
+    def _maybe_compact(self):
+        # إزالة العناصر الملغاة عندما تصبح أغلب الكومة عناصر ميتة (كلفة موزعة على الإلغاءات)
+        if len(self._heap) > 64 and len(self._heap) > 2 * self._count:
+            self._heap = [item for item in self._heap if self._is_live(item[1], item[2], item[3])]
+            heapq.heapify(self._heap)
+
+    def _pop_due(self, now: float) -> List[KickEntry]:
+        batch = []
+        while self._heap and self._heap[0][0] <= now and len(batch) < self._max_batch:
+            deadline, seq, chat_id, user_id, message_id = heapq.heappop(self._heap)
+            if not self._is_live(seq, chat_id, user_id):
+                continue
+            chat = self._live[chat_id]
+            del chat[user_id]
+            if not chat:
+                del self._live[chat_id]
+            self._count -= 1
+            batch.append((deadline, chat_id, user_id, message_id))
+        return batch
+
+    async def _expire(self, batch: List[KickEntry], slots: asyncio.Semaphore):
+        try:
+            await self._on_expire(batch)
+        except Exception as e:
+            logger.error(f"خطأ في معالجة دفعة مواعيد الطرد: {e}")
+        finally:
+            slots.release()
+
+    async def _run(self):
+        while True:
+            # الانتظار هنا فقط عندما تكون max_in_flight دفعة جارية، ثم يُسحب من الكومة ما استحق حتى الآن
+            await self._slots.acquire()
+            batch = self._pop_due(time.time())
+            if batch:
+                task = asyncio.create_task(self._expire(batch, self._slots))
+                self._batches.add(task)
+                task.add_done_callback(self._batches.discard)
+                continue
+            self._slots.release()
+
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
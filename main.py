@@ -9,18 +9,35 @@
 import re
 import logging
 import asyncio
-import random
 import fcntl
-from datetime import datetime, timedelta
+import multiprocessing
+import signal
 from typing import Dict, Set
 import telegram
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ChatMember
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ChatMemberHandler, filters, ContextTypes
-from flask import Flask, request
 import threading
 import time
 import json
 
+from admin_roster import AdminRoster
+from bot_request import InstrumentedRequest, request_from_env
+from broadcast import BroadcastEngine, BroadcastJobs
+from captcha_pool import CaptchaPool
+from captcha_tokens import CaptchaSigner, CaptchaToken, derive_secret
+from chat_limiter import ChatLimiter
+from chat_registry import ActivatingAdminIndex, ChatRegistry
+from kick_scheduler import DeadlineScheduler
+from outbound import OutboundScheduler
+from pending_record import PendingRecord
+from pending_store import PendingCaptchaStore
+from raid_guard import COHORT_KEY, RaidGuard
+from sharding import ShardRouter
+from state_backend import create_state_backend
+from storage import BotTotals, CaptchaCounters, CaptchaEventBuffer, CoalescingUpserter, MongoRepository
+from update_queue import UpdateQueue
+from webhook_server import WebhookApp, serve
+
 # MongoDB imports
 from pymongo import MongoClient
 from pymongo.errors import ConnectionFailure
@@ -44,33 +61,86 @@ MONGO_URI = os.getenv("MONGO_URI")
 # معرفات المطورين (User IDs)
 DEVELOPER_IDS = [6714288409, 6459577996]
 
-# قاموس لتخزين حالة الحماية لكل مجموعة (للتخزين المؤقت في الذاكرة)
-protection_enabled: Dict[int, bool] = {}
-
 # قاموس لتخزين الأعضاء الجدد الذين ينتظرون حل الكابتشا
-pending_users: Dict[int, Dict[int, dict]] = {}
-
-# قاموس لتخزين مهام الطرد المؤجلة
-kick_tasks: Dict[str, asyncio.Task] = {}
+pending_users: Dict[int, Dict[int, PendingRecord]] = {}
+
+# مهلة حل الكابتشا بالثواني
+CAPTCHA_TIMEOUT = 30 * 60
+# صلاحيات العضو بعد حل الكابتشا (أو بعد رفع تقييد لم يصل سؤاله)
+MEMBER_PERMISSIONS = telegram.ChatPermissions(
+    can_send_messages=True,
+    can_send_polls=True,
+    can_send_other_messages=True,
+    can_add_web_page_previews=True,
+    can_change_info=False,
+    can_invite_users=True,
+    can_pin_messages=False,
+)
 
 # MongoDB Client and Database
 client: MongoClient = None
 db = None
 
-# Flask app
-app = Flask(__name__)
+# جميع عمليات قاعدة البيانات تمر عبر مجمع خيوط محدود حتى لا تحجب حلقة الأحداث
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 8))
+repository = MongoRepository(lambda: db, max_workers=DB_POOL_SIZE)
 
-# Use PORT environment variable provided by Render, default to 8000
-PORT = int(os.environ.get("PORT", 8000))
-flask_start_time = time.time()
+# أحداث الكابتشا تُجمع في الذاكرة وتُكتب دفعة واحدة، مع تحديث العدادات بـ $inc
+captcha_counters = CaptchaCounters(repository)
+captcha_events = CaptchaEventBuffer(repository, captcha_counters)
 
-@app.route("/")
-def home():
-    uptime_minutes = (time.time() - flask_start_time) / 60
-    return f"Bot is running! Uptime: {uptime_minutes:.2f} minutes."
+# إجمالي المجموعات والمستخدمين، لقطة تُحدّث كل BOT_TOTALS_REFRESH ثانية
+bot_totals = BotTotals(repository, refresh_interval=float(os.environ.get("BOT_TOTALS_REFRESH", 300)))
 
-# Telegram Bot Application
-application: Application = None
+# تحديثات المستخدمين والمجموعات تُجمع وتُكتب دورياً؛ تحديث الطابع الزمني وحده يُهمل داخل هذه النافذة
+TOUCH_WINDOW_SECONDS = float(os.environ.get("TOUCH_WINDOW_SECONDS", 300))
+user_updates = CoalescingUpserter(repository, "users", "user_id", "last_interaction", touch_window=TOUCH_WINDOW_SECONDS)
+chat_updates = CoalescingUpserter(repository, "chats", "chat_id", "last_activity", touch_window=TOUCH_WINDOW_SECONDS)
+
+# حالة الحماية لكل مجموعة، تُحمّل من db.chats عند بدء التشغيل
+chat_registry = ChatRegistry(repository)
+
+# المشرف الذي فعّل الحماية -> مجموعاته، لـ /start وقوائم المشرفين دون استعلام
+activating_admins = ActivatingAdminIndex(repository)
+
+# مشرفو كل مجموعة من get_chat_administrators، تُلغى عند ترقية أو تنزيل مشرف وبعد ADMIN_CACHE_TTL ثانية
+admin_roster = AdminRoster(ttl=float(os.environ.get("ADMIN_CACHE_TTL", 600)))
+
+# الإذاعة: عمال متوازون ضمن حد Telegram العام (~30 رسالة في الثانية)
+broadcast_engine = BroadcastEngine(
+    global_rate=float(os.environ.get("BROADCAST_RATE", 25)),
+    workers=int(os.environ.get("BROADCAST_WORKERS", 8)),
+)
+# مهام الإذاعة تُحفظ في broadcast_jobs وتُستأنف بعد إعادة التشغيل
+broadcast_jobs = BroadcastJobs(repository, broadcast_engine, upserters={"users": user_updates, "chats": chat_updates})
+
+# كل طلبات البوت تمر بمجدول واحد: OUTBOUND_RATE طلب في الثانية للبوت كله (يُقسم على العمال)،
+# و OUTBOUND_GROUP_RATE رسالة في الدقيقة لكل مجموعة، مع إعادة المحاولة بعد RetryAfter وأخطاء الشبكة
+OUTBOUND_RATE = float(os.environ.get("OUTBOUND_RATE", 30))
+OUTBOUND_GROUP_RATE = float(os.environ.get("OUTBOUND_GROUP_RATE", 20))
+OUTBOUND_MAX_RETRIES = int(os.environ.get("OUTBOUND_MAX_RETRIES", 3))
+outbound: OutboundScheduler = None
+
+# اتصالات Bot API: BOT_API_POOL_SIZE و BOT_API_KEEPALIVE و BOT_API_HTTP2 ومهل BOT_API_*_TIMEOUT و BOT_API_METHOD_TIMEOUTS،
+# وبنفس الأسماء مع GET_UPDATES_ لطلبات getUpdates
+bot_request: InstrumentedRequest = None
+
+# تحديثات الويب هوك: طابور محدود يفرغه عمال، والرد على Telegram لا ينتظر المعالجة
+# المحادثات المختلفة تُعالج بالتوازي، وتحديثات المحادثة الواحدة بترتيب وصولها
+UPDATE_WORKERS = int(os.environ.get("UPDATE_WORKERS", 32))
+UPDATE_QUEUE_SIZE = int(os.environ.get("UPDATE_QUEUE_SIZE", 10000))
+UPDATE_QUEUE_OVERFLOW = os.environ.get("UPDATE_QUEUE_OVERFLOW", "reject")
+update_queue: UpdateQueue = None
+
+# BOT_WORKERS > 1: عملية استقبال للويب هوك وعمال منفصلون، كل مجموعة يعالجها عامل واحد (abs(chat_id) % BOT_WORKERS)
+BOT_WORKERS = int(os.environ.get("BOT_WORKERS", 1))
+# طابور كل عامل بين عملية الاستقبال والعامل
+SHARD_QUEUE_SIZE = int(os.environ.get("SHARD_QUEUE_SIZE", 10000))
+# رقم العامل الحالي وعدد العمال (0 و 1 في وضع العملية الواحدة)
+SHARD, SHARDS = 0, 1
+
+# Use PORT environment variable provided by Render, default to 8000
+PORT = int(os.environ.get("PORT", 8000))
 
 def init_mongodb():
     global client, db
@@ -85,140 +155,48 @@ def init_mongodb():
 
 async def log_captcha_event(user_id: int, chat_id: int, status: str):
     """تسجيل حدث كابتشا في قاعدة البيانات"""
-    if db is not None:
-        db.captcha_stats.insert_one({
-            "user_id": user_id,
-            "chat_id": chat_id,
-            "status": status,
-            "timestamp": datetime.now()
-        })
+    captcha_events.add(user_id, chat_id, status)
 
 async def update_user_info(user_id: int, username: str = None, first_name: str = None):
     """تحديث معلومات المستخدم في قاعدة البيانات"""
-    if db is not None:
-        db.users.update_one(
-            {"user_id": user_id},
-            {"$set": {
-                "username": username,
-                "first_name": first_name,
-                "last_interaction": datetime.now()
-            }},
-            upsert=True
-        )
+    # تفاعل المستخدم مع البوت يعني أنه لم يعد يحظره
+    user_updates.update(user_id, {"username": username, "first_name": first_name, "unreachable": False})
 
 async def update_chat_info(chat_id: int, chat_title: str = None, protection_enabled_status: bool = None, admin_id: int = None):
     """تحديث معلومات المجموعة في قاعدة البيانات"""
-    if db is not None:
-        update_data = {"chat_title": chat_title, "last_activity": datetime.now()}
-        if protection_enabled_status is not None:
-            update_data["protection_enabled"] = protection_enabled_status
-        if admin_id is not None:
-            update_data["activating_admin_id"] = admin_id
-
-        db.chats.update_one(
-            {"chat_id": chat_id},
-            {"$set": update_data},
-            upsert=True
-        )
+    fields = {}
+    if chat_title is not None:
+        fields["chat_title"] = chat_title
+    if protection_enabled_status is not None:
+        fields["protection_enabled"] = protection_enabled_status
+    if protection_enabled_status:
+        fields["unreachable"] = False
+    if admin_id is not None:
+        fields["activating_admin_id"] = admin_id
+    # تغييرات حالة الحماية تُكتب فوراً دون انتظار الدورة التالية
+    chat_updates.update(chat_id, fields, flush_now=protection_enabled_status is not None)
+    activating_admins.update(chat_id, protection_enabled_status, admin_id)
 
 async def get_stats(user_id: int = None, chat_id: int = None, hours: int = None):
     """الحصول على الإحصائيات"""
-    if db is not None:
-        query = {}
-        if chat_id:
-            query["chat_id"] = chat_id
-        if user_id:
-            query["user_id"] = user_id
-        if hours:
-            query["timestamp"] = {"$gte": datetime.now() - timedelta(hours=hours)}
-        
-        pipeline = [
-            {"$match": query},
-            {"$group": {"_id": "$status", "count": {"$sum": 1}}}
-        ]
-        results = list(db.captcha_stats.aggregate(pipeline))
-        
-        stats = {"success": 0, "kicked": 0, "timeout": 0}
-        for res in results:
-            stats[res["_id"]] = res["count"]
-        return stats
-    return {"success": 0, "kicked": 0, "timeout": 0}
+    if user_id or hours:
+        # العدادات لا تغطي التصفية حسب المستخدم أو المدة
+        return await repository.get_stats(user_id, chat_id, hours)
+    return await captcha_counters.get(chat_id)
 
 async def get_bot_stats():
     """الحصول على إحصائيات البوت العامة"""
-    if db is not None:
-        total_chats = db.chats.count_documents({})
-        total_users = db.users.count_documents({})
-        return {"total_chats": total_chats, "total_users": total_users}
-    return {"total_chats": 0, "total_users": 0}
-
-async def get_all_users():
-    """الحصول على جميع المستخدمين"""
-    if db is not None:
-        users = list(db.users.find({}, {"user_id": 1, "_id": 0}))
-        return [user["user_id"] for user in users]
-    return []
-
-async def get_all_chats():
-    """الحصول على جميع المجموعات التي تم تفعيل الحماية فيها"""
-    if db is not None:
-        chats = list(db.chats.find({"protection_enabled": True}, {"chat_id": 1, "_id": 0}))
-        return [chat["chat_id"] for chat in chats]
-    return []
+    return await bot_totals.get()
 
 async def is_activating_admin(user_id: int) -> bool:
     """التحقق مما إذا كان المستخدم هو المشرف الذي قام بتفعيل البوت في أي مجموعة"""
-    if db is not None:
-        count = db.chats.count_documents({"protection_enabled": True, "activating_admin_id": user_id})
-        return count > 0
-    return False
+    return await activating_admins.is_activating_admin(user_id)
 
-class CaptchaGenerator:
-    """مولد أسئلة الكابتشا"""
-    
-    @staticmethod
-    def generate_math_captcha():
-        """توليد سؤال رياضي بسيط"""
-        num1 = random.randint(1, 10)
-        num2 = random.randint(1, 10)
-        operation = random.choice(["+", "-", "*"])
-        
-        if operation == "+":
-            answer = num1 + num2
-            question = f"كم يساوي {num1} + {num2}؟"
-        elif operation == "-":
-            if num1 < num2:
-                num1, num2 = num2, num1
-            answer = num1 - num2
-            question = f"كم يساوي {num1} - {num2}؟"
-        else:  # multiplication
-            answer = num1 * num2
-            question = f"كم يساوي {num1} × {num2}؟"
-        
-        return question, answer
-    
-    @staticmethod
-    def generate_options(correct_answer):
-        """توليد خيارات متعددة للإجابة"""
-        options = [correct_answer]
-        
-        seen_options = {correct_answer}
-        while len(options) < 4:
-            wrong_answer = correct_answer + random.choice([-1, 1]) * random.randint(1, 10)
-            
-            if wrong_answer not in seen_options and wrong_answer >= 0:
-                options.append(wrong_answer)
-                seen_options.add(wrong_answer)
-            else:
-                for _ in range(10):
-                    wrong_answer = random.randint(max(0, correct_answer - 15), correct_answer + 15)
-                    if wrong_answer not in seen_options and wrong_answer >= 0:
-                        options.append(wrong_answer)
-                        seen_options.add(wrong_answer)
-                        break
-        
-        random.shuffle(options)
-        return options
+# أسئلة الكابتشا تُسحب جاهزة من مخزون يُولّد على دفعات ويُعاد ملؤه في الخلفية
+captcha_pool = CaptchaPool()
+
+# أزرار الكابتشا موقعة بمفتاح مشترك بين جميع نسخ البوت (CAPTCHA_SECRET أو مشتق من التوكن)
+captcha_signer = CaptchaSigner(derive_secret(BOT_TOKEN, os.environ.get("CAPTCHA_SECRET")))
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logger.info(f"start_command: Received /start command from user {update.effective_user.id} in chat type {update.effective_chat.type}")
@@ -265,8 +243,7 @@ async def enable_protection(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
     try:
-        member = await context.bot.get_chat_member(chat_id, user_id)
-        if member.status not in ["administrator", "creator"] and user_id not in DEVELOPER_IDS:
+        if user_id not in DEVELOPER_IDS and not await admin_roster.is_admin(context.bot, chat_id, user_id):
             await update.effective_chat.send_message("عذراً، يمكن للمشرفين أو المطورين فقط تفعيل نظام الحماية.")
             return
     except Exception as e:
@@ -274,7 +251,7 @@ async def enable_protection(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     await update_chat_info(chat_id, update.effective_chat.title, True, user_id)
-    protection_enabled[chat_id] = True
+    chat_registry.set_enabled(chat_id, True)
     await update.message.reply_text(
         "✅ تم تفعيل نظام الحماية بنجاح!\n"
         "سيتم الآن طلب حل كابتشا من جميع الأعضاء الجدد.\n"
@@ -287,8 +264,7 @@ async def disable_protection(update: Update, context: ContextTypes.DEFAULT_TYPE)
     user_id = update.effective_user.id
     
     try:
-        member = await context.bot.get_chat_member(chat_id, user_id)
-        if member.status not in ["administrator", "creator"] and user_id not in DEVELOPER_IDS:
+        if user_id not in DEVELOPER_IDS and not await admin_roster.is_admin(context.bot, chat_id, user_id):
             await update.effective_chat.send_message("عذراً، يمكن للمشرفين أو المطورين فقط إلغاء تفعيل نظام الحماية.")
             return
     except Exception as e:
@@ -296,18 +272,13 @@ async def disable_protection(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return
     
     await update_chat_info(chat_id, update.effective_chat.title, False, None)
-    protection_enabled[chat_id] = False
-    
-    tasks_to_cancel = []
-    for task_key, task in kick_tasks.items():
-        if task_key.startswith(f"{chat_id}_"):
-            tasks_to_cancel.append(task_key)
+    chat_registry.set_enabled(chat_id, False)
     
-    for task_key in tasks_to_cancel:
-        kick_tasks[task_key].cancel()
-        del kick_tasks[task_key]
+    kick_scheduler.cancel_chat(chat_id)
+    await raid_guard.release(context.bot, chat_id)
     
     if chat_id in pending_users:
+        pending_store.delete_chat(chat_id, pending_users[chat_id].keys())
         del pending_users[chat_id]
     
     await update.message.reply_text("❌ تم إلغاء تفعيل نظام الحماية.")
@@ -316,7 +287,7 @@ async def new_member_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
     """معالج الأعضاء الجدد"""
     chat_id = update.effective_chat.id
     
-    if not protection_enabled.get(chat_id, False):
+    if not await chat_registry.is_enabled(chat_id):
         return
     
     new_users_to_process = []
@@ -328,39 +299,42 @@ async def new_member_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if not new_users_to_process:
         return
     
-    for new_user in new_users_to_process:
-        user_id = new_user.id
-        
-        if new_user.is_bot:
-            continue
-        
-        question, correct_answer = CaptchaGenerator.generate_math_captcha()
-        options = CaptchaGenerator.generate_options(correct_answer)
-        
-        keyboard = []
-        for i, option in enumerate(options):
-            keyboard.append([InlineKeyboardButton(str(option), callback_data=f"captcha_{user_id}_{option}")])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        if chat_id not in pending_users:
-            pending_users[chat_id] = {}
-        
-        pending_users[chat_id][user_id] = {
-            "correct_answer": correct_answer,
-            "join_time": datetime.now(),
-            "username": new_user.username or new_user.first_name,
-            "wrong_attempts": 0
-        }
-        
-        try:
-            await context.bot.restrict_chat_member(
+    # موجة انضمام: قفل المجموعة مرة واحدة وسؤال مشترك بدلاً من تقييد ورسالة لكل عضو
+    humans = [user for user in new_users_to_process if not user.is_bot]
+    # إذا تعذر قفل المجموعة تُعالج الموجة عضواً عضواً
+    if humans and raid_guard.check(chat_id, len(humans)) and await raid_guard.admit(context.bot, chat_id, humans):
+        return
+    
+    # كل عضو يُعالج في مهمة مستقلة؛ فشل أحدهم لا يوقف الباقين ويُسجل باسمه
+    results = await asyncio.gather(
+        *(challenge_new_member(context.bot, chat_id, new_user) for new_user in humans), return_exceptions=True
+    )
+    failed = 0
+    for new_user, result in zip(humans, results):
+        if isinstance(result, Exception):
+            failed += 1
+            logger.error(f"خطأ في معالجة العضو الجديد {new_user.id} في {chat_id}: {result}")
+    if failed and len(humans) > 1:
+        logger.warning(f"Captcha fan-out in {chat_id}: {failed} of {len(humans)} new members failed.")
+
+async def challenge_new_member(bot, chat_id: int, new_user):
+    """تقييد العضو الجديد وإرسال سؤاله معاً، ضمن حد العمليات المتزامنة للمجموعة"""
+    user_id = new_user.id
+    question, correct_answer, options = captcha_pool.pop()
+    deadline = int(time.time()) + CAPTCHA_TIMEOUT
+    reply_markup = captcha_signer.keyboard(chat_id, user_id, correct_answer, options, deadline)
+    
+    record = pending_users.setdefault(chat_id, {})[user_id] = PendingRecord(new_user.username or new_user.first_name, deadline)
+    
+    async with new_member_limiter.slot(chat_id):
+        # الإجابة موقعة في الزر ولا تحتاج إلى التقييد، فيُرسلان معاً بدلاً من رحلتين متتاليتين
+        restricted, captcha_message = await asyncio.gather(
+            bot.restrict_chat_member(
                 chat_id=chat_id,
                 user_id=user_id,
                 permissions=telegram.ChatPermissions(can_send_messages=False)
-            )
-            
-            captcha_message = await context.bot.send_message(
+            ),
+            bot.send_message(
                 chat_id=chat_id,
                 text=f"مرحباً {new_user.mention_html()}!\n\n"
                      f"لضمان أنك لست بوت، يرجى حل هذا السؤال:\n\n"
@@ -368,95 +342,94 @@ async def new_member_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
                      f"⏰ لديك 30 دقيقة لحل السؤال، وإلا سيتم طردك تلقائياً.",
                 reply_markup=reply_markup,
                 parse_mode="HTML"
-            )
-            
-            pending_users[chat_id][user_id]["message_id"] = captcha_message.message_id
-            
-            task_key = f"{chat_id}_{user_id}"
-            kick_task = asyncio.create_task(
-                schedule_kick(context, chat_id, user_id, captcha_message.message_id)
-            )
-            kick_tasks[task_key] = kick_task
-            
-        except Exception as e:
-            logger.error(f"خطأ في معالجة العضو الجديد: {e}")
+            ),
+            return_exceptions=True,
+        )
+    
+    if isinstance(restricted, Exception) or isinstance(captcha_message, Exception):
+        if pending_users.get(chat_id, {}).get(user_id) is record:
+            forget_pending_captcha(chat_id, user_id)
+        # سؤال بلا تقييد لا معنى له
+        if not isinstance(captcha_message, Exception):
+            try:
+                await bot.delete_message(chat_id=chat_id, message_id=captcha_message.message_id)
+            except Exception as e:
+                logger.error(f"خطأ في حذف رسالة الكابتشا للمستخدم {user_id} من {chat_id}: {e}")
+        # وتقييد بلا سؤال يترك العضو صامتاً دون مهلة طرد ولا زر لحله، فيُرفع
+        elif not isinstance(restricted, Exception):
+            try:
+                await bot.restrict_chat_member(chat_id=chat_id, user_id=user_id, permissions=MEMBER_PERMISSIONS)
+            except Exception as e:
+                logger.error(f"خطأ في رفع تقييد المستخدم {user_id} في {chat_id} بعد فشل إرسال الكابتشا: {e}")
+        if isinstance(restricted, Exception):
+            raise restricted
+        raise captcha_message
+    
+    record.message_id = captcha_message.message_id
+    pending_store.save(chat_id, user_id, record.to_record())
+    
+    kick_scheduler.schedule(chat_id, user_id, captcha_message.message_id, deadline=deadline)
+
+def legacy_captcha_token(chat_id: int, data: str):
+    """أزرار captcha_{user_id}_{option} الصادرة قبل التوقيع، تُقبل حتى تنتهي مهلتها"""
+    match = re.fullmatch(r"captcha_(\d+)_(\d+)", data or "")
+    record = match and pending_users.get(chat_id, {}).get(int(match[1]))
+    if not record or record.correct_answer is None:
+        return None
+    option = int(match[2])
+    return CaptchaToken(int(match[1]), record.deadline, record.wrong_attempts, option, option == record.correct_answer)
 
 async def captcha_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """معالج إجابات الكابتشا"""
     query = update.callback_query
-    await query.answer()
-    
     chat_id = update.effective_chat.id
-    callback_data = query.data
-    
-    if not callback_data.startswith("captcha_"):
-        return
-    
-    parts = callback_data.split("_")
-    if len(parts) != 3:
-        return
-    
-    user_id = int(parts[1])
-    selected_answer = int(parts[2])
     
-    if chat_id not in pending_users or user_id not in pending_users[chat_id]:
+    # بيانات الزر موقعة وتحمل كل ما يلزم للتحقق، فلا حاجة إلى pending_users وتعمل الإجابة لدى أي نسخة من البوت
+    token = captcha_signer.verify(chat_id, query.data) or legacy_captcha_token(chat_id, query.data)
+    if token is None or token.expires_at <= time.time():
+        await query.answer()
         await query.edit_message_text("❌ انتهت صلاحية هذا السؤال.")
         return
     
+    user_id = token.user_id
     if query.from_user.id != user_id:
         await query.answer("❌ يمكنك فقط الإجابة على سؤالك الخاص!", show_alert=True)
         return
     
-    user_data = pending_users[chat_id][user_id]
-    correct_answer = user_data["correct_answer"]
-    
-    if selected_answer == correct_answer:
+    if token.correct:
+        await query.answer()
         try:
             await context.bot.restrict_chat_member(
                 chat_id=chat_id,
                 user_id=user_id,
-                permissions=telegram.ChatPermissions(
-                    can_send_messages=True,
-                    can_send_polls=True,
-                    can_send_other_messages=True,
-                    can_add_web_page_previews=True,
-                    can_change_info=False,
-                    can_invite_users=True,
-                    can_pin_messages=False,
-                )
+                permissions=MEMBER_PERMISSIONS,
             )
             
-            task_key = f"{chat_id}_{user_id}"
-            if task_key in kick_tasks:
-                kick_tasks[task_key].cancel()
-                del kick_tasks[task_key]
+            kick_scheduler.cancel(chat_id, user_id)
             await context.bot.send_message(chat_id, f"✅ أحسنت! {query.from_user.mention_html()} لقد أجبت بشكل صحيح. تم فك التقييد عنك.", parse_mode="HTML")
             await context.bot.delete_message(chat_id=chat_id, message_id=query.message.message_id)
             
-            del pending_users[chat_id][user_id]
+            forget_pending_captcha(chat_id, user_id)
             
             await log_captcha_event(user_id, chat_id, "success")
         except Exception as e:
             logger.error(f"خطأ في إلغاء تقييد المستخدم {user_id} من {chat_id} بعد حل الكابتشا: {e}")
     else:
-        user_data["wrong_attempts"] += 1
+        wrong_attempts = token.attempts + 1
         await query.answer("❌ إجابة خاطئة. حاول مرة أخرى.", show_alert=True)
         
-        if user_data["wrong_attempts"] >= 2:
-            logger.info(f"محاولة طرد المستخدم {user_id} من {chat_id} بعد {user_data["wrong_attempts"]} محاولات خاطئة.")
+        if wrong_attempts >= 2:
+            logger.info(f"محاولة طرد المستخدم {user_id} من {chat_id} بعد {wrong_attempts} محاولات خاطئة.")
             await context.bot.send_message(chat_id, f"❌ {query.from_user.mention_html()} لقد فشلت في حل الكابتشا بعد عدة محاولات. سيتم طردك.", parse_mode="HTML")
             await context.bot.delete_message(chat_id=chat_id, message_id=query.message.message_id)
+            kick_scheduler.cancel(chat_id, user_id)
             await kick_user(context, chat_id, user_id)
             await log_captcha_event(user_id, chat_id, "kicked")
-            del pending_users[chat_id][user_id]
+            forget_pending_captcha(chat_id, user_id)
         else:
-            # Regenerate options for the same question
-            question, correct_answer = CaptchaGenerator.generate_math_captcha()
-            options = CaptchaGenerator.generate_options(correct_answer)
-            keyboard = []
-            for i, option in enumerate(options):
-                keyboard.append([InlineKeyboardButton(str(option), callback_data=f"captcha_{user_id}_{option}")])
-            reply_markup = InlineKeyboardMarkup(keyboard)
+            # سؤال جديد بأزرار تحمل عدد المحاولات الجديد ونفس المهلة
+            question, correct_answer, options = captcha_pool.pop()
+            reply_markup = captcha_signer.keyboard(chat_id, user_id, correct_answer, options, token.expires_at, wrong_attempts)
             
             # Update the message with new options
             await query.edit_message_text(
@@ -467,23 +440,91 @@ async def captcha_callback_handler(update: Update, context: ContextTypes.DEFAULT
                 reply_markup=reply_markup,
                 parse_mode="HTML"
             )
-            # Update the correct answer in pending_users
-            pending_users[chat_id][user_id]["correct_answer"] = correct_answer
 
-async def schedule_kick(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_id: int, message_id: int):
-    """جدولة طرد المستخدم إذا لم يحل الكابتشا في الوقت المحدد"""
-    await asyncio.sleep(30 * 60)  # 30 دقيقة
-    
+def forget_pending_captcha(chat_id: int, user_id: int):
+    """حذف الكابتشا المعلقة من الذاكرة المحلية (إن كانت صادرة من هذه النسخة) ومن المخزن المشترك"""
+    chat_pending = pending_users.get(chat_id)
+    if chat_pending is not None:
+        chat_pending.pop(user_id, None)
+    pending_store.delete(chat_id, user_id)
+
+async def expire_captchas(batch):
+    """طرد دفعة من الأعضاء الذين انتهت مهلة الكابتشا الخاصة بهم"""
+    await asyncio.gather(*(
+        raid_guard.expire(application.bot, chat_id, message_id) if user_id == COHORT_KEY
+        else expire_captcha(chat_id, user_id, message_id)
+        for _, chat_id, user_id, message_id in batch
+    ))
+
+async def expire_captcha(chat_id: int, user_id: int, message_id: int):
+    """طرد المستخدم إذا لم يحل الكابتشا في الوقت المحدد"""
     if chat_id in pending_users and user_id in pending_users[chat_id]:
         try:
-            await context.bot.send_message(chat_id, f"⏰ انتهى الوقت! {pending_users[chat_id][user_id]['username']} لم يحل الكابتشا في الوقت المحدد. سيتم طرده.")
-            await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
-            await kick_user(context, chat_id, user_id)
+            # ربما حل العضو الكابتشا لدى نسخة أخرى من البوت؛ حالة التقييد في Telegram هي المرجع المشترك
+            member = await application.bot.get_chat_member(chat_id, user_id)
+            if member.status in (ChatMember.MEMBER, ChatMember.ADMINISTRATOR, ChatMember.OWNER) or (
+                member.status == ChatMember.RESTRICTED and member.can_send_messages
+            ):
+                forget_pending_captcha(chat_id, user_id)
+                return
+            
+            await application.bot.send_message(chat_id, f"⏰ انتهى الوقت! {pending_users[chat_id][user_id].username} لم يحل الكابتشا في الوقت المحدد. سيتم طرده.")
+            await application.bot.delete_message(chat_id=chat_id, message_id=message_id)
+            await kick_user(application, chat_id, user_id)
             await log_captcha_event(user_id, chat_id, "timeout")
             del pending_users[chat_id][user_id]
+            pending_store.delete(chat_id, user_id)
         except Exception as e:
             logger.error(f"خطأ في طرد المستخدم {user_id} من {chat_id} بعد انتهاء الوقت: {e}")
 
+# مجدول واحد لجميع مواعيد الطرد
+# حتى KICK_BATCH_CONCURRENCY دفعة طرد تُعالج معاً حتى لا تؤخر دفعة بطيئة المهل المستحقة بعدها
+kick_scheduler = DeadlineScheduler(expire_captchas, max_in_flight=int(os.environ.get("KICK_BATCH_CONCURRENCY", 4)))
+
+# حد عمليات تقييد/إرسال الكابتشا المتزامنة لكل مجموعة عند انضمام عدة أعضاء معاً
+new_member_limiter = ChatLimiter(int(os.environ.get("NEW_MEMBER_CONCURRENCY", 10)))
+
+# تخزين دائم للكابتشا المعلقة
+# STATE_BACKEND: mongodb (الافتراضي)، memory://، sqlite:///path أو redis://host:port/db
+pending_store = PendingCaptchaStore(create_state_backend(os.environ.get("STATE_BACKEND", "mongodb"), repository))
+
+# موجات الانضمام: فوق RAID_JOIN_THRESHOLD انضمام خلال RAID_WINDOW_SECONDS تُقفل المجموعة ويُنشر سؤال مشترك
+raid_guard = RaidGuard(
+    pending_users,
+    pending_store,
+    kick_scheduler,
+    log_captcha_event,
+    captcha_pool.pop,
+    threshold=int(os.environ.get("RAID_JOIN_THRESHOLD", 10)),
+    window=float(os.environ.get("RAID_WINDOW_SECONDS", 10)),
+    timeout=float(os.environ.get("RAID_CAPTCHA_TIMEOUT", 5 * 60)),
+)
+
+async def admin_change_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """إلغاء قائمة المشرفين المخزنة عند ترقية عضو أو تنزيله"""
+    admin_roster.observe(update.chat_member)
+
+async def raid_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """معالج إجابات سؤال موجة الانضمام المشترك"""
+    await raid_guard.answer(update.callback_query)
+
+async def restore_pending_captchas():
+    """استعادة الكابتشا المعلقة بعد إعادة التشغيل؛ من انتهت مهلتهم يطردهم المجدول فوراً في الخلفية"""
+    now = time.time()
+    overdue = 0
+    for doc in await pending_store.load_all(SHARD, SHARDS):
+        chat_id = doc.pop("chat_id")
+        user_id = doc.pop("user_id")
+        if raid_guard.restore(chat_id, user_id, doc):
+            continue
+        record = pending_users.setdefault(chat_id, {})[user_id] = PendingRecord.from_record(doc)
+        # لا يُنتظر طرد المتأخرين هنا حتى لا يتأخر بدء استقبال التحديثات
+        if record.deadline <= now:
+            overdue += 1
+        kick_scheduler.schedule(chat_id, user_id, record.message_id, deadline=record.deadline)
+    if overdue:
+        logger.info(f"Reconciling {overdue} overdue captchas after restart in the background.")
+
 async def kick_user(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_id: int):
     """طرد المستخدم من المجموعة"""
     try:
@@ -508,32 +549,76 @@ async def dev_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         captcha_stats = await get_stats()
         message = (
             f"📊 **إحصائيات البوت** 📊\n\n"
-            f"👥 **إجمالي المجموعات:** {stats["total_chats"]}\n"
-            f"👤 **إجمالي المستخدمين:** {stats["total_users"]}\n\n"
+            f"👥 **إجمالي المجموعات:** {stats['total_chats']}\n"
+            f"👤 **إجمالي المستخدمين:** {stats['total_users']}\n\n"
             f"**إحصائيات الكابتشا:**\n"
-            f"✅ **الناجحة:** {captcha_stats["success"]}\n"
-            f"❌ **المطرودون:** {captcha_stats["kicked"]}\n"
-            f"⏰ **انتهى الوقت:** {captcha_stats["timeout"]}"
+            f"✅ **الناجحة:** {captcha_stats['success']}\n"
+            f"❌ **المطرودون:** {captcha_stats['kicked']}\n"
+            f"⏰ **انتهى الوقت:** {captcha_stats['timeout']}"
         )
         await update.message.reply_text(message, parse_mode="Markdown")
 
+    elif command == "/rebuild_stats":
+        await captcha_events.flush()
+        chats_count = await captcha_counters.rebuild()
+        await update.message.reply_text(f"✅ تمت إعادة بناء عدادات الكابتشا لـ {chats_count} مجموعة.")
+
+    elif command == "/db_stats":
+        lines = ["🗄️ زمن عمليات قاعدة البيانات:\n"]
+        for name, op in sorted(repository.metrics.snapshot().items()):
+            lines.append(
+                f"{name}: {op['count']} عملية، متوسط {op['avg_ms']:.1f}ms، أقصى {op['max_ms']:.1f}ms، أخطاء {op['errors']}"
+            )
+        events = captcha_events.snapshot()
+        lines.append(
+            f"\nأحداث الكابتشا: {events['backlog']} بانتظار الكتابة، {events['flushed']} مكتوبة، "
+            f"{events['dropped']} مفقودة{' ⚠️ تأخر في قاعدة البيانات' if events['backpressured'] else ''}"
+        )
+        await update.message.reply_text("\n".join(lines))
+
+    elif command == "/queue_stats":
+        stats = update_queue.snapshot()
+        shard = f" (العامل {SHARD + 1}/{SHARDS})" if SHARDS > 1 else ""
+        await update.message.reply_text(
+            f"📥 طابور التحديثات{shard}: {stats['depth']}/{stats['max_size']} ({stats['overflow']})\n"
+            f"أقدم تحديث: {stats['oldest_age_ms']:.0f}ms، متوسط الانتظار {stats['avg_wait_ms']:.1f}ms، أقصى {stats['max_wait_ms']:.1f}ms\n"
+            f"العمال المشغولون: {stats['busy']}/{stats['workers']}، محادثات نشطة {stats['active_chats']}\n"
+            f"مقبولة {stats['accepted']}، معالجة {stats['processed']}، فاشلة {stats['failed']}، "
+            f"مهملة {stats['dropped']}، مرفوضة {stats['rejected']}\n\n"
+            + outbound_summary()
+        )
+
+    elif command == "/broadcast_status":
+        jobs = await broadcast_jobs.recent()
+        if not jobs:
+            await update.message.reply_text("لا توجد مهام إذاعة.")
+            return
+        lines = ["📣 آخر مهام الإذاعة:\n"]
+        for job in jobs:
+            lines.append(
+                f"{job['_id']} ({job['kind']}) - {job['status']}: "
+                f"✅ {job['sent']} ❌ {job['failed']} 🚫 {job['unreachable']}، آخر معرف {job['last_id']}"
+            )
+        await update.message.reply_text("\n".join(lines))
+
     elif command == "/broadcast" and len(args) > 1:
         message_to_broadcast = " ".join(args[1:])
         await broadcast_message(update, context, message_to_broadcast)
 
 async def broadcast_message(update: Update, context: ContextTypes.DEFAULT_TYPE, message: str):
     """إرسال رسالة إذاعية إلى جميع المجموعات"""
-    chats = await get_all_chats()
-    success_count = 0
-    for chat_id in chats:
-        try:
-            await context.bot.send_message(chat_id, message)
-            success_count += 1
-            await asyncio.sleep(0.1) # لتجنب تجاوز حدود الإرسال
-        except Exception as e:
-            logger.error(f"خطأ في إرسال رسالة إذاعية إلى {chat_id}: {e}")
-    
-    await update.message.reply_text(f"✅ تم إرسال الرسالة الإذاعية بنجاح إلى {success_count} من {len(chats)} مجموعة.")
+    await start_broadcast_job(update, context, "chats", message)
+
+async def start_broadcast_job(update: Update, context: ContextTypes.DEFAULT_TYPE, kind: str, message: str):
+    """إنشاء مهمة إذاعة في الخلفية وإبلاغ المرسل بمعرفها"""
+    job_id = await broadcast_jobs.start(context.bot, kind, message, update.effective_user.id)
+    if job_id is None:
+        await update.message.reply_text("❌ تعذر إنشاء مهمة الإذاعة، حاول لاحقاً.")
+        return
+    await update.message.reply_text(
+        f"📣 بدأت مهمة الإذاعة {job_id}.\n"
+        "سيصلك تقرير عند اكتمالها، ويمكنك متابعة التقدم عبر /broadcast_status."
+    )
 
 async def admin_command_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """معالج أوامر المشرفين"""
@@ -552,39 +637,43 @@ async def admin_command_handler(update: Update, context: ContextTypes.DEFAULT_TY
 
 async def broadcast_to_users(update: Update, context: ContextTypes.DEFAULT_TYPE, message: str):
     """إرسال رسالة إذاعية إلى جميع المستخدمين"""
-    targets = []
-    if update.effective_user.id in DEVELOPER_IDS:
-        targets = await get_all_users()
-    else:
+    if update.effective_user.id not in DEVELOPER_IDS:
         # المشرفون يمكنهم فقط مراسلة المستخدمين في مجموعاتهم
         # (هذه الميزة تحتاج إلى تنفيذ إضافي لتتبع المستخدمين لكل مجموعة)
         await update.message.reply_text("هذه الميزة متاحة حاليًا للمطورين فقط.")
         return
 
-    success_count = 0
-    for target_id in targets:
-        try:
-            await context.bot.send_message(target_id, message)
-            success_count += 1
-            await asyncio.sleep(0.1)
-        except Exception as e:
-            logger.error(f"خطأ في إرسال رسالة إذاعية إلى {target_id}: {e}")
-    
-    await update.message.reply_text(f"✅ تم إرسال الرسالة الإذاعية بنجاح إلى {success_count} من {len(targets)} هدف.")
-
+    await start_broadcast_job(update, context, "users", message)
 
-@app.route("/health")
-def health_check():
-    return "OK", 200
 
 # Global variable to hold the Application instance
 application: Application = None
 
 async def setup_bot():
-    global application
+    global application, update_queue, outbound, bot_request
     init_mongodb()
-
-    application = Application.builder().token(BOT_TOKEN).build()
+    await pending_store.open()
+    await chat_registry.warm_up()
+    # مع عدة عمال يُفعّل كل عامل مجموعاته فقط، فيبقى التحقق من قاعدة البيانات
+    if SHARDS == 1:
+        await activating_admins.warm_up()
+    await broadcast_jobs.ensure_indexes()
+
+    outbound = OutboundScheduler(
+        global_rate=OUTBOUND_RATE / SHARDS,
+        group_rate=OUTBOUND_GROUP_RATE / 60,
+        max_retries=OUTBOUND_MAX_RETRIES,
+    )
+    bot_request = request_from_env("BOT_API", pool_size=256, read_timeout=5)
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .request(bot_request)
+        .get_updates_request(request_from_env("GET_UPDATES", pool_size=1, read_timeout=5))
+        .rate_limiter(outbound)
+        .build()
+    )
+    update_queue = UpdateQueue(application, workers=UPDATE_WORKERS, max_size=UPDATE_QUEUE_SIZE, overflow=UPDATE_QUEUE_OVERFLOW)
 
     # معالجات الأوامر
     application.add_handler(CommandHandler("start", start_command))
@@ -592,42 +681,149 @@ async def setup_bot():
     application.add_handler(MessageHandler(filters.Regex(re.compile(r"^تعطيل$", re.IGNORECASE)), disable_protection))
     application.add_handler(CommandHandler("stats", dev_command_handler))
     application.add_handler(CommandHandler("broadcast", dev_command_handler))
+    application.add_handler(CommandHandler("db_stats", dev_command_handler))
+    application.add_handler(CommandHandler("rebuild_stats", dev_command_handler))
+    application.add_handler(CommandHandler("broadcast_status", dev_command_handler))
+    application.add_handler(CommandHandler("queue_stats", dev_command_handler))
     application.add_handler(CommandHandler("broadcast_users", admin_command_handler))
 
     # معالج الأعضاء الجدد
     application.add_handler(ChatMemberHandler(new_member_handler, ChatMemberHandler.CHAT_MEMBER))
+    # تغييرات المشرفين في مجموعة مستقلة حتى تصل أيضاً إلى new_member_handler
+    application.add_handler(ChatMemberHandler(admin_change_handler, ChatMemberHandler.CHAT_MEMBER), group=-1)
 
     # معالج ردود الكابتشا
     application.add_handler(CallbackQueryHandler(captcha_callback_handler, pattern=r"^captcha_"))
+    application.add_handler(CallbackQueryHandler(raid_callback_handler, pattern=r"^raid_\d+$"))
 
     # معالج أزرار القوائم
     application.add_handler(CallbackQueryHandler(start_command, pattern=r"^(dev_commands_menu|admin_commands_menu)$"))
 
-    # Set the webhook
+async def shutdown_background_tasks():
+    """إيقاف المهام الخلفية وكتابة ما تبقى في المخازن المؤقتة"""
+    await kick_scheduler.stop()
+    await pending_store.stop()
+    await captcha_events.stop()
+    await user_updates.stop()
+    await chat_updates.stop()
+    repository.shutdown()
+
+async def set_webhook(bot):
     webhook_url = os.environ.get("WEBHOOK_URL")
     if webhook_url:
-        await application.bot.set_webhook(url=f"{webhook_url}/{BOT_TOKEN}")
+        await bot.set_webhook(url=f"{webhook_url}/{BOT_TOKEN}", allowed_updates=Update.ALL_TYPES)
         logger.info(f"Webhook set to {webhook_url}/{BOT_TOKEN}")
     else:
         logger.warning("WEBHOOK_URL not set. Webhook will not be configured.")
 
+def outbound_summary() -> str:
+    """سطر حالة مجدول الطلبات الصادرة"""
+    stats = outbound.snapshot()
+    return (
+        f"📤 الطلبات الصادرة: {stats['requests']}، بانتظار الإرسال {stats['waiting']} (أقصى {stats['peak_waiting']})\n"
+        f"مؤخرة {stats['throttled']} بإجمالي {stats['throttle_seconds']:.1f}s، "
+        f"RetryAfter {stats['retry_after']} ({stats['retry_after_seconds']:.0f}s)، إعادة بعد خطأ شبكة {stats['network_retries']}\n"
+        + pool_summary(bot_request.snapshot())
+    )
 
-@app.route(f"/{BOT_TOKEN}", methods=["POST"])
-async def webhook_handler():
-    if request.method == "POST":
-        update = Update.de_json(request.get_json(force=True), application.bot)
-        await application.process_update(update)
-    return "", 200
+def pool_summary(pool: dict) -> str:
+    """سطر حالة مجمع اتصالات Bot API"""
+    return (
+        f"🔌 مجمع الاتصالات: {pool['in_flight']}/{pool['pool_size']} مشغولة (أقصى {pool['peak_in_flight']})، "
+        f"انتظر {pool['waited']} من {pool['requests']} طلب بمتوسط {pool['avg_wait_ms']:.1f}ms وأقصى {pool['max_wait_ms']:.1f}ms، "
+        f"انتهت مهلة {pool['pool_timeouts']}"
+    )
 
+def run_shard_worker(shard: int, shards: int, updates):
+    """نقطة دخول عملية العامل shard"""
+    # إشارة الإيقاف تصل إلى كل عمليات المجموعة؛ العامل يتوقف عند علامة النهاية من عملية الاستقبال بعد تفريغ طابوره
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    asyncio.run(shard_worker(shard, shards, updates))
+
+async def shard_worker(shard: int, shards: int, updates):
+    """عامل يعالج تحديثات مجموعاته فقط ويستعيد الكابتشا المعلقة الخاصة بها"""
+    global SHARD, SHARDS
+    SHARD, SHARDS = shard, shards
+    await setup_bot()
+
+    async with application:
+        kick_scheduler.start()
+        await restore_pending_captchas()
+        # الإذاعات المتوقفة يستأنفها عامل واحد فقط
+        if shard == 0:
+            await broadcast_jobs.resume_all(application.bot)
+
+        await application.start()
+        update_queue.start()
+        loop = asyncio.get_running_loop()
+        logger.info(f"Shard worker {shard + 1}/{shards} started.")
+        try:
+            while True:
+                data = await loop.run_in_executor(None, updates.get)
+                if data is None:
+                    break
+                update = Update.de_json(data, application.bot)
+                # الطابور المحلي ممتلئ: الانتظار بدل الإهمال، فيمتلئ طابور العامل وترد عملية الاستقبال بـ 503
+                while not update_queue.put(update):
+                    await asyncio.sleep(0.05)
+        finally:
+            await update_queue.stop()
+            await application.stop()
+            await shutdown_background_tasks()
+
+async def run_sharded():
+    """عملية الاستقبال: تضبط الويب هوك وتوزع التحديثات على BOT_WORKERS عاملاً"""
+    context = multiprocessing.get_context("spawn")
+    queues = [context.Queue(SHARD_QUEUE_SIZE) for _ in range(BOT_WORKERS)]
+    workers = [
+        context.Process(target=run_shard_worker, args=(shard, BOT_WORKERS, queues[shard]), name=f"shard-{shard}")
+        for shard in range(BOT_WORKERS)
+    ]
+    for worker in workers:
+        worker.start()
+
+    router = ShardRouter(queues)
+    # تطبيق بلا معالجات: يكفي لفك التحديثات وضبط الويب هوك
+    ingress = Application.builder().token(BOT_TOKEN).build()
+    async with ingress:
+        await set_webhook(ingress.bot)
+        try:
+            await serve(WebhookApp(ingress, f"/{BOT_TOKEN}", router), "0.0.0.0", PORT)
+        finally:
+            router.close()
+            loop = asyncio.get_running_loop()
+            for worker in workers:
+                await loop.run_in_executor(None, worker.join)
+
+async def main():
+    """تشغيل البوت وخادم الويب هوك على حلقة أحداث واحدة"""
+    if BOT_WORKERS > 1:
+        await run_sharded()
+        return
 
-if __name__ == "__main__":
-    # Ensure the Application is initialized before Flask starts
-    # This is a common pattern for integrating asyncio with Flask
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(setup_bot())
+    await setup_bot()
 
-    # Run the Flask app
-    app.run(host="0.0.0.0", port=PORT, debug=False)
+    async with application:
+        await set_webhook(application.bot)
+
+        kick_scheduler.start()
+        await restore_pending_captchas()
+        await broadcast_jobs.resume_all(application.bot)
+
+        await application.start()
+        update_queue.start()
+        try:
+            await serve(WebhookApp(application, f"/{BOT_TOKEN}", update_queue), "0.0.0.0", PORT)
+        finally:
+            # معالجة التحديثات التي تم الرد عليها قبل إيقاف Application
+            await update_queue.stop()
+            await application.stop()
+            await shutdown_background_tasks()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
 
 
 
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+مجدول الطلبات الصادرة إلى Telegram Bot API
+كل استدعاء لـ bot.* يمر عبره (rate_limiter للتطبيق): دلو رموز عام، ودلو لكل محادثة للرسائل،
+وإيقاف تلقائي بعد RetryAfter ثم إعادة المحاولة، وإعادة محاولة مع تأخير عشوائي لأخطاء الشبكة العابرة.
+طلبات الإذاعة (rate_limit_args={"bulk": True}) تأخذ من الحد العام ومن حد المحادثة ما تتركه طلبات الحماية فقط.
+"""
+
+import asyncio
+import logging
+import random
+from typing import Callable, Dict, Optional
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+from telegram.ext import BaseRateLimiter
+
+from rate_limit import TokenBucket, retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+# الطلبات التي تنشر رسالة في المحادثة: لا تُعاد بعد انتهاء المهلة (ربما وصلت فتتكرر)
+MESSAGE_ENDPOINTS = ("send", "copy", "forward")
+
+
+def chat_of(data: dict) -> Optional[int]:
+    """معرف المحادثة الرقمي للطلب إن وُجد"""
+    chat_id = data.get("chat_id")
+    try:
+        return int(chat_id)
+    except (TypeError, ValueError):
+        return None
+
+
+class OutboundScheduler(BaseRateLimiter):
+    """تحديد معدل كل طلبات البوت ضمن حدود Telegram بدلاً من ردها بأخطاء 429"""
+
+    def __init__(self, global_rate: float = 30.0, private_rate: float = 1.0, group_rate: float = 20 / 60,
+                 group_burst: float = 20, max_retries: int = 3, backoff: float = 0.5, max_chats: int = 10000):
+        # بلا دفعة أولى: دلو ممتلئ بسعة ثانية كاملة يسمح بضعف الحد خلال الثانية الأولى فيرد Telegram بـ 429
+        self._global = TokenBucket(global_rate, capacity=1)
+        self._private_rate = private_rate
+        self._group_rate = group_rate
+        self._group_burst = group_burst
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._max_chats = max_chats
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        self.requests = 0
+        self.waiting = 0
+        # طلبات الحماية المنتظرة للحد العام ولحد كل محادثة؛ طلبات الإذاعة تنتظر حتى تنتهي
+        self.urgent_waiting = 0
+        self._urgent_chats: Dict[int, int] = {}
+        self.bulk_requests = 0
+        self.peak_waiting = 0
+        self.throttled = 0
+        self.throttle_seconds = 0.0
+        self.retry_after = 0
+        self.retry_after_seconds = 0.0
+        self.network_retries = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        self._chat_buckets.clear()
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= self._max_chats:
+                self._prune()
+            # المعرفات السالبة مجموعات (20 رسالة في الدقيقة مع دفعة أولى)، والموجبة محادثات خاصة (رسالة في الثانية)
+            if chat_id < 0:
+                bucket = TokenBucket(self._group_rate, capacity=self._group_burst)
+            else:
+                bucket = TokenBucket(self._private_rate, capacity=1)
+            self._chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _prune(self):
+        for chat_id in [chat_id for chat_id, bucket in self._chat_buckets.items() if bucket.is_idle()]:
+            del self._chat_buckets[chat_id]
+
+    async def _throttle(self, chat_id: Optional[int], sends: bool, bulk: bool) -> float:
+        """الانتظار حتى يُسمح بالطلب؛ تُرجع زمن الانتظار"""
+        waited = 0.0
+        self.waiting += 1
+        self.peak_waiting = max(self.peak_waiting, self.waiting)
+        try:
+            if chat_id is not None:
+                if sends and bulk:
+                    waited += await self._acquire_spare(
+                        self._chat_bucket(chat_id), lambda: self._urgent_chats.get(chat_id, 0)
+                    )
+                elif sends:
+                    # رسائل الحماية تحترم حد المحادثة قبل أن يرد Telegram بـ 429، وتسبق رسائل الإذاعة إليه
+                    self._urgent_chats[chat_id] = self._urgent_chats.get(chat_id, 0) + 1
+                    try:
+                        waited += await self._chat_bucket(chat_id).acquire()
+                    finally:
+                        self._urgent_chats[chat_id] -= 1
+                        if not self._urgent_chats[chat_id]:
+                            del self._urgent_chats[chat_id]
+                else:
+                    # الطلبات الأخرى (تقييد، طرد، حذف) لا تستهلك حد رسائل المحادثة لكنها تحترم إيقافها بعد RetryAfter
+                    bucket = self._chat_buckets.get(chat_id)
+                    pause = bucket.paused() if bucket is not None else 0.0
+                    if pause:
+                        await asyncio.sleep(pause)
+                        waited += pause
+            if bulk:
+                waited += await self._acquire_spare(self._global, lambda: self.urgent_waiting)
+            else:
+                self.urgent_waiting += 1
+                try:
+                    waited += await self._global.acquire()
+                finally:
+                    self.urgent_waiting -= 1
+        finally:
+            self.waiting -= 1
+        if waited:
+            self.throttled += 1
+            self.throttle_seconds += waited
+        return waited
+
+    @staticmethod
+    async def _acquire_spare(bucket: TokenBucket, urgent: Callable[[], int]) -> float:
+        """رمز من bucket لطلب إذاعة، بعد أن تأخذ طلبات الحماية المنتظرة له (urgent()) رموزها"""
+        waited = 0.0
+        while True:
+            if urgent():
+                wait = 1 / bucket.rate
+            else:
+                wait = bucket.try_acquire()
+                if not wait:
+                    return waited
+            waited += wait
+            await asyncio.sleep(wait)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = chat_of(data)
+        sends = endpoint.startswith(MESSAGE_ENDPOINTS)
+        # rate_limit_args={"max_retries": n} لتغيير عدد المحاولات لطلب واحد، و {"bulk": True} لطلبات الإذاعة
+        max_retries = (rate_limit_args or {}).get("max_retries", self._max_retries)
+        bulk = bool((rate_limit_args or {}).get("bulk"))
+        self.requests += 1
+        self.bulk_requests += bulk
+        attempt = 0
+        while True:
+            await self._throttle(chat_id, sends, bulk)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if attempt >= max_retries:
+                    raise
+                seconds = retry_after_seconds(e)
+                self.retry_after += 1
+                self.retry_after_seconds += seconds
+                logger.warning(f"Flood control on {endpoint} (chat {chat_id}), pausing for {seconds}s.")
+                # حد رسائل المحادثة يوقف تلك المحادثة فقط، وما عداه يوقف كل الطلبات
+                if sends and chat_id is not None:
+                    self._chat_bucket(chat_id).pause(seconds)
+                else:
+                    self._global.pause(seconds)
+            except NetworkError as e:
+                if isinstance(e, BadRequest) or attempt >= max_retries or (sends and isinstance(e, TimedOut)):
+                    raise
+                self.network_retries += 1
+                delay = min(self._backoff * 2 ** attempt, 30) * random.uniform(0.5, 1.5)
+                logger.warning(f"Network error on {endpoint} (attempt {attempt + 1}), retrying in {delay:.2f}s: {e}")
+                await asyncio.sleep(delay)
+            attempt += 1
+
+    def snapshot(self) -> dict:
+        return {
+            "requests": self.requests,
+            "waiting": self.waiting,
+            "urgent_waiting": self.urgent_waiting,
+            "bulk_requests": self.bulk_requests,
+            "peak_waiting": self.peak_waiting,
+            "throttled": self.throttled,
+            "throttle_seconds": self.throttle_seconds,
+            "retry_after": self.retry_after,
+            "retry_after_seconds": self.retry_after_seconds,
+            "network_retries": self.network_retries,
+            "global_rate": self._global.rate,
+            "chats": len(self._chat_buckets),
+        }
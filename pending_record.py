@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+سجل الكابتشا المعلقة لعضو واحد في pending_users
+كائن بحقول ثابتة (__slots__) بدلاً من قاموس، مع أوقات بثوانٍ صحيحة منذ epoch وأسماء مشتركة (interned)
+فتنخفض كلفة العضو المعلق في الذاكرة أثناء موجات الانضمام
+"""
+
+import sys
+import time
+from datetime import datetime
+from typing import Optional
+
+
+class PendingRecord:
+    """عضو ينتظر حل الكابتشا"""
+
+    __slots__ = ("username", "join_time", "message_id", "deadline", "wrong_attempts", "correct_answer", "cohort")
+
+    def __init__(self, username: str, deadline: float = 0, message_id: int = 0, join_time: int = None,
+                 wrong_attempts: int = 0, correct_answer: Optional[int] = None, cohort: bool = False):
+        self.username = sys.intern(username) if username else username
+        self.join_time = int(time.time()) if join_time is None else join_time
+        self.message_id = message_id
+        self.deadline = int(deadline)
+        self.wrong_attempts = wrong_attempts
+        # الإجابة الصحيحة تُحفظ فقط لسؤال الدفعة المشترك وأزرار ما قبل التوقيع؛ أزرار الكابتشا الموقعة تحملها بنفسها
+        self.correct_answer = correct_answer
+        self.cohort = cohort
+
+    def to_record(self) -> dict:
+        """المستند المحفوظ في مخزن الكابتشا المعلقة"""
+        record = {
+            "join_time": self.join_time,
+            "username": self.username,
+            "message_id": self.message_id,
+            "deadline": self.deadline,
+        }
+        if self.cohort:
+            record["cohort"] = True
+        if self.correct_answer is not None:
+            record["correct_answer"] = self.correct_answer
+        if self.wrong_attempts:
+            record["wrong_attempts"] = self.wrong_attempts
+        return record
+
+    @classmethod
+    def from_record(cls, doc: dict) -> "PendingRecord":
+        """سجل من مستند المخزن (بما فيها المستندات القديمة التي تحفظ join_time كـ datetime)"""
+        join_time = doc.get("join_time")
+        if isinstance(join_time, datetime):
+            join_time = int(join_time.timestamp())
+        return cls(
+            doc.get("username"),
+            deadline=doc["deadline"],
+            message_id=doc["message_id"],
+            join_time=join_time,
+            wrong_attempts=doc.get("wrong_attempts", 0),
+            correct_answer=doc.get("correct_answer"),
+            cohort=doc.get("cohort", False),
+        )
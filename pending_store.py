@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+تخزين دائم لأسئلة الكابتشا المعلقة حتى لا تضيع عند إعادة التشغيل
+الكتابة مؤجلة (write-behind): التغييرات تُجمع في الذاكرة وتُرسل دفعة واحدة إلى المخزن (state_backend)
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+from state_backend import StateBackend
+from storage import BackgroundFlusher
+
+
+class PendingCaptchaStore(BackgroundFlusher):
+    """مخزن الكابتشا المعلقة مع تجميع الكتابات"""
+
+    def __init__(self, backend: StateBackend, flush_interval: float = 2.0, max_batch: int = 500):
+        super().__init__(flush_interval)
+        self._backend = backend
+        self._max_batch = max_batch
+        # (chat_id, user_id) -> المستند المراد حفظه، أو None للحذف. آخر تغيير هو الذي يُكتب
+        self._dirty: Dict[Tuple[int, int], Optional[dict]] = {}
+
+    async def open(self):
+        """تجهيز المخزن (الفهارس أو الجداول)"""
+        await self._backend.open()
+
+    def save(self, chat_id: int, user_id: int, record: dict):
+        """تسجيل (أو تحديث) كابتشا معلقة؛ يجب أن يحتوي السجل على deadline و message_id"""
+        doc = dict(record)
+        doc.update({"chat_id": chat_id, "user_id": user_id})
+        self._mark((chat_id, user_id), doc)
+
+    def delete(self, chat_id: int, user_id: int):
+        """حذف كابتشا معلقة بعد حلها أو طرد صاحبها"""
+        self._mark((chat_id, user_id), None)
+
+    def delete_chat(self, chat_id: int, user_ids):
+        """حذف جميع الكابتشا المعلقة لمجموعة"""
+        for user_id in user_ids:
+            self._mark((chat_id, user_id), None)
+
+    async def load_all(self, shard: int = 0, shards: int = 1) -> List[dict]:
+        """تحميل الكابتشا المعلقة في مجموعات العامل shard عند بدء التشغيل"""
+        return await self._backend.load(shard, shards)
+
+    def _mark(self, key: Tuple[int, int], doc: Optional[dict]):
+        self._dirty[key] = doc
+        self._touch(flush_now=len(self._dirty) >= self._max_batch)
+
+    async def flush(self):
+        """كتابة جميع التغييرات المعلقة دفعة واحدة"""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        upserts = {key: doc for key, doc in dirty.items() if doc is not None}
+        deletes = [key for key, doc in dirty.items() if doc is None]
+        written = await self._backend.write(upserts, deletes)
+        if not written:
+            # إعادة التغييرات التي لم تُكتب دون الكتابة فوق تغييرات أحدث
+            for key, doc in dirty.items():
+                self._dirty.setdefault(key, doc)
+
+    async def stop(self):
+        """كتابة ما تبقى ثم إغلاق المخزن"""
+        await super().stop()
+        await self._backend.close()
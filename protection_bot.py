@@ -8,7 +8,6 @@
 import re
 import logging
 import asyncio
-import random
 import sqlite3
 import os
 from dotenv import load_dotenv
@@ -16,12 +15,30 @@ from dotenv import load_dotenv
 load_dotenv() # Load environment variables from .env file
 
 import fcntl
-from datetime import datetime, timedelta
+import threading
 from typing import Dict, Set
 import telegram
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ChatMember
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ChatMemberHandler, filters, ContextTypes
 
+import time
+
+from admin_roster import AdminRoster
+from bot_request import request_from_env
+from captcha_pool import CaptchaPool
+from captcha_tokens import CaptchaSigner, CaptchaToken, derive_secret
+from chat_limiter import ChatLimiter
+from chat_registry import ActivatingAdminIndex, ChatRegistry
+from kick_scheduler import DeadlineScheduler
+from outbound import OutboundScheduler
+from pending_record import PendingRecord
+from pending_store import PendingCaptchaStore
+from raid_guard import COHORT_KEY, RaidGuard
+from sqlite_storage import SQLiteRepository
+from state_backend import create_state_backend
+from storage import BotTotals, CaptchaCounters, CaptchaEventBuffer, CoalescingUpserter, MongoRepository
+from update_processor import ChatOrderedUpdateProcessor
+
 # إعداد التسجيل
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -41,17 +58,46 @@ if not DATABASE_URL:
     logger.error("DATABASE_URL environment variable not set!")
     exit(1)
 
+# DATABASE_URL=sqlite:///path/to/bot.db يستخدم قاعدة SQLite مضمنة بدلاً من MongoDB (نشر على جهاز واحد)
+SQLITE_PREFIX = 'sqlite:///'
+USE_SQLITE = DATABASE_URL.startswith(SQLITE_PREFIX)
+
 # معرفات المطورين (User IDs)
 DEVELOPER_IDS = [6714288409, 6459577996]
 
-# قاموس لتخزين حالة الحماية لكل مجموعة
-protection_enabled: Dict[int, bool] = {}
-
 # قاموس لتخزين الأعضاء الجدد الذين ينتظرون حل الكابتشا
-pending_users: Dict[int, Dict[int, dict]] = {}
+pending_users: Dict[int, Dict[int, PendingRecord]] = {}
+
+# مهلة حل الكابتشا بالثواني
+CAPTCHA_TIMEOUT = 1800  # 30 minutes
+# صلاحيات العضو بعد حل الكابتشا (أو بعد رفع تقييد لم يصل سؤاله)
+MEMBER_PERMISSIONS = telegram.ChatPermissions(
+    can_send_messages=True,
+    can_send_polls=True,
+    can_send_other_messages=True,
+    can_add_web_page_previews=True,
+    can_change_info=False,
+    can_invite_users=True,
+    can_pin_messages=False,
+)
+
+# تحديثات المحادثات المختلفة تُعالج بالتوازي، وتحديثات المحادثة الواحدة بترتيب وصولها
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", 32))
+
+# كل طلبات البوت تمر بمجدول واحد: OUTBOUND_RATE طلب في الثانية للبوت كله و OUTBOUND_GROUP_RATE رسالة في الدقيقة لكل مجموعة،
+# مع إعادة المحاولة بعد RetryAfter وأخطاء الشبكة
+outbound = OutboundScheduler(
+    global_rate=float(os.getenv("OUTBOUND_RATE", 30)),
+    group_rate=float(os.getenv("OUTBOUND_GROUP_RATE", 20)) / 60,
+    max_retries=int(os.getenv("OUTBOUND_MAX_RETRIES", 3)),
+)
+
+# اتصالات Bot API: BOT_API_POOL_SIZE و BOT_API_KEEPALIVE و BOT_API_HTTP2 ومهل BOT_API_*_TIMEOUT و BOT_API_METHOD_TIMEOUTS،
+# وبنفس الأسماء مع GET_UPDATES_ لطلبات getUpdates (الاستطلاع الطويل)
+bot_request = request_from_env('BOT_API', pool_size=256, read_timeout=5)
+get_updates_request = request_from_env('GET_UPDATES', pool_size=1, read_timeout=5)
 
-# قاموس لتخزين مهام الطرد المؤجلة
-kick_tasks: Dict[str, asyncio.Task] = {}
+application: Application = None
 
 # MongoDB Client
 from pymongo import MongoClient
@@ -75,8 +121,30 @@ def get_db_client():
             exit(1)
     return db
 
+# قفل إنشاء الاتصال من خيوط مجمع قاعدة البيانات
+db_client_lock = threading.Lock()
+
+def get_repository_db():
+    """قاعدة البيانات لعمليات المجمع: اتصال مخزن دون ping لكل عملية، و None بدلاً من exit عند الفشل"""
+    global client, db
+    if db is not None:
+        return db
+    with db_client_lock:
+        if db is None:
+            try:
+                # MongoClient يعيد الاتصال بنفسه؛ أخطاء الشبكة تظهر في العملية نفسها ويسجلها MongoRepository.run
+                client = MongoClient(DATABASE_URL)
+                db = client.protection_bot_db
+                logger.info("Successfully connected to MongoDB.")
+            except Exception as e:
+                logger.error(f"MongoDB connection failed: {e}")
+    return db
+
 def init_database():
     """تهيئة قاعدة البيانات (MongoDB لا تحتاج لإنشاء جداول صريحة) """
+    if USE_SQLITE:
+        # الجداول والفهارس يُنشئها SQLiteRepository عند أول اتصال
+        return
     database = get_db_client()
     if database is not None:
         try:
@@ -88,188 +156,95 @@ def init_database():
             database.chats.create_index("chat_id", unique=True)
             database.chats.create_index("protection_enabled")
             database.chats.create_index("activating_admin_id")
+            database.pending_captchas.create_index([("chat_id", 1), ("user_id", 1)], unique=True)
             logger.info("MongoDB indexes ensured.")
         except OperationFailure as e:
             logger.error(f"Failed to create MongoDB indexes: {e}")
         except Exception as e:
             logger.error(f"An unexpected error occurred during MongoDB index creation: {e}")
 
-def log_captcha_event(user_id: int, chat_id: int, status: str):
+# جميع عمليات قاعدة البيانات تمر عبر مجمع خيوط محدود حتى لا تحجب حلقة الأحداث
+if USE_SQLITE:
+    repository = SQLiteRepository(DATABASE_URL[len(SQLITE_PREFIX):])
+else:
+    repository = MongoRepository(get_repository_db, max_workers=int(os.getenv("DB_POOL_SIZE", 8)))
+
+# أحداث الكابتشا تُجمع في الذاكرة وتُكتب دفعة واحدة، مع تحديث العدادات بـ $inc
+captcha_counters = CaptchaCounters(repository)
+captcha_events = CaptchaEventBuffer(repository, captcha_counters)
+
+# إجمالي المجموعات والمستخدمين، لقطة تُحدّث كل BOT_TOTALS_REFRESH ثانية
+bot_totals = BotTotals(repository, refresh_interval=float(os.getenv("BOT_TOTALS_REFRESH", 300)))
+
+# تحديثات المستخدمين والمجموعات تُجمع وتُكتب دورياً؛ تحديث الطابع الزمني وحده يُهمل داخل هذه النافذة
+TOUCH_WINDOW_SECONDS = float(os.getenv("TOUCH_WINDOW_SECONDS", 300))
+user_updates = CoalescingUpserter(repository, "users", "user_id", "last_interaction", touch_window=TOUCH_WINDOW_SECONDS)
+chat_updates = CoalescingUpserter(repository, "chats", "chat_id", "last_activity", touch_window=TOUCH_WINDOW_SECONDS)
+
+# حالة الحماية لكل مجموعة، تُحمّل من db.chats عند بدء التشغيل
+chat_registry = ChatRegistry(repository)
+
+# المشرف الذي فعّل الحماية -> مجموعاته، لـ /start وقوائم المشرفين دون استعلام
+activating_admins = ActivatingAdminIndex(repository)
+
+# مشرفو كل مجموعة من get_chat_administrators، تُلغى عند ترقية أو تنزيل مشرف وبعد ADMIN_CACHE_TTL ثانية
+admin_roster = AdminRoster(ttl=float(os.getenv('ADMIN_CACHE_TTL', 600)))
+
+async def log_captcha_event(user_id: int, chat_id: int, status: str):
     """تسجيل حدث كابتشا في قاعدة البيانات"""
-    database = get_db_client()
-    if database is not None:
-        try:
-            database.captcha_stats.insert_one({
-                "user_id": user_id,
-                "chat_id": chat_id,
-                "status": status,
-                "timestamp": datetime.now()
-            })
-        except Exception as e:
-            logger.error(f"Error logging captcha event to MongoDB: {e}")
+    captcha_events.add(user_id, chat_id, status)
 
-def update_user_info(user_id: int, username: str = None, first_name: str = None):
+async def update_user_info(user_id: int, username: str = None, first_name: str = None):
     """تحديث معلومات المستخدم في قاعدة البيانات"""
-    database = get_db_client()
-    if database is not None:
-        try:
-            database.users.update_one(
-                {"user_id": user_id},
-                {"$set": {
-                    "username": username,
-                    "first_name": first_name,
-                    "last_interaction": datetime.now()
-                }},
-                upsert=True
-            )
-        except Exception as e:
-            logger.error(f"Error updating user info in MongoDB: {e}")
+    user_updates.update(user_id, {"username": username, "first_name": first_name})
 
-def update_chat_info(chat_id: int, chat_title: str = None, protection_enabled: bool = None, admin_id: int = None):
+async def update_chat_info(chat_id: int, chat_title: str = None, protection_enabled: bool = None, admin_id: int = None):
     """تحديث معلومات المجموعة في قاعدة البيانات"""
-    database = get_db_client()
-    if database is not None:
-        update_fields = {"last_activity": datetime.now()}
-        if chat_title is not None:
-            update_fields["chat_title"] = chat_title
-        if protection_enabled is not None:
-            update_fields["protection_enabled"] = protection_enabled
-        if admin_id is not None:
-            update_fields["activating_admin_id"] = admin_id
-
-        try:
-            database.chats.update_one(
-                {"chat_id": chat_id},
-                {"$set": update_fields},
-                upsert=True
-            )
-        except Exception as e:
-            logger.error(f"Error updating chat info in MongoDB: {e}")
-
-def get_stats(user_id: int = None, chat_id: int = None, hours: int = None):
+    fields = {}
+    if chat_title is not None:
+        fields["chat_title"] = chat_title
+    if protection_enabled is not None:
+        fields["protection_enabled"] = protection_enabled
+    if admin_id is not None:
+        fields["activating_admin_id"] = admin_id
+    # تغييرات حالة الحماية تُكتب فوراً دون انتظار الدورة التالية
+    chat_updates.update(chat_id, fields, flush_now=protection_enabled is not None)
+    activating_admins.update(chat_id, protection_enabled, admin_id)
+
+async def get_stats(user_id: int = None, chat_id: int = None, hours: int = None):
     """الحصول على الإحصائيات"""
-    database = get_db_client()
-    stats = {"success": 0, "kicked": 0, "timeout": 0}
-    if database is not None:
-        query = {}
-        if chat_id:
-            query["chat_id"] = chat_id
-        if user_id:
-            query["user_id"] = user_id
-        if hours:
-            query["timestamp"] = {"$gte": datetime.now() - timedelta(hours=hours)}
+    if user_id or hours:
+        # العدادات لا تغطي التصفية حسب المستخدم أو المدة
+        return await repository.get_stats(user_id, chat_id, hours)
+    return await captcha_counters.get(chat_id)
 
-        try:
-            pipeline = [
-                {"$match": query},
-                {"$group": {"_id": "$status", "count": {"$sum": 1}}}
-            ]
-            results = database.captcha_stats.aggregate(pipeline)
-            for res in results:
-                stats[res["_id"]] = res["count"]
-        except Exception as e:
-            logger.error(f"Error getting stats from MongoDB: {e}")
-    return stats
-
-def get_bot_stats():
+async def get_bot_stats():
     """الحصول على إحصائيات البوت العامة"""
-    database = get_db_client()
-    total_chats = 0
-    total_users = 0
-    if database is not None:
-        try:
-            total_chats = database.chats.distinct("chat_id")
-            total_users = database.users.distinct("user_id")
-        except Exception as e:
-            logger.error(f"Error getting bot stats from MongoDB: {e}")
-    return {"total_chats": len(total_chats), "total_users": len(total_users)}
+    return await bot_totals.get()
 
-def get_all_users():
+async def get_all_users():
     """الحصول على جميع المستخدمين"""
-    database = get_db_client()
-    users = []
-    if database is not None:
-        try:
-            users = [user["user_id"] for user in database.users.find({}, {"user_id": 1})]
-        except Exception as e:
-            logger.error(f"Error getting all users from MongoDB: {e}")
-    return users
+    return await repository.get_all_users()
 
-def get_all_chats():
+async def get_all_chats():
     """الحصول على جميع المجموعات التي تم تفعيل الحماية فيها"""
-    database = get_db_client()
-    chats = []
-    if database is not None:
-        try:
-            chats = [chat["chat_id"] for chat in database.chats.find({"protection_enabled": True}, {"chat_id": 1})]
-        except Exception as e:
-            logger.error(f"Error getting all chats from MongoDB: {e}")
-    return chats
+    return await repository.get_all_chats()
 
 async def is_activating_admin(user_id: int) -> bool:
     """التحقق مما إذا كان المستخدم هو المشرف الذي قام بتفعيل البوت في أي مجموعة"""
-    database = get_db_client()
-    if database is not None:
-        try:
-            result = database.chats.find_one({"protection_enabled": True, "activating_admin_id": user_id})
-            return result is not None
-        except Exception as e:
-            logger.error(f"Error checking activating admin in MongoDB: {e}")
-            return False
-    return False
+    return await activating_admins.is_activating_admin(user_id)
 
-class CaptchaGenerator:
-    """مولد أسئلة الكابتشا"""
-    
-    @staticmethod
-    def generate_math_captcha():
-        """توليد سؤال رياضي بسيط"""
-        num1 = random.randint(1, 10)
-        num2 = random.randint(1, 10)
-        operation = random.choice(['+', '-', '*'])
-        
-        if operation == '+':
-            answer = num1 + num2
-            question = f"كم يساوي {num1} + {num2}؟"
-        elif operation == '-':
-            if num1 < num2:
-                num1, num2 = num2, num1
-            answer = num1 - num2
-            question = f"كم يساوي {num1} - {num2}؟"
-        else:  # multiplication
-            answer = num1 * num2
-            question = f"كم يساوي {num1} × {num2}؟"
-        
-        return question, answer
-    
-    @staticmethod
-    def generate_options(correct_answer):
-        """توليد خيارات متعددة للإجابة"""
-        options = [correct_answer]
-        
-        seen_options = {correct_answer}
-        while len(options) < 4:
-            wrong_answer = correct_answer + random.choice([-1, 1]) * random.randint(1, 10)
-            
-            if wrong_answer not in seen_options and wrong_answer >= 0:
-                options.append(wrong_answer)
-                seen_options.add(wrong_answer)
-            else:
-                for _ in range(10):
-                    wrong_answer = random.randint(max(0, correct_answer - 15), correct_answer + 15)
-                    if wrong_answer not in seen_options and wrong_answer >= 0:
-                        options.append(wrong_answer)
-                        seen_options.add(wrong_answer)
-                        break
-        
-        random.shuffle(options)
-        return options
+# أسئلة الكابتشا تُسحب جاهزة من مخزون يُولّد على دفعات ويُعاد ملؤه في الخلفية
+captcha_pool = CaptchaPool()
+
+# أزرار الكابتشا موقعة بمفتاح مشترك بين جميع نسخ البوت (CAPTCHA_SECRET أو مشتق من التوكن)
+captcha_signer = CaptchaSigner(derive_secret(BOT_TOKEN, os.getenv("CAPTCHA_SECRET")))
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """معالج أمر /start"""
     user = update.effective_user
     
-    update_user_info(user.id, user.username, user.first_name)
+    await update_user_info(user.id, user.username, user.first_name)
     
     if update.effective_chat.type == 'private':
         message_text = (
@@ -309,16 +284,15 @@ async def enable_protection(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     
     try:
-        member = await context.bot.get_chat_member(chat_id, user_id)
-        if member.status not in ['administrator', 'creator'] and user_id not in DEVELOPER_IDS:
+        if user_id not in DEVELOPER_IDS and not await admin_roster.is_admin(context.bot, chat_id, user_id):
             await update.effective_chat.send_message("عذراً، يمكن للمشرفين أو المطورين فقط تفعيل نظام الحماية.")
             return
     except Exception as e:
         logger.error(f"خطأ في التحقق من صلاحيات المستخدم: {e}")
         return
     
-    update_chat_info(chat_id, update.effective_chat.title, True, user_id)
-    protection_enabled[chat_id] = True
+    await update_chat_info(chat_id, update.effective_chat.title, True, user_id)
+    chat_registry.set_enabled(chat_id, True)
     await update.message.reply_text(
         "✅ تم تفعيل نظام الحماية بنجاح!\n"
         "سيتم الآن طلب حل كابتشا من جميع الأعضاء الجدد.\n"
@@ -331,27 +305,21 @@ async def disable_protection(update: Update, context: ContextTypes.DEFAULT_TYPE)
     user_id = update.effective_user.id
     
     try:
-        member = await context.bot.get_chat_member(chat_id, user_id)
-        if member.status not in ['administrator', 'creator'] and user_id not in DEVELOPER_IDS:
+        if user_id not in DEVELOPER_IDS and not await admin_roster.is_admin(context.bot, chat_id, user_id):
             await update.effective_chat.send_message("عذراً، يمكن للمشرفين أو المطورين فقط إلغاء تفعيل نظام الحماية.")
             return
     except Exception as e:
         logger.error(f"خطأ في التحقق من صلاحيات المستخدم: {e}")
         return
     
-    update_chat_info(chat_id, update.effective_chat.title, False, None)
-    protection_enabled[chat_id] = False
+    await update_chat_info(chat_id, update.effective_chat.title, False, None)
+    chat_registry.set_enabled(chat_id, False)
     
-    tasks_to_cancel = []
-    for task_key, task in kick_tasks.items():
-        if task_key.startswith(f"{chat_id}_"):
-            tasks_to_cancel.append(task_key)
-    
-    for task_key in tasks_to_cancel:
-        kick_tasks[task_key].cancel()
-        del kick_tasks[task_key]
+    kick_scheduler.cancel_chat(chat_id)
+    await raid_guard.release(context.bot, chat_id)
     
     if chat_id in pending_users:
+        pending_store.delete_chat(chat_id, pending_users[chat_id].keys())
         del pending_users[chat_id]
     
     await update.message.reply_text("❌ تم إلغاء تفعيل نظام الحماية.")
@@ -360,7 +328,7 @@ async def new_member_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
     """معالج الأعضاء الجدد"""
     chat_id = update.effective_chat.id
     
-    if not protection_enabled.get(chat_id, False):
+    if not await chat_registry.is_enabled(chat_id):
         return
     
     new_users_to_process = []
@@ -372,39 +340,42 @@ async def new_member_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if not new_users_to_process:
         return
     
-    for new_user in new_users_to_process:
-        user_id = new_user.id
-        
-        if new_user.is_bot:
-            continue
-        
-        question, correct_answer = CaptchaGenerator.generate_math_captcha()
-        options = CaptchaGenerator.generate_options(correct_answer)
-        
-        keyboard = []
-        for i, option in enumerate(options):
-            keyboard.append([InlineKeyboardButton(str(option), callback_data=f"captcha_{user_id}_{option}")])
-        
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        
-        if chat_id not in pending_users:
-            pending_users[chat_id] = {}
-        
-        pending_users[chat_id][user_id] = {
-            'correct_answer': correct_answer,
-            'join_time': datetime.now(),
-            'username': new_user.username or new_user.first_name,
-            'wrong_attempts': 0
-        }
-        
-        try:
-            await context.bot.restrict_chat_member(
+    # موجة انضمام: قفل المجموعة مرة واحدة وسؤال مشترك بدلاً من تقييد ورسالة لكل عضو
+    humans = [user for user in new_users_to_process if not user.is_bot]
+    # إذا تعذر قفل المجموعة تُعالج الموجة عضواً عضواً
+    if humans and raid_guard.check(chat_id, len(humans)) and await raid_guard.admit(context.bot, chat_id, humans):
+        return
+    
+    # كل عضو يُعالج في مهمة مستقلة؛ فشل أحدهم لا يوقف الباقين ويُسجل باسمه
+    results = await asyncio.gather(
+        *(challenge_new_member(context.bot, chat_id, new_user) for new_user in humans), return_exceptions=True
+    )
+    failed = 0
+    for new_user, result in zip(humans, results):
+        if isinstance(result, Exception):
+            failed += 1
+            logger.error(f"خطأ في معالجة العضو الجديد {new_user.id} في {chat_id}: {result}")
+    if failed and len(humans) > 1:
+        logger.warning(f"Captcha fan-out in {chat_id}: {failed} of {len(humans)} new members failed.")
+
+async def challenge_new_member(bot, chat_id: int, new_user):
+    """تقييد العضو الجديد وإرسال سؤاله معاً، ضمن حد العمليات المتزامنة للمجموعة"""
+    user_id = new_user.id
+    question, correct_answer, options = captcha_pool.pop()
+    deadline = int(time.time()) + CAPTCHA_TIMEOUT
+    reply_markup = captcha_signer.keyboard(chat_id, user_id, correct_answer, options, deadline)
+    
+    record = pending_users.setdefault(chat_id, {})[user_id] = PendingRecord(new_user.username or new_user.first_name, deadline)
+    
+    async with new_member_limiter.slot(chat_id):
+        # الإجابة موقعة في الزر ولا تحتاج إلى التقييد، فيُرسلان معاً بدلاً من رحلتين متتاليتين
+        restricted, captcha_message = await asyncio.gather(
+            bot.restrict_chat_member(
                 chat_id=chat_id,
                 user_id=user_id,
                 permissions=telegram.ChatPermissions(can_send_messages=False)
-            )
-            
-            captcha_message = await context.bot.send_message(
+            ),
+            bot.send_message(
                 chat_id=chat_id,
                 text=f"مرحباً {new_user.mention_html()}!\n\n"
                      f"لضمان أنك لست بوت، يرجى حل هذا السؤال:\n\n"
@@ -412,124 +383,185 @@ async def new_member_handler(update: Update, context: ContextTypes.DEFAULT_TYPE)
                      f"⏰ لديك 30 دقيقة لحل السؤال، وإلا سيتم طردك تلقائياً.",
                 reply_markup=reply_markup,
                 parse_mode='HTML'
-            )
-            
-            pending_users[chat_id][user_id]['message_id'] = captcha_message.message_id
-            
-            task_key = f"{chat_id}_{user_id}"
-            kick_task = asyncio.create_task(
-                schedule_kick(context, chat_id, user_id, captcha_message.message_id)
-            )
-            kick_tasks[task_key] = kick_task
-            
-        except Exception as e:
-            logger.error(f"خطأ في معالجة العضو الجديد: {e}")
+            ),
+            return_exceptions=True,
+        )
+    
+    if isinstance(restricted, Exception) or isinstance(captcha_message, Exception):
+        if pending_users.get(chat_id, {}).get(user_id) is record:
+            forget_pending_captcha(chat_id, user_id)
+        # سؤال بلا تقييد لا معنى له
+        if not isinstance(captcha_message, Exception):
+            try:
+                await bot.delete_message(chat_id=chat_id, message_id=captcha_message.message_id)
+            except Exception as e:
+                logger.error(f"خطأ في حذف رسالة الكابتشا للمستخدم {user_id} من {chat_id}: {e}")
+        # وتقييد بلا سؤال يترك العضو صامتاً دون مهلة طرد ولا زر لحله، فيُرفع
+        elif not isinstance(restricted, Exception):
+            try:
+                await bot.restrict_chat_member(chat_id=chat_id, user_id=user_id, permissions=MEMBER_PERMISSIONS)
+            except Exception as e:
+                logger.error(f"خطأ في رفع تقييد المستخدم {user_id} في {chat_id} بعد فشل إرسال الكابتشا: {e}")
+        if isinstance(restricted, Exception):
+            raise restricted
+        raise captcha_message
+    
+    record.message_id = captcha_message.message_id
+    pending_store.save(chat_id, user_id, record.to_record())
+    
+    kick_scheduler.schedule(chat_id, user_id, captcha_message.message_id, deadline=deadline)
+
+def legacy_captcha_token(chat_id: int, data: str):
+    """أزرار captcha_{user_id}_{option} الصادرة قبل التوقيع، تُقبل حتى تنتهي مهلتها"""
+    match = re.fullmatch(r"captcha_(\d+)_(\d+)", data or "")
+    record = match and pending_users.get(chat_id, {}).get(int(match[1]))
+    if not record or record.correct_answer is None:
+        return None
+    option = int(match[2])
+    return CaptchaToken(int(match[1]), record.deadline, record.wrong_attempts, option, option == record.correct_answer)
 
 async def captcha_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """معالج إجابات الكابتشا"""
     query = update.callback_query
-    await query.answer()
-    
     chat_id = update.effective_chat.id
-    callback_data = query.data
     
-    if not callback_data.startswith("captcha_"):
-        return
-    
-    parts = callback_data.split("_")
-    if len(parts) != 3:
-        return
-    
-    user_id = int(parts[1])
-    selected_answer = int(parts[2])
-    
-    if chat_id not in pending_users or user_id not in pending_users[chat_id]:
+    # بيانات الزر موقعة وتحمل كل ما يلزم للتحقق، فلا حاجة إلى pending_users وتعمل الإجابة لدى أي نسخة من البوت
+    token = captcha_signer.verify(chat_id, query.data) or legacy_captcha_token(chat_id, query.data)
+    if token is None or token.expires_at <= time.time():
+        await query.answer()
         await query.edit_message_text("❌ انتهت صلاحية هذا السؤال.")
         return
     
+    user_id = token.user_id
     if query.from_user.id != user_id:
         await query.answer("❌ يمكنك فقط الإجابة على سؤالك الخاص!", show_alert=True)
         return
     
-    user_data = pending_users[chat_id][user_id]
-    correct_answer = user_data['correct_answer']
-    
-    if selected_answer == correct_answer:
+    await query.answer()
+    if token.correct:
         try:
             await context.bot.restrict_chat_member(
                 chat_id=chat_id,
                 user_id=user_id,
-                permissions=telegram.ChatPermissions(
-                    can_send_messages=True,
-                    can_send_polls=True,
-                    can_send_other_messages=True,
-                    can_add_web_page_previews=True,
-                    can_change_info=False,
-                    can_invite_users=True,
-                    can_pin_messages=False,
-                )
+                permissions=MEMBER_PERMISSIONS,
             )
             
-            task_key = f"{chat_id}_{user_id}"
-            if task_key in kick_tasks:
-                kick_tasks[task_key].cancel()
-                del kick_tasks[task_key]
+            kick_scheduler.cancel(chat_id, user_id)
             await context.bot.send_message(chat_id, f"✅ أحسنت! {query.from_user.mention_html()} لقد أجبت بشكل صحيح. تم فك التقييد عنك.", parse_mode='HTML')
             await context.bot.delete_message(chat_id=chat_id, message_id=query.message.message_id)
             
-            del pending_users[chat_id][user_id]
+            forget_pending_captcha(chat_id, user_id)
             
-            log_captcha_event(user_id, chat_id, 'success')
+            await log_captcha_event(user_id, chat_id, 'success')
         except Exception as e:
             logger.error(f"خطأ في إلغاء تقييد العضو: {e}")
     else:
-        user_data['wrong_attempts'] += 1
+        wrong_attempts = token.attempts + 1
         
-        if user_data['wrong_attempts'] >= 3:
+        if wrong_attempts >= 3:
             await query.edit_message_text("❌ لقد تجاوزت الحد الأقصى لعدد المحاولات. سيتم طردك.")
-            await context.bot.kick_chat_member(chat_id, user_id)
-            log_captcha_event(user_id, chat_id, 'kicked')
-            
-            task_key = f"{chat_id}_{user_id}"
-            if task_key in kick_tasks:
-                kick_tasks[task_key].cancel()
-                del kick_tasks[task_key]
+            await context.bot.ban_chat_member(chat_id, user_id)
+            await log_captcha_event(user_id, chat_id, 'kicked')
             
-            if chat_id in pending_users and user_id in pending_users[chat_id]:
-                del pending_users[chat_id][user_id]
+            kick_scheduler.cancel(chat_id, user_id)
+            forget_pending_captcha(chat_id, user_id)
         else:
-            question, correct_answer = CaptchaGenerator.generate_math_captcha()
-            options = CaptchaGenerator.generate_options(correct_answer)
-            keyboard = []
-            for i, option in enumerate(options):
-                keyboard.append([InlineKeyboardButton(str(option), callback_data=f"captcha_{user_id}_{option}")])
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            pending_users[chat_id][user_id]['correct_answer'] = correct_answer
+            # سؤال جديد بأزرار تحمل عدد المحاولات الجديد ونفس المهلة
+            question, correct_answer, options = captcha_pool.pop()
+            reply_markup = captcha_signer.keyboard(chat_id, user_id, correct_answer, options, token.expires_at, wrong_attempts)
             
             await query.edit_message_text(
                 f"❌ إجابة خاطئة. حاول مرة أخرى.\n\n❓ {question}",
                 reply_markup=reply_markup
             )
 
-async def schedule_kick(context: ContextTypes.DEFAULT_TYPE, chat_id: int, user_id: int, message_id: int):
-    """جدولة طرد المستخدم إذا لم يحل الكابتشا في الوقت المحدد"""
-    await asyncio.sleep(1800)  # 30 minutes
-    
-    task_key = f"{chat_id}_{user_id}"
-    if task_key in kick_tasks:
-        del kick_tasks[task_key]
-
+def forget_pending_captcha(chat_id: int, user_id: int):
+    """حذف الكابتشا المعلقة من الذاكرة المحلية (إن كانت صادرة من هذه النسخة) ومن المخزن المشترك"""
+    chat_pending = pending_users.get(chat_id)
+    if chat_pending is not None:
+        chat_pending.pop(user_id, None)
+    pending_store.delete(chat_id, user_id)
+
+async def expire_captchas(batch):
+    """طرد دفعة من الأعضاء الذين انتهت مهلة الكابتشا الخاصة بهم"""
+    await asyncio.gather(*(
+        raid_guard.expire(application.bot, chat_id, message_id) if user_id == COHORT_KEY
+        else expire_captcha(chat_id, user_id, message_id)
+        for _, chat_id, user_id, message_id in batch
+    ))
+
+async def expire_captcha(chat_id: int, user_id: int, message_id: int):
+    """طرد المستخدم إذا لم يحل الكابتشا في الوقت المحدد"""
     if chat_id in pending_users and user_id in pending_users[chat_id]:
         try:
-            await context.bot.kick_chat_member(chat_id, user_id)
-            await context.bot.send_message(chat_id, f"⏰ انتهى الوقت! تم طرد {pending_users[chat_id][user_id]['username']} لعدم حل الكابتشا.")
-            await context.bot.delete_message(chat_id=chat_id, message_id=message_id)
-            log_captcha_event(user_id, chat_id, 'timeout')
+            # ربما حل العضو الكابتشا لدى نسخة أخرى من البوت؛ حالة التقييد في Telegram هي المرجع المشترك
+            member = await application.bot.get_chat_member(chat_id, user_id)
+            if member.status in (ChatMember.MEMBER, ChatMember.ADMINISTRATOR, ChatMember.OWNER) or (
+                member.status == ChatMember.RESTRICTED and member.can_send_messages
+            ):
+                forget_pending_captcha(chat_id, user_id)
+                return
+            
+            await application.bot.ban_chat_member(chat_id, user_id)
+            await application.bot.send_message(chat_id, f"⏰ انتهى الوقت! تم طرد {pending_users[chat_id][user_id].username} لعدم حل الكابتشا.")
+            await application.bot.delete_message(chat_id=chat_id, message_id=message_id)
+            await log_captcha_event(user_id, chat_id, 'timeout')
             del pending_users[chat_id][user_id]
+            pending_store.delete(chat_id, user_id)
         except Exception as e:
             logger.error(f"خطأ في طرد العضو بعد انتهاء الوقت: {e}")
 
+# مجدول واحد لجميع مواعيد الطرد
+# حتى KICK_BATCH_CONCURRENCY دفعة طرد تُعالج معاً حتى لا تؤخر دفعة بطيئة المهل المستحقة بعدها
+kick_scheduler = DeadlineScheduler(expire_captchas, max_in_flight=int(os.getenv("KICK_BATCH_CONCURRENCY", 4)))
+
+# حد عمليات تقييد/إرسال الكابتشا المتزامنة لكل مجموعة عند انضمام عدة أعضاء معاً
+new_member_limiter = ChatLimiter(int(os.getenv("NEW_MEMBER_CONCURRENCY", 10)))
+
+# تخزين دائم للكابتشا المعلقة
+# STATE_BACKEND: mongodb (الافتراضي)، memory://، sqlite:///path أو redis://host:port/db
+# مع SQLite تُحفظ الكابتشا المعلقة في نفس الملف افتراضياً
+pending_store = PendingCaptchaStore(create_state_backend(
+    os.getenv('STATE_BACKEND', DATABASE_URL if USE_SQLITE else 'mongodb'), repository
+))
+
+# موجات الانضمام: فوق RAID_JOIN_THRESHOLD انضمام خلال RAID_WINDOW_SECONDS تُقفل المجموعة ويُنشر سؤال مشترك
+raid_guard = RaidGuard(
+    pending_users,
+    pending_store,
+    kick_scheduler,
+    log_captcha_event,
+    captcha_pool.pop,
+    threshold=int(os.getenv("RAID_JOIN_THRESHOLD", 10)),
+    window=float(os.getenv("RAID_WINDOW_SECONDS", 10)),
+    timeout=float(os.getenv("RAID_CAPTCHA_TIMEOUT", 5 * 60)),
+)
+
+async def admin_change_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """إلغاء قائمة المشرفين المخزنة عند ترقية عضو أو تنزيله"""
+    admin_roster.observe(update.chat_member)
+
+async def raid_callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """معالج إجابات سؤال موجة الانضمام المشترك"""
+    await raid_guard.answer(update.callback_query)
+
+async def restore_pending_captchas():
+    """استعادة الكابتشا المعلقة بعد إعادة التشغيل؛ من انتهت مهلتهم يطردهم المجدول فوراً في الخلفية"""
+    now = time.time()
+    overdue = 0
+    for doc in await pending_store.load_all():
+        chat_id = doc.pop('chat_id')
+        user_id = doc.pop('user_id')
+        if raid_guard.restore(chat_id, user_id, doc):
+            continue
+        record = pending_users.setdefault(chat_id, {})[user_id] = PendingRecord.from_record(doc)
+        # لا يُنتظر طرد المتأخرين هنا حتى لا يتأخر بدء استقبال التحديثات
+        if record.deadline <= now:
+            overdue += 1
+        kick_scheduler.schedule(chat_id, user_id, record.message_id, deadline=record.deadline)
+    if overdue:
+        logger.info(f"Reconciling {overdue} overdue captchas after restart in the background.")
+
 async def dev_commands_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """قائمة أوامر المطورين"""
     query = update.callback_query
@@ -560,10 +592,21 @@ async def dev_bot_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text("عذراً، هذه الأوامر مخصصة للمطورين فقط.")
         return
     
-    stats = get_bot_stats()
+    stats = await get_bot_stats()
     message_text = f"📊 إحصائيات البوت:\n\n"
     message_text += f"عدد المجموعات: {stats['total_chats']}\n"
     message_text += f"عدد المستخدمين: {stats['total_users']}\n"
+    requests = outbound.snapshot()
+    message_text += (
+        f"\n📤 الطلبات الصادرة: {requests['requests']}، بانتظار الإرسال {requests['waiting']} (أقصى {requests['peak_waiting']})\n"
+        f"مؤخرة {requests['throttled']} بإجمالي {requests['throttle_seconds']:.1f}s، "
+        f"RetryAfter {requests['retry_after']} ({requests['retry_after_seconds']:.0f}s)\n"
+    )
+    pool = bot_request.snapshot()
+    message_text += (
+        f"🔌 مجمع الاتصالات: {pool['in_flight']}/{pool['pool_size']} مشغولة، "
+        f"انتظر {pool['waited']} طلب بمتوسط {pool['avg_wait_ms']:.1f}ms وأقصى {pool['max_wait_ms']:.1f}ms\n"
+    )
 
     keyboard = [[InlineKeyboardButton("🔙 رجوع", callback_data="dev_commands_menu")]]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -598,7 +641,7 @@ async def admin_chat_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text("عذراً، هذه الأوامر مخصصة للمشرفين الذين قاموا بتفعيل البوت في مجموعاتهم فقط.")
         return
     
-    stats = get_stats(chat_id=chat_id)
+    stats = await get_stats(chat_id=chat_id)
     message_text = f"📊 إحصائيات الكابتشا للمجموعة:\n\n"
     message_text += f"إجابات صحيحة: {stats['success']}\n"
     message_text += f"تم طردهم: {stats['kicked']}\n"
@@ -608,10 +651,38 @@ async def admin_chat_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     reply_markup = InlineKeyboardMarkup(keyboard)
     await query.edit_message_text(message_text, reply_markup=reply_markup)
 
+async def on_startup(app: Application):
+    """تشغيل المهام الخلفية بعد تهيئة التطبيق"""
+    kick_scheduler.start()
+    await chat_registry.warm_up()
+    await activating_admins.warm_up()
+    await pending_store.open()
+    await restore_pending_captchas()
+
+async def on_shutdown(app: Application):
+    """إيقاف المهام الخلفية عند إيقاف التطبيق"""
+    await kick_scheduler.stop()
+    await pending_store.stop()
+    await captcha_events.stop()
+    await user_updates.stop()
+    await chat_updates.stop()
+    repository.shutdown()
+
 def start_bot():
     """دالة التشغيل الرئيسية للبوت"""
+    global application
     init_database() # Initialize MongoDB
-    application = Application.builder().token(BOT_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .concurrent_updates(ChatOrderedUpdateProcessor(workers=UPDATE_WORKERS))
+        .request(bot_request)
+        .get_updates_request(get_updates_request)
+        .rate_limiter(outbound)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
 
 
     # Handlers
@@ -619,7 +690,9 @@ def start_bot():
     application.add_handler(CommandHandler("enable", enable_protection))
     application.add_handler(CommandHandler("disable", disable_protection))
     application.add_handler(MessageHandler(filters.StatusUpdate.NEW_CHAT_MEMBERS, new_member_handler))
-    application.add_handler(CallbackQueryHandler(captcha_callback_handler, pattern=r"^captcha_\\d+_\\d+$"))
+    application.add_handler(ChatMemberHandler(admin_change_handler, ChatMemberHandler.CHAT_MEMBER))
+    application.add_handler(CallbackQueryHandler(captcha_callback_handler, pattern=r"^captcha_"))
+    application.add_handler(CallbackQueryHandler(raid_callback_handler, pattern=r"^raid_\d+$"))
     application.add_handler(CallbackQueryHandler(dev_commands_menu, pattern=r"^dev_commands_menu$"))
     application.add_handler(CallbackQueryHandler(admin_commands_menu, pattern=r"^admin_commands_menu$"))
     application.add_handler(CallbackQueryHandler(dev_bot_stats, pattern=r"^dev_bot_stats$"))
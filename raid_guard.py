@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+وضع موجات الانضمام (raid)
+عند تجاوز معدل الانضمام في مجموعة تُقفل المجموعة مؤقتاً بدلاً من تقييد كل عضو، ويُنشر سؤال واحد
+مشترك يجيب عليه كل عضو جديد بنفسه، وللدفعة كلها مهلة واحدة تنتهي بطرد من لم يتحقق ثم رفع القفل
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+import telegram
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from pending_record import PendingRecord
+
+logger = logging.getLogger(__name__)
+
+# مفتاح الدفعة في المجدول ومخزن الكابتشا المعلقة (معرفات مستخدمي Telegram موجبة دائماً)
+COHORT_KEY = 0
+
+# عدد محاولات الطرد المتزامنة عند انتهاء مهلة الدفعة
+KICK_CONCURRENCY = 20
+
+
+class JoinRateMonitor:
+    """عدد الانضمامات لكل مجموعة خلال نافذة زمنية منزلقة"""
+
+    def __init__(self, threshold: int = 10, window: float = 10.0):
+        self._threshold = threshold
+        self._window = window
+        # chat_id -> (طوابع (الوقت، العدد)، المجموع داخل النافذة)
+        self._joins: Dict[int, Tuple[deque, List[int]]] = {}
+        self._next_prune = time.monotonic() + window
+
+    def record(self, chat_id: int, count: int = 1) -> bool:
+        """تسجيل انضمامات جديدة؛ تُرجع True إذا تجاوز المعدل الحد"""
+        now = time.monotonic()
+        # حذف المجموعات الخاملة مرة كل نافذة، حتى لا تبقى كل مجموعة سجلت انضماماً في الذاكرة
+        if now >= self._next_prune:
+            self.prune()
+            self._next_prune = now + self._window
+        entry = self._joins.get(chat_id)
+        if entry is None:
+            entry = self._joins[chat_id] = (deque(), [0])
+        stamps, total = entry
+        stamps.append((now, count))
+        total[0] += count
+        while stamps and stamps[0][0] <= now - self._window:
+            total[0] -= stamps.popleft()[1]
+        return total[0] > self._threshold
+
+    def prune(self):
+        """حذف المجموعات التي لم تسجل انضماماً خلال النافذة"""
+        cutoff = time.monotonic() - self._window
+        for chat_id in [chat_id for chat_id, (stamps, _) in self._joins.items() if stamps[-1][0] <= cutoff]:
+            del self._joins[chat_id]
+
+
+class RaidCohort:
+    """دفعة أعضاء موجة الانضمام في مجموعة: رسالة واحدة وسؤال واحد ومهلة واحدة"""
+
+    def __init__(self, chat_id: int, message_id: int, deadline: float, correct_answer: int, permissions: dict = None):
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.deadline = deadline
+        self.correct_answer = correct_answer
+        # صلاحيات المجموعة قبل القفل لإعادتها بعد انتهاء الدفعة
+        self.permissions = permissions
+
+    def to_record(self) -> dict:
+        return {
+            "cohort": True,
+            "message_id": self.message_id,
+            "deadline": self.deadline,
+            "correct_answer": self.correct_answer,
+            "permissions": self.permissions,
+        }
+
+
+class RaidGuard:
+    """كشف موجات الانضمام وإدارة دفعاتها فوق pending_users ومخزن الكابتشا والمجدول"""
+
+    def __init__(
+        self,
+        pending_users: Dict[int, Dict[int, PendingRecord]],
+        pending_store,
+        scheduler,
+        log_event: Callable[[int, int, str], Awaitable[None]],
+        make_captcha: Callable[[], Tuple[str, int, List[int]]],
+        threshold: int = 10,
+        window: float = 10.0,
+        timeout: float = 5 * 60,
+        max_attempts: int = 2,
+    ):
+        self._pending_users = pending_users
+        self._pending_store = pending_store
+        self._scheduler = scheduler
+        self._log_event = log_event
+        self._make_captcha = make_captcha
+        self._timeout = timeout
+        self._max_attempts = max_attempts
+        self._monitor = JoinRateMonitor(threshold, window)
+        self._cohorts: Dict[int, RaidCohort] = {}
+        # chat_id -> نهاية مهلة عدم محاولة القفل بعد فشله (تُعالج الانضمامات عضواً عضواً حتى ذلك الحين)
+        self._lock_failures: Dict[int, float] = {}
+        self._lock_retry = window
+
+    def __len__(self) -> int:
+        return len(self._cohorts)
+
+    def check(self, chat_id: int, count: int) -> bool:
+        """تسجيل انضمامات؛ تُرجع True إذا يجب معالجتها كموجة (دفعة قائمة أو معدل مرتفع)"""
+        raid = self._monitor.record(chat_id, count)
+        if chat_id in self._cohorts:
+            return True
+        if raid and chat_id in self._lock_failures:
+            if time.monotonic() < self._lock_failures[chat_id]:
+                return False
+            del self._lock_failures[chat_id]
+        return raid
+
+    async def admit(self, bot, chat_id: int, users) -> int:
+        """إضافة أعضاء جدد إلى دفعة المجموعة، مع إنشائها (قفل + رسالة السؤال) إن لم تكن قائمة؛
+        تُرجع 0 إذا تعذر فتح الدفعة، فيجب تقييد الأعضاء واحداً واحداً"""
+        cohort = self._cohorts.get(chat_id)
+        if cohort is None:
+            cohort = await self._open(bot, chat_id)
+            if cohort is None:
+                return 0
+
+        chat_pending = self._pending_users.setdefault(chat_id, {})
+        for user in users:
+            record = chat_pending[user.id] = PendingRecord(
+                user.username or user.first_name,
+                deadline=cohort.deadline,
+                message_id=cohort.message_id,
+                correct_answer=cohort.correct_answer,
+                cohort=True,
+            )
+            self._pending_store.save(chat_id, user.id, record.to_record())
+        return len(users)
+
+    async def answer(self, query) -> None:
+        """التحقق من إجابة عضو على سؤال الدفعة المشترك"""
+        chat_id = query.message.chat.id
+        user = query.from_user
+        cohort = self._cohorts.get(chat_id)
+        if cohort is None or cohort.message_id != query.message.message_id:
+            await query.answer("❌ انتهت صلاحية هذا السؤال.", show_alert=True)
+            return
+
+        record = self._pending_users.get(chat_id, {}).get(user.id)
+        if record is None or not record.cohort:
+            await query.answer("هذا السؤال مخصص للأعضاء الجدد فقط.", show_alert=True)
+            return
+
+        selected_answer = int(query.data.split("_")[1])
+        if selected_answer == cohort.correct_answer:
+            self._forget(chat_id, user.id)
+            await query.answer("✅ تم التحقق منك. ستتمكن من الكتابة عند رفع القفل المؤقت عن المجموعة.", show_alert=True)
+            await self._log_event(user.id, chat_id, "success")
+            return
+
+        record.wrong_attempts += 1
+        if record.wrong_attempts < self._max_attempts:
+            self._pending_store.save(chat_id, user.id, record.to_record())
+            await query.answer("❌ إجابة خاطئة. حاول مرة أخرى.", show_alert=True)
+            return
+
+        self._forget(chat_id, user.id)
+        await query.answer("❌ لقد فشلت في حل الكابتشا بعد عدة محاولات. سيتم طردك.", show_alert=True)
+        await self._kick(query.get_bot(), chat_id, user.id)
+        await self._log_event(user.id, chat_id, "kicked")
+
+    async def expire(self, bot, chat_id: int, message_id: int):
+        """انتهاء مهلة الدفعة: طرد من لم يتحقق، حذف رسالة السؤال، ثم رفع القفل"""
+        cohort = self._cohorts.get(chat_id)
+        if cohort is None or cohort.message_id != message_id:
+            return
+        del self._cohorts[chat_id]
+
+        chat_pending = self._pending_users.get(chat_id, {})
+        members = [
+            user_id for user_id, record in chat_pending.items()
+            if record.cohort and record.message_id == message_id
+        ]
+        for user_id in members:
+            self._forget(chat_id, user_id)
+
+        semaphore = asyncio.Semaphore(KICK_CONCURRENCY)
+
+        async def expire_member(user_id: int):
+            async with semaphore:
+                await self._kick(bot, chat_id, user_id)
+            await self._log_event(user_id, chat_id, "timeout")
+
+        await asyncio.gather(*(expire_member(user_id) for user_id in members))
+        logger.info(f"Raid cohort in {chat_id} expired; kicked {len(members)} unverified members.")
+
+        await self._close(bot, cohort)
+        try:
+            await bot.send_message(
+                chat_id, f"⏰ انتهت مهلة التحقق. تم طرد {len(members)} عضو لم يحل الكابتشا ورُفع القفل عن المجموعة."
+            )
+        except Exception as e:
+            logger.error(f"خطأ في إرسال ملخص موجة الانضمام في {chat_id}: {e}")
+
+    async def release(self, bot, chat_id: int):
+        """إنهاء دفعة المجموعة دون طرد (مثلاً عند إلغاء تفعيل الحماية) ورفع القفل"""
+        cohort = self._cohorts.pop(chat_id, None)
+        if cohort is not None:
+            await self._close(bot, cohort)
+
+    def restore(self, chat_id: int, user_id: int, doc: dict) -> bool:
+        """استعادة سجل من مخزن الكابتشا بعد إعادة التشغيل؛ تُرجع True إذا كان السجل تابعاً لدفعة"""
+        if user_id == COHORT_KEY:
+            cohort = RaidCohort(
+                chat_id, doc["message_id"], doc["deadline"], doc["correct_answer"], doc.get("permissions")
+            )
+            self._cohorts[chat_id] = cohort
+            # المهلة المنقضية تُطلق فوراً من المجدول
+            self._scheduler.schedule(chat_id, COHORT_KEY, cohort.message_id, deadline=cohort.deadline)
+            return True
+        if doc.get("cohort"):
+            self._pending_users.setdefault(chat_id, {})[user_id] = PendingRecord.from_record(doc)
+            return True
+        return False
+
+    async def _open(self, bot, chat_id: int):
+        question, correct_answer, options = self._make_captcha()
+        permissions = None
+        try:
+            chat = await bot.get_chat(chat_id)
+            if chat.permissions is not None:
+                permissions = chat.permissions.to_dict()
+            # قفل واحد للمجموعة بدلاً من restrict_chat_member لكل عضو جديد
+            await bot.set_chat_permissions(chat_id, telegram.ChatPermissions.no_permissions())
+        except Exception as e:
+            # دفعة بلا قفل تترك الأعضاء الجدد بلا أي تقييد حتى انتهاء المهلة
+            logger.error(f"Failed to lock chat {chat_id} during join raid, falling back to per-user captchas: {e}")
+            now = time.monotonic()
+            for stale in [stale for stale, until in self._lock_failures.items() if until <= now]:
+                del self._lock_failures[stale]
+            self._lock_failures[chat_id] = now + self._lock_retry
+            return None
+
+        keyboard = [[InlineKeyboardButton(str(option), callback_data=f"raid_{option}") for option in options]]
+        minutes = int(self._timeout // 60)
+        try:
+            message = await bot.send_message(
+                chat_id=chat_id,
+                text=f"🚨 تم رصد موجة انضمام كبيرة، وأُقفلت المجموعة مؤقتاً.\n\n"
+                     f"على جميع الأعضاء الجدد حل هذا السؤال للتحقق:\n\n"
+                     f"❓ {question}\n\n"
+                     f"⏰ من لا يحل السؤال خلال {minutes} دقائق سيتم طرده، ثم يُرفع القفل.",
+                reply_markup=InlineKeyboardMarkup(keyboard),
+            )
+        except Exception as e:
+            logger.error(f"Failed to post raid captcha in {chat_id}: {e}")
+            await self._unlock(bot, chat_id, permissions)
+            return None
+
+        cohort = RaidCohort(chat_id, message.message_id, time.time() + self._timeout, correct_answer, permissions)
+        self._cohorts[chat_id] = cohort
+        self._pending_store.save(chat_id, COHORT_KEY, cohort.to_record())
+        self._scheduler.schedule(chat_id, COHORT_KEY, cohort.message_id, deadline=cohort.deadline)
+        logger.warning(f"Join raid detected in {chat_id}; opened cohort until {cohort.deadline:.0f}.")
+        return cohort
+
+    async def _close(self, bot, cohort: RaidCohort):
+        self._scheduler.cancel(cohort.chat_id, COHORT_KEY)
+        self._pending_store.delete(cohort.chat_id, COHORT_KEY)
+        try:
+            await bot.delete_message(chat_id=cohort.chat_id, message_id=cohort.message_id)
+        except Exception as e:
+            logger.error(f"خطأ في حذف رسالة موجة الانضمام في {cohort.chat_id}: {e}")
+        await self._unlock(bot, cohort.chat_id, cohort.permissions)
+
+    @staticmethod
+    async def _unlock(bot, chat_id: int, permissions: dict):
+        try:
+            if permissions is not None:
+                restored = telegram.ChatPermissions.de_json(permissions, bot)
+            else:
+                restored = telegram.ChatPermissions(
+                    can_send_messages=True,
+                    can_send_polls=True,
+                    can_send_other_messages=True,
+                    can_add_web_page_previews=True,
+                    can_invite_users=True,
+                )
+            await bot.set_chat_permissions(chat_id, restored)
+        except Exception as e:
+            logger.error(f"Failed to unlock chat {chat_id} after join raid: {e}")
+
+    @staticmethod
+    async def _kick(bot, chat_id: int, user_id: int):
+        try:
+            await bot.ban_chat_member(chat_id=chat_id, user_id=user_id)
+        except Exception as e:
+            logger.error(f"خطأ في طرد المستخدم {user_id} من {chat_id}: {e}")
+
+    def _forget(self, chat_id: int, user_id: int):
+        chat_pending = self._pending_users.get(chat_id)
+        if chat_pending is not None:
+            chat_pending.pop(user_id, None)
+        self._pending_store.delete(chat_id, user_id)
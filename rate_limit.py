@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+أدوات تحديد معدل الإرسال إلى Telegram Bot API
+"""
+
+import asyncio
+import time
+from datetime import timedelta
+
+
+def retry_after_seconds(error) -> float:
+    """مدة الانتظار المطلوبة في خطأ RetryAfter بالثواني (int أو timedelta حسب إصدار المكتبة)"""
+    value = error.retry_after
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return float(value)
+
+
+class TokenBucket:
+    """دلو رموز: rate رمز في الثانية بسعة capacity، مع إمكانية الإيقاف المؤقت بعد RetryAfter"""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+
+    def try_acquire(self) -> float:
+        """أخذ رمز إن توفر؛ تُرجع 0 عند النجاح أو عدد الثواني الواجب انتظارها"""
+        now = time.monotonic()
+        if now < self._paused_until:
+            return self._paused_until - now
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+    async def acquire(self) -> float:
+        """الانتظار حتى يتوفر رمز؛ تُرجع إجمالي زمن الانتظار"""
+        waited = 0.0
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return waited
+            waited += wait
+            await asyncio.sleep(wait)
+
+    def paused(self) -> float:
+        """الثواني المتبقية من الإيقاف المؤقت (0 إن لم يكن موقوفاً)"""
+        return max(0.0, self._paused_until - time.monotonic())
+
+    def is_idle(self) -> bool:
+        """هل الدلو ممتلئ وغير موقوف؟ (حذفه لا يغير شيئاً)"""
+        now = time.monotonic()
+        return now >= self._paused_until and self._tokens + (now - self._updated) * self.rate >= self.capacity
+
+    def pause(self, seconds: float):
+        """إيقاف الإرسال مؤقتاً (مثلاً بعد RetryAfter من Telegram)"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+        self._updated = self._paused_until
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+توزيع المجموعات على عدة عمليات
+كل مجموعة يملكها عامل واحد (abs(chat_id) % shards)، فتبقى حالتها في ذاكرة ذلك العامل
+(pending_users ومواعيد الطرد وقفل موجات الانضمام) دون أي تنسيق بين العمليات
+"""
+
+import logging
+import queue
+from typing import List
+
+from update_processor import update_chat_id
+
+logger = logging.getLogger(__name__)
+
+
+def shard_of(chat_id: int, shards: int) -> int:
+    """رقم العامل المسؤول عن المجموعة"""
+    return abs(chat_id) % shards
+
+
+class ShardRouter:
+    """يوجه كل تحديث إلى طابور العامل المسؤول عن محادثته؛ له واجهة UpdateQueue.put نفسها"""
+
+    def __init__(self, queues: List):
+        self._queues = queues
+        self.routed = [0] * len(queues)
+        self.rejected = 0
+
+    def put(self, update) -> bool:
+        """تحويل التحديث إلى العامل دون انتظار؛ تُرجع False إذا كان طابوره ممتلئاً"""
+        chat_id = update_chat_id(update)
+        # التحديثات التي لا تتبع محادثة يعالجها العامل الأول
+        shard = shard_of(chat_id, len(self._queues)) if chat_id is not None else 0
+        try:
+            self._queues[shard].put_nowait(update.to_dict())
+        except queue.Full:
+            self.rejected += 1
+            return False
+        self.routed[shard] += 1
+        return True
+
+    def close(self):
+        """إشارة إيقاف لكل عامل بعد آخر تحديث في طابوره"""
+        for shard_queue in self._queues:
+            shard_queue.put(None)
+
+    def snapshot(self) -> dict:
+        return {"shards": len(self._queues), "routed": list(self.routed), "rejected": self.rejected}
@@ -0,0 +1,305 @@
+# -*- coding: utf-8 -*-
+"""
+تخزين SQLite مضمّن للنشر على جهاز واحد
+نفس واجهة MongoRepository التي تستخدمها المخازن في storage.py، دون رحلة شبكة لكل عملية
+اتصال واحد بوضع WAL في خيط مخصص، بجمل SQL ثابتة (يعيد sqlite3 استخدام الجمل المجهزة) ومعاملة واحدة لكل دفعة
+"""
+
+import asyncio
+import logging
+import sqlite3
+import time
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Callable, Dict, List, Optional
+
+from storage import OperationMetrics
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS captcha_stats (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    chat_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    timestamp REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS captcha_stats_chat_status ON captcha_stats (chat_id, status);
+CREATE INDEX IF NOT EXISTS captcha_stats_user ON captcha_stats (user_id, status);
+CREATE INDEX IF NOT EXISTS captcha_stats_timestamp ON captcha_stats (timestamp, status);
+
+CREATE TABLE IF NOT EXISTS captcha_counters (
+    scope TEXT NOT NULL,
+    status TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (scope, status)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS users (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT,
+    first_name TEXT,
+    unreachable INTEGER NOT NULL DEFAULT 0,
+    last_interaction REAL
+);
+
+CREATE TABLE IF NOT EXISTS chats (
+    chat_id INTEGER PRIMARY KEY,
+    chat_title TEXT,
+    protection_enabled INTEGER NOT NULL DEFAULT 0,
+    activating_admin_id INTEGER,
+    unreachable INTEGER NOT NULL DEFAULT 0,
+    last_activity REAL
+);
+CREATE INDEX IF NOT EXISTS chats_enabled ON chats (protection_enabled, chat_id);
+CREATE INDEX IF NOT EXISTS chats_activating_admin ON chats (activating_admin_id) WHERE protection_enabled = 1;
+"""
+
+# الأعمدة المسموح بتحديثها لكل جدول (أسماء الحقول هي نفسها في MongoDB)
+COLUMNS = {
+    "users": ("username", "first_name", "unreachable", "last_interaction"),
+    "chats": ("chat_title", "protection_enabled", "activating_admin_id", "unreachable", "last_activity"),
+}
+KEY_FIELDS = {"users": "user_id", "chats": "chat_id"}
+
+
+def _value(value):
+    """datetime تُخزن كثوانٍ منذ epoch"""
+    return value.timestamp() if isinstance(value, datetime) else value
+
+
+def _write(connection: sqlite3.Connection, statements) -> bool:
+    """تنفيذ [(sql, rows)] في معاملة واحدة"""
+    connection.execute("BEGIN IMMEDIATE")
+    try:
+        for sql, rows in statements:
+            connection.executemany(sql, rows)
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    return True
+
+
+class SQLiteRepository:
+    """واجهة غير حاجبة لقاعدة SQLite: جميع العمليات في خيط واحد يملك الاتصال"""
+
+    def __init__(self, path: str):
+        self._path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self._connection: Optional[sqlite3.Connection] = None
+        self.metrics = OperationMetrics()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            connection = sqlite3.connect(self._path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA temp_store=MEMORY")
+            connection.executescript(SCHEMA)
+            self._connection = connection
+            logger.info(f"SQLite database ready at {self._path}.")
+        return self._connection
+
+    def _call(self, operation: Callable, args, kwargs):
+        return operation(self._connect(), *args, **kwargs)
+
+    async def run(self, name: str, operation: Callable, *args, default=None, **kwargs):
+        """تنفيذ operation(connection, *args) في خيط SQLite مع تسجيل زمن التنفيذ"""
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        failed = False
+        try:
+            return await loop.run_in_executor(self._executor, partial(self._call, operation, args, kwargs))
+        except Exception as e:
+            failed = True
+            logger.error(f"SQLite operation {name} failed: {e}")
+            return default
+        finally:
+            self.metrics.record(name, time.perf_counter() - start, failed)
+
+    def shutdown(self):
+        """إغلاق الاتصال بعد انتهاء العمليات الجارية"""
+        def close():
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+        self._executor.submit(close)
+        self._executor.shutdown(wait=True)
+
+    async def insert_captcha_events(self, docs: List[dict]) -> List[dict]:
+        """كتابة دفعة من أحداث الكابتشا في معاملة واحدة؛ تُرجع المستندات التي لم تُكتب (كلها أو لا شيء)"""
+        rows = [(doc["user_id"], doc["chat_id"], doc["status"], _value(doc["timestamp"])) for doc in docs]
+        written = await self.run(
+            "captcha_stats.insert",
+            _write,
+            [("INSERT INTO captcha_stats (user_id, chat_id, status, timestamp) VALUES (?, ?, ?, ?)", rows)],
+            default=False,
+        )
+        return [] if written else docs
+
+    async def get_stats(self, user_id: int = None, chat_id: int = None, hours: int = None) -> dict:
+        """الحصول على إحصائيات الكابتشا"""
+        conditions, params = [], []
+        if chat_id:
+            conditions.append("chat_id = ?")
+            params.append(chat_id)
+        if user_id:
+            conditions.append("user_id = ?")
+            params.append(user_id)
+        if hours:
+            conditions.append("timestamp >= ?")
+            params.append((datetime.now() - timedelta(hours=hours)).timestamp())
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        sql = f"SELECT status, COUNT(*) FROM captcha_stats{where} GROUP BY status"
+        results = await self.run(
+            "captcha_stats.group", lambda connection: connection.execute(sql, params).fetchall(), default=[]
+        )
+        stats = {"success": 0, "kicked": 0, "timeout": 0}
+        stats.update(dict(results))
+        return stats
+
+    async def get_all_users(self) -> list:
+        """الحصول على جميع المستخدمين"""
+        return await self.run(
+            "users.select",
+            lambda connection: [row[0] for row in connection.execute("SELECT user_id FROM users WHERE unreachable = 0")],
+            default=[],
+        )
+
+    async def get_all_chats(self) -> list:
+        """الحصول على جميع المجموعات التي تم تفعيل الحماية فيها"""
+        return await self.run(
+            "chats.select",
+            lambda connection: [row[0] for row in connection.execute(
+                "SELECT chat_id FROM chats WHERE protection_enabled = 1 AND unreachable = 0"
+            )],
+            default=[],
+        )
+
+    async def mark_unreachable(self, collection: str, key_field: str, ids: List[int]):
+        """استبعاد المحادثات التي حظرت البوت أو لم تعد موجودة من الإذاعات القادمة"""
+        if KEY_FIELDS.get(collection) != key_field:
+            raise ValueError(f"Unknown table {collection}.{key_field}")
+        await self.run(
+            f"{collection}.mark_unreachable",
+            _write,
+            [(f"UPDATE {collection} SET unreachable = 1 WHERE {key_field} = ?", [(key,) for key in ids])],
+        )
+
+    async def is_activating_admin(self, user_id: int) -> bool:
+        """التحقق مما إذا كان المستخدم هو المشرف الذي قام بتفعيل البوت في أي مجموعة"""
+        result = await self.run(
+            "chats.activating_admin",
+            lambda connection: connection.execute(
+                "SELECT 1 FROM chats WHERE activating_admin_id = ? AND protection_enabled = 1 LIMIT 1", (user_id,)
+            ).fetchone(),
+        )
+        return result is not None
+
+    async def load_activating_admins(self) -> Optional[List[tuple]]:
+        """أزواج (المجموعة، المشرف الذي فعّلها) لجميع المجموعات المحمية"""
+        return await self.run(
+            "chats.activating_admins",
+            lambda connection: connection.execute(
+                "SELECT chat_id, activating_admin_id FROM chats "
+                "WHERE protection_enabled = 1 AND activating_admin_id IS NOT NULL"
+            ).fetchall(),
+        )
+
+    async def upsert_fields(self, collection: str, key_field: str, dirty: Dict[int, dict]) -> bool:
+        """تحديث (أو إنشاء) صف لكل مفتاح؛ الصفوف ذات الحقول نفسها تُكتب بجملة واحدة"""
+        if KEY_FIELDS.get(collection) != key_field:
+            raise ValueError(f"Unknown table {collection}.{key_field}")
+        columns = COLUMNS[collection]
+        groups: Dict[tuple, list] = {}
+        for key, fields in dirty.items():
+            names = tuple(name for name in columns if name in fields)
+            groups.setdefault(names, []).append((key, *(_value(fields[name]) for name in names)))
+        statements = []
+        for names, rows in groups.items():
+            placeholders = ", ".join("?" * (len(names) + 1))
+            updates = ", ".join(f"{name} = excluded.{name}" for name in names) or f"{key_field} = excluded.{key_field}"
+            statements.append((
+                f"INSERT INTO {collection} ({', '.join((key_field, *names))}) VALUES ({placeholders}) "
+                f"ON CONFLICT ({key_field}) DO UPDATE SET {updates}",
+                rows,
+            ))
+        return await self.run(f"{collection}.upsert", _write, statements, default=False)
+
+    async def increment_counters(self, increments: Dict[object, Dict[str, int]]) -> bool:
+        """زيادة عدادات الكابتشا"""
+        rows = [(str(key), status, count) for key, counts in increments.items() for status, count in counts.items()]
+        return await self.run(
+            "captcha_counters.increment",
+            _write,
+            [(
+                "INSERT INTO captcha_counters (scope, status, count) VALUES (?, ?, ?) "
+                "ON CONFLICT (scope, status) DO UPDATE SET count = count + excluded.count",
+                rows,
+            )],
+            default=False,
+        )
+
+    async def get_counters(self, key) -> Optional[dict]:
+        """عدادات مجموعة أو العدادات الإجمالية"""
+        rows = await self.run(
+            "captcha_counters.select",
+            lambda connection: connection.execute(
+                "SELECT status, count FROM captcha_counters WHERE scope = ?", (str(key),)
+            ).fetchall(),
+        )
+        return dict(rows) if rows else None
+
+    async def count_captcha_events(self) -> Optional[List[tuple]]:
+        """عدد أحداث الكابتشا لكل (مجموعة، حالة) من السجل الكامل"""
+        return await self.run(
+            "captcha_stats.group",
+            lambda connection: connection.execute(
+                "SELECT chat_id, status, COUNT(*) FROM captcha_stats GROUP BY chat_id, status"
+            ).fetchall(),
+        )
+
+    async def replace_counters(self, counters: Dict[object, Dict[str, int]]) -> bool:
+        """استبدال العدادات بالقيم المعاد حسابها"""
+        return await self.run(
+            "captcha_counters.replace",
+            _write,
+            [
+                ("DELETE FROM captcha_counters WHERE scope = ?", [(str(key),) for key in counters]),
+                (
+                    "INSERT INTO captcha_counters (scope, status, count) VALUES (?, ?, ?)",
+                    [(str(key), status, count) for key, counts in counters.items() for status, count in counts.items()],
+                ),
+            ],
+            default=False,
+        )
+
+    async def estimated_totals(self) -> Optional[dict]:
+        """عدد المجموعات والمستخدمين"""
+        def count(connection):
+            return {
+                "total_chats": connection.execute("SELECT COUNT(*) FROM chats").fetchone()[0],
+                "total_users": connection.execute("SELECT COUNT(*) FROM users").fetchone()[0],
+            }
+        return await self.run("bot_totals.count", count)
+
+    async def load_enabled_chats(self) -> Optional[array]:
+        """معرفات المجموعات المفعلة مرتبة (من الفهرس مباشرة)"""
+        return await self.run(
+            "chats.warm_up",
+            lambda connection: array("q", (row[0] for row in connection.execute(
+                "SELECT chat_id FROM chats WHERE protection_enabled = 1 ORDER BY chat_id"
+            ))),
+        )
+
+    async def is_protection_enabled(self, chat_id: int) -> Optional[bool]:
+        """حالة الحماية لمجموعة واحدة؛ None عند فشل الاستعلام"""
+        def find(connection):
+            row = connection.execute("SELECT protection_enabled FROM chats WHERE chat_id = ?", (chat_id,)).fetchone()
+            return bool(row and row[0])
+        return await self.run("chats.protection_enabled", find)
+
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+مخازن حالة الكابتشا المعلقة المشتركة بين عمليات البوت
+يُختار المخزن عبر STATE_BACKEND:
+    mongodb (الافتراضي)          مجموعة pending_captchas في MongoDB
+    memory://                     في ذاكرة العملية (عملية واحدة، للتطوير)
+    sqlite:///path/to/state.db    SQLite بوضع WAL لعدة عمليات على نفس الجهاز
+    redis://host:port/db          مخزن مفاتيح شبكي لعدة أجهزة
+"""
+
+import asyncio
+import json
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Tuple
+
+from pymongo import DeleteOne, ReplaceOne
+
+from sharding import shard_of
+
+logger = logging.getLogger(__name__)
+
+# (chat_id, user_id)
+Key = Tuple[int, int]
+
+
+def encode_record(doc: dict) -> str:
+    """تحويل سجل إلى JSON مع الحفاظ على قيم datetime"""
+    return json.dumps(doc, default=lambda value: {"$date": value.isoformat()}, ensure_ascii=False)
+
+
+def decode_record(text) -> dict:
+    return json.loads(text, object_hook=lambda obj: datetime.fromisoformat(obj["$date"]) if "$date" in obj else obj)
+
+
+class StateBackend:
+    """واجهة المخزن: كتابة دفعة من التغييرات وتحميل سجلات عامل عند بدء التشغيل"""
+
+    async def open(self):
+        """تجهيز المخزن (فهارس، جداول، اتصالات)"""
+
+    async def write(self, upserts: Dict[Key, dict], deletes: List[Key]) -> bool:
+        """كتابة دفعة واحدة؛ تُرجع False عند الفشل لتُعاد المحاولة لاحقاً"""
+        raise NotImplementedError
+
+    async def load(self, shard: int = 0, shards: int = 1) -> List[dict]:
+        """جميع السجلات في مجموعات العامل shard، مع chat_id و user_id"""
+        raise NotImplementedError
+
+    async def close(self):
+        """إغلاق الاتصالات"""
+
+
+class MongoStateBackend(StateBackend):
+    """مجموعة pending_captchas عبر MongoRepository"""
+
+    def __init__(self, repository):
+        self._repository = repository
+
+    async def open(self):
+        await self._repository.run(
+            "pending_captchas.create_index",
+            lambda db: db.pending_captchas.create_index([("chat_id", 1), ("user_id", 1)], unique=True),
+        )
+
+    async def write(self, upserts: Dict[Key, dict], deletes: List[Key]) -> bool:
+        operations = [
+            ReplaceOne({"chat_id": chat_id, "user_id": user_id}, doc, upsert=True)
+            for (chat_id, user_id), doc in upserts.items()
+        ]
+        operations.extend(DeleteOne({"chat_id": chat_id, "user_id": user_id}) for chat_id, user_id in deletes)
+        return await self._repository.run(
+            "pending_captchas.bulk_write",
+            lambda db: db.pending_captchas.bulk_write(operations, ordered=False) is not None,
+            default=False,
+        )
+
+    async def load(self, shard: int = 0, shards: int = 1) -> List[dict]:
+        query = {}
+        if shards > 1:
+            query = {"$expr": {"$eq": [{"$mod": [{"$abs": "$chat_id"}, shards]}, shard]}}
+        return await self._repository.run(
+            "pending_captchas.find", lambda db: list(db.pending_captchas.find(query, {"_id": 0})), default=[]
+        )
+
+
+class MemoryStateBackend(StateBackend):
+    """قاموس في ذاكرة العملية؛ لا يصمد بعد إعادة التشغيل ولا يُشارك بين العمليات"""
+
+    def __init__(self):
+        self._records: Dict[Key, dict] = {}
+
+    async def write(self, upserts: Dict[Key, dict], deletes: List[Key]) -> bool:
+        self._records.update(upserts)
+        for key in deletes:
+            self._records.pop(key, None)
+        return True
+
+    async def load(self, shard: int = 0, shards: int = 1) -> List[dict]:
+        return [dict(doc) for (chat_id, _), doc in self._records.items() if shard_of(chat_id, shards) == shard]
+
+
+class SQLiteStateBackend(StateBackend):
+    """ملف SQLite بوضع WAL: عدة عمليات تقرأ وتكتب على نفس الجهاز، وكل دفعة في معاملة واحدة"""
+
+    def __init__(self, path: str):
+        self._path = path
+        # اتصال واحد في خيط واحد؛ الكتابات متسلسلة أصلاً في SQLite
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-state")
+        self._connection = None
+
+    def _connect(self):
+        connection = sqlite3.connect(self._path, timeout=30, isolation_level=None)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS pending_captchas ("
+            "chat_id INTEGER NOT NULL, user_id INTEGER NOT NULL, doc TEXT NOT NULL, "
+            "PRIMARY KEY (chat_id, user_id)) WITHOUT ROWID"
+        )
+        return connection
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    async def open(self):
+        def connect():
+            if self._connection is None:
+                self._connection = self._connect()
+        await self._run(connect)
+
+    def _write(self, upserts: Dict[Key, dict], deletes: List[Key]):
+        connection = self._connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany(
+                "INSERT INTO pending_captchas (chat_id, user_id, doc) VALUES (?, ?, ?) "
+                "ON CONFLICT (chat_id, user_id) DO UPDATE SET doc = excluded.doc",
+                [(chat_id, user_id, encode_record(doc)) for (chat_id, user_id), doc in upserts.items()],
+            )
+            connection.executemany("DELETE FROM pending_captchas WHERE chat_id = ? AND user_id = ?", deletes)
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    async def write(self, upserts: Dict[Key, dict], deletes: List[Key]) -> bool:
+        if self._connection is None:
+            await self.open()
+        try:
+            await self._run(self._write, upserts, deletes)
+            return True
+        except sqlite3.Error as e:
+            logger.error(f"SQLite state write failed: {e}")
+            return False
+
+    async def load(self, shard: int = 0, shards: int = 1) -> List[dict]:
+        if self._connection is None:
+            await self.open()
+
+        def load():
+            rows = self._connection.execute(
+                "SELECT doc FROM pending_captchas WHERE abs(chat_id) % ? = ?", (shards, shard)
+            )
+            return [decode_record(doc) for (doc,) in rows]
+        return await self._run(load)
+
+    async def close(self):
+        if self._connection is not None:
+            await self._run(self._connection.close)
+            self._connection = None
+        self._executor.shutdown(wait=False)
+
+
+class RedisStateBackend(StateBackend):
+    """مخزن Redis: hash لكل مجموعة (pending:{chat_id}) ومجموعة بمعرفات المجموعات (pending:chats)"""
+
+    CHATS_KEY = "pending:chats"
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis  # يُطلب فقط عند اختيار هذا المخزن
+
+        self._client = redis.from_url(url)
+        self._errors = redis.RedisError
+
+    @staticmethod
+    def _chat_key(chat_id: int) -> str:
+        return f"pending:{chat_id}"
+
+    async def write(self, upserts: Dict[Key, dict], deletes: List[Key]) -> bool:
+        pipeline = self._client.pipeline(transaction=False)
+        for (chat_id, user_id), doc in upserts.items():
+            pipeline.hset(self._chat_key(chat_id), str(user_id), encode_record(doc))
+            pipeline.sadd(self.CHATS_KEY, chat_id)
+        for chat_id, user_id in deletes:
+            pipeline.hdel(self._chat_key(chat_id), str(user_id))
+        try:
+            await pipeline.execute()
+            return True
+        except self._errors as e:
+            logger.error(f"Redis state write failed: {e}")
+            return False
+
+    async def load(self, shard: int = 0, shards: int = 1) -> List[dict]:
+        chat_ids = [int(chat_id) for chat_id in await self._client.smembers(self.CHATS_KEY)]
+        chat_ids = [chat_id for chat_id in chat_ids if shard_of(chat_id, shards) == shard]
+        pipeline = self._client.pipeline(transaction=False)
+        for chat_id in chat_ids:
+            pipeline.hgetall(self._chat_key(chat_id))
+        records = []
+        for chat_id, fields in zip(chat_ids, await pipeline.execute()):
+            if not fields:
+                await self._client.srem(self.CHATS_KEY, chat_id)
+                continue
+            records.extend(decode_record(doc) for doc in fields.values())
+        return records
+
+    async def close(self):
+        await self._client.aclose()
+
+
+def create_state_backend(url: str, repository=None) -> StateBackend:
+    """إنشاء المخزن المناسب لقيمة STATE_BACKEND"""
+    if not url or url == "mongodb":
+        return MongoStateBackend(repository)
+    if url == "memory://":
+        return MemoryStateBackend()
+    if url.startswith("sqlite:///"):
+        return SQLiteStateBackend(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://")):
+        return RedisStateBackend(url)
+    raise ValueError(f"Unsupported STATE_BACKEND: {url}")
@@ -0,0 +1,516 @@
+# -*- coding: utf-8 -*-
+"""
+طبقة الوصول إلى البيانات
+جميع استدعاءات pymongo المتزامنة تُنفذ في مجمع خيوط محدود حتى لا تحجب حلقة الأحداث
+"""
+
+import asyncio
+import logging
+import time
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from functools import partial
+from typing import Callable, Dict, Iterable, List, Optional
+
+from bson import ObjectId
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+CAPTCHA_STATUSES = ("success", "kicked", "timeout")
+
+
+class OperationMetrics:
+    """قياس زمن الاستجابة لكل عملية على قاعدة البيانات"""
+
+    def __init__(self):
+        # name -> [count, errors, total_seconds, max_seconds]
+        self._ops: Dict[str, list] = {}
+
+    def record(self, name: str, elapsed: float, failed: bool = False):
+        op = self._ops.get(name)
+        if op is None:
+            op = self._ops[name] = [0, 0, 0.0, 0.0]
+        op[0] += 1
+        op[1] += failed
+        op[2] += elapsed
+        if elapsed > op[3]:
+            op[3] = elapsed
+
+    def snapshot(self) -> Dict[str, dict]:
+        """ملخص العمليات: العدد، الأخطاء، متوسط وأقصى زمن بالملي ثانية"""
+        return {
+            name: {
+                "count": count,
+                "errors": errors,
+                "avg_ms": total / count * 1000,
+                "max_ms": max_seconds * 1000,
+            }
+            for name, (count, errors, total, max_seconds) in self._ops.items()
+        }
+
+
+class BackgroundFlusher:
+    """أساس المخازن ذات الكتابة المؤجلة: حلقة واحدة تستدعي flush دورياً أو عند الطلب"""
+
+    def __init__(self, flush_interval: float):
+        self._flush_interval = flush_interval
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    async def flush(self):
+        raise NotImplementedError
+
+    def _touch(self, flush_now: bool = False):
+        """تشغيل حلقة الكتابة إن لم تكن تعمل، وإيقاظها فوراً إذا طُلب ذلك"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # لا توجد حلقة أحداث تعمل؛ ستُكتب البيانات عند أول flush
+            return
+        # قد تكون المهمة السابقة مرتبطة بحلقة أحداث أُغلقت، فنعيد إنشاءها في الحلقة الحالية
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._stopping = False
+            self._wakeup = asyncio.Event()
+            self._task = loop.create_task(self._run())
+        if flush_now:
+            self._wakeup.set()
+
+    async def stop(self):
+        """إيقاف حلقة الكتابة مع كتابة ما تبقى"""
+        if self._task is not None and not self._task.done():
+            # الإلغاء لا يكفي: بعض العملاء (مثل pipeline.execute في redis-py) يبتلعون CancelledError فتستمر الحلقة،
+            # لذلك تُوقظ الحلقة وتنتهي بنفسها بعد الكتابة الجارية
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+        self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self._flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+
+class MongoRepository:
+    """واجهة غير حاجبة لعمليات MongoDB عبر مجمع خيوط محدود الحجم"""
+
+    def __init__(self, get_db: Callable, max_workers: int = 8):
+        self._get_db = get_db
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mongo")
+        self.metrics = OperationMetrics()
+
+    def _call(self, operation: Callable, args, kwargs, default):
+        db = self._get_db()
+        if db is None:
+            return default
+        return operation(db, *args, **kwargs)
+
+    async def run(self, name: str, operation: Callable, *args, default=None, **kwargs):
+        """تنفيذ operation(db, *args) في مجمع الخيوط مع تسجيل زمن التنفيذ"""
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        failed = False
+        try:
+            return await loop.run_in_executor(
+                self._executor, partial(self._call, operation, args, kwargs, default)
+            )
+        except Exception as e:
+            failed = True
+            logger.error(f"MongoDB operation {name} failed: {e}")
+            return default
+        finally:
+            self.metrics.record(name, time.perf_counter() - start, failed)
+
+    def shutdown(self):
+        """إيقاف مجمع الخيوط بعد انتهاء العمليات الجارية"""
+        self._executor.shutdown(wait=True)
+
+    async def insert_captcha_events(self, docs: List[dict]) -> List[dict]:
+        """كتابة دفعة من أحداث الكابتشا في عملية insert_many واحدة؛ تُرجع المستندات التي لم تُكتب"""
+        # _id ثابت لكل حدث: إعادة المحاولة بعد رد مفقود أو نجاح جزئي لا تكرر الأحداث المكتوبة
+        for doc in docs:
+            doc.setdefault("_id", ObjectId())
+
+        def insert(db):
+            try:
+                db.captcha_stats.insert_many(docs, ordered=False)
+            except BulkWriteError as e:
+                # تكرار المفتاح (11000) يعني أن الحدث كُتب في محاولة سابقة
+                failed = {error["index"] for error in e.details.get("writeErrors", []) if error.get("code") != 11000}
+                if e.details.get("writeConcernErrors"):
+                    raise
+                return [doc for index, doc in enumerate(docs) if index in failed]
+            return []
+
+        return await self.run("captcha_stats.insert_many", insert, default=docs)
+
+    async def bulk_write(self, collection: str, operations: list) -> bool:
+        """تنفيذ دفعة عمليات غير مرتبة على مجموعة واحدة"""
+        return await self.run(
+            f"{collection}.bulk_write",
+            lambda db: db[collection].bulk_write(operations, ordered=False) is not None,
+            default=False,
+        )
+
+    async def get_stats(self, user_id: int = None, chat_id: int = None, hours: int = None) -> dict:
+        """الحصول على إحصائيات الكابتشا"""
+        query = {}
+        if chat_id:
+            query["chat_id"] = chat_id
+        if user_id:
+            query["user_id"] = user_id
+        if hours:
+            query["timestamp"] = {"$gte": datetime.now() - timedelta(hours=hours)}
+        pipeline = [
+            {"$match": query},
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+        ]
+        results = await self.run(
+            "captcha_stats.aggregate", lambda db: list(db.captcha_stats.aggregate(pipeline)), default=[]
+        )
+        stats = {"success": 0, "kicked": 0, "timeout": 0}
+        for res in results:
+            stats[res["_id"]] = res["count"]
+        return stats
+
+    async def get_all_users(self) -> list:
+        """الحصول على جميع المستخدمين"""
+        return await self.run(
+            "users.find",
+            lambda db: [user["user_id"] for user in db.users.find({"unreachable": {"$ne": True}}, {"user_id": 1, "_id": 0})],
+            default=[],
+        )
+
+    async def get_all_chats(self) -> list:
+        """الحصول على جميع المجموعات التي تم تفعيل الحماية فيها"""
+        return await self.run(
+            "chats.find",
+            lambda db: [chat["chat_id"] for chat in db.chats.find(
+                {"protection_enabled": True, "unreachable": {"$ne": True}}, {"chat_id": 1, "_id": 0}
+            )],
+            default=[],
+        )
+
+    async def mark_unreachable(self, collection: str, key_field: str, ids: List[int]):
+        """استبعاد المحادثات التي حظرت البوت أو لم تعد موجودة من الإذاعات القادمة"""
+        for i in range(0, len(ids), 1000):
+            chunk = ids[i:i + 1000]
+            await self.run(
+                f"{collection}.update_many",
+                lambda db: db[collection].update_many({key_field: {"$in": chunk}}, {"$set": {"unreachable": True}}),
+            )
+
+    async def is_activating_admin(self, user_id: int) -> bool:
+        """التحقق مما إذا كان المستخدم هو المشرف الذي قام بتفعيل البوت في أي مجموعة"""
+        result = await self.run(
+            "chats.find_one",
+            lambda db: db.chats.find_one({"protection_enabled": True, "activating_admin_id": user_id}, {"_id": 1}),
+        )
+        return result is not None
+
+    async def load_activating_admins(self) -> Optional[List[tuple]]:
+        """أزواج (المجموعة، المشرف الذي فعّلها) لجميع المجموعات المحمية"""
+        return await self.run(
+            "chats.activating_admins",
+            lambda db: [
+                (doc["chat_id"], doc["activating_admin_id"])
+                for doc in db.chats.find(
+                    {"protection_enabled": True, "activating_admin_id": {"$ne": None}},
+                    {"chat_id": 1, "activating_admin_id": 1, "_id": 0},
+                    batch_size=1000,
+                )
+            ],
+        )
+
+    async def upsert_fields(self, collection: str, key_field: str, dirty: Dict[int, dict]) -> bool:
+        """تحديث (أو إنشاء) مستند لكل مفتاح بالحقول المعطاة"""
+        operations = [UpdateOne({key_field: key}, {"$set": fields}, upsert=True) for key, fields in dirty.items()]
+        return await self.bulk_write(collection, operations)
+
+    async def increment_counters(self, increments: Dict[object, Dict[str, int]]) -> bool:
+        """زيادة عدادات الكابتشا بـ $inc"""
+        operations = [UpdateOne({"_id": key}, {"$inc": counts}, upsert=True) for key, counts in increments.items()]
+        return await self.bulk_write("captcha_counters", operations)
+
+    async def get_counters(self, key) -> Optional[dict]:
+        """عدادات مجموعة أو العدادات الإجمالية"""
+        return await self.run("captcha_counters.find_one", lambda db: db.captcha_counters.find_one({"_id": key}))
+
+    async def count_captcha_events(self) -> Optional[List[tuple]]:
+        """عدد أحداث الكابتشا لكل (مجموعة، حالة) من السجل الكامل"""
+        pipeline = [{"$group": {"_id": {"chat_id": "$chat_id", "status": "$status"}, "count": {"$sum": 1}}}]
+        results = await self.run(
+            "captcha_stats.aggregate", lambda db: list(db.captcha_stats.aggregate(pipeline, allowDiskUse=True)), default=None
+        )
+        if results is None:
+            return None
+        return [(res["_id"].get("chat_id"), res["_id"].get("status"), res["count"]) for res in results]
+
+    async def replace_counters(self, counters: Dict[object, Dict[str, int]]) -> bool:
+        """استبدال العدادات بالقيم المعاد حسابها"""
+        operations = [ReplaceOne({"_id": key}, counts, upsert=True) for key, counts in counters.items()]
+        return await self.bulk_write("captcha_counters", operations)
+
+    async def estimated_totals(self) -> Optional[dict]:
+        """عدد المجموعات والمستخدمين من بيانات المجموعة الوصفية"""
+        def count(db):
+            return {
+                "total_chats": db.chats.estimated_document_count(),
+                "total_users": db.users.estimated_document_count(),
+            }
+        return await self.run("bot_totals.estimated_count", count)
+
+    async def load_enabled_chats(self) -> Optional[array]:
+        """معرفات المجموعات المفعلة مرتبة، عبر مؤشر متدفق دون بناء قائمة مستندات في الذاكرة"""
+        def load(db):
+            ids = array("q")
+            cursor = db.chats.find({"protection_enabled": True}, {"chat_id": 1, "_id": 0}, batch_size=1000)
+            for doc in cursor:
+                ids.append(doc["chat_id"])
+            return array("q", sorted(set(ids)))
+        return await self.run("chats.warm_up", load)
+
+    async def is_protection_enabled(self, chat_id: int) -> Optional[bool]:
+        """حالة الحماية لمجموعة واحدة؛ None عند فشل الاستعلام"""
+        def find(db):
+            doc = db.chats.find_one({"chat_id": chat_id}, {"protection_enabled": 1, "_id": 0})
+            return bool(doc and doc.get("protection_enabled"))
+        return await self.run("chats.find_one", find)
+
+
+class CaptchaEventBuffer(BackgroundFlusher):
+    """مخزن مؤقت لأحداث الكابتشا يُكتب عبر insert_many عند بلوغ حجم أو عمر محدد"""
+
+    def __init__(self, repository: MongoRepository, counters: "CaptchaCounters" = None, max_size: int = 500,
+                 max_age: float = 5.0, high_watermark: int = 5000, max_backlog: int = 50000):
+        super().__init__(max_age)
+        self._repository = repository
+        self._counters = counters
+        self._max_size = max_size
+        self._high_watermark = high_watermark
+        self._max_backlog = max_backlog
+        self._events: List[dict] = []
+        self._in_flight = 0
+        self._flush_lock = asyncio.Lock()
+        self._backpressured = False
+        self.dropped = 0
+        self.flushed = 0
+
+    @property
+    def backlog(self) -> int:
+        """عدد الأحداث التي لم تُكتب بعد (في المخزن أو قيد الكتابة)"""
+        return len(self._events) + self._in_flight
+
+    @property
+    def backpressured(self) -> bool:
+        """True إذا كانت قاعدة البيانات متأخرة عن معدل الأحداث"""
+        return self._backpressured
+
+    def add(self, user_id: int, chat_id: int, status: str):
+        """إضافة حدث كابتشا إلى المخزن المؤقت"""
+        self._events.append({"user_id": user_id, "chat_id": chat_id, "status": status, "timestamp": datetime.now()})
+        if len(self._events) > self._max_backlog:
+            # الحد الأقصى للذاكرة: نتخلى عن أقدم الأحداث
+            overflow = len(self._events) - self._max_backlog
+            del self._events[:overflow]
+            self.dropped += overflow
+        self._update_backpressure()
+        self._touch(flush_now=len(self._events) >= self._max_size)
+
+    def _update_backpressure(self):
+        backlog = self.backlog
+        if not self._backpressured and backlog >= self._high_watermark:
+            self._backpressured = True
+            logger.warning(f"Captcha event buffer is backpressured: {backlog} events waiting for MongoDB.")
+        elif self._backpressured and backlog < self._high_watermark // 2:
+            self._backpressured = False
+            logger.info(f"Captcha event buffer recovered: {backlog} events waiting for MongoDB.")
+
+    async def flush(self):
+        """كتابة الأحداث المخزنة على دفعات"""
+        async with self._flush_lock:
+            while self._events:
+                batch = self._events[:self._max_size]
+                del self._events[:self._max_size]
+                self._in_flight = len(batch)
+                unwritten = await self._repository.insert_captcha_events(batch)
+                self._in_flight = 0
+                if len(unwritten) < len(batch):
+                    pending = {id(doc) for doc in unwritten}
+                    written = [doc for doc in batch if id(doc) not in pending]
+                    self.flushed += len(written)
+                    if self._counters is not None:
+                        await self._counters.write(written)
+                if unwritten:
+                    # إعادة ما لم يُكتب إلى بداية المخزن والمحاولة في الدورة التالية
+                    self._events[:0] = unwritten
+                    self._update_backpressure()
+                    return
+                self._update_backpressure()
+
+    def snapshot(self) -> dict:
+        """حالة المخزن المؤقت"""
+        return {
+            "backlog": self.backlog,
+            "backpressured": self._backpressured,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+        }
+
+
+class CoalescingUpserter(BackgroundFlusher):
+    """تجميع تحديثات المستندات (users/chats) في خريطة dirty وكتابتها دورياً دفعة واحدة"""
+
+    def __init__(self, repository: MongoRepository, collection: str, key_field: str, timestamp_field: str,
+                 touch_window: float = 300.0, flush_interval: float = 5.0, max_dirty: int = 1000,
+                 max_known: int = 100000):
+        super().__init__(flush_interval)
+        self._repository = repository
+        self._collection = collection
+        self._key_field = key_field
+        self._timestamp_field = timestamp_field
+        self._touch_window = touch_window
+        self._max_dirty = max_dirty
+        self._max_known = max_known
+        # id -> الحقول التي لم تُكتب بعد
+        self._dirty: Dict[int, dict] = {}
+        # id -> (آخر قيم معروفة للحقول، وقت آخر تحديث للطابع الزمني)
+        self._known: "OrderedDict[int, tuple]" = OrderedDict()
+        self.suppressed = 0
+
+    def update(self, key: int, fields: dict, flush_now: bool = False):
+        """تسجيل تحديث للمستند؛ تحديث الطابع الزمني وحده يُهمل داخل نافذة touch_window"""
+        now = time.time()
+        known = self._known.get(key)
+        if known is None:
+            changed = dict(fields)
+            known_fields = dict(fields)
+        else:
+            known_fields, touched_at = known
+            changed = {name: value for name, value in fields.items() if known_fields.get(name, _MISSING) != value}
+            if not changed and now - touched_at < self._touch_window:
+                self.suppressed += 1
+                return
+            known_fields.update(changed)
+
+        self._known[key] = (known_fields, now)
+        self._known.move_to_end(key)
+        if len(self._known) > self._max_known:
+            self._known.popitem(last=False)
+
+        pending = self._dirty.setdefault(key, {})
+        pending.update(changed)
+        pending[self._timestamp_field] = datetime.now()
+        self._touch(flush_now=flush_now or len(self._dirty) >= self._max_dirty)
+
+    def forget(self, keys: Iterable[int]):
+        """إسقاط القيم المعروفة لمستندات تغيرت في قاعدة البيانات خارج هذا المجمّع (مثل mark_unreachable)"""
+        for key in keys:
+            self._known.pop(key, None)
+
+    async def flush(self):
+        """كتابة جميع التحديثات المجمعة في عملية واحدة"""
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        if not await self._repository.upsert_fields(self._collection, self._key_field, dirty):
+            # دمج التحديثات الفاشلة تحت التحديثات الأحدث التي وصلت أثناء الكتابة
+            for key, fields in dirty.items():
+                fields.update(self._dirty.get(key, {}))
+                self._dirty[key] = fields
+
+
+class CaptchaCounters:
+    """عدادات الكابتشا لكل مجموعة وإجمالية في captcha_counters، تُحدّث بزيادات وتُقرأ من ذاكرة مؤقتة"""
+
+    GLOBAL = "global"
+
+    def __init__(self, repository: MongoRepository, cache_ttl: float = 60.0):
+        self._repository = repository
+        self._cache_ttl = cache_ttl
+        # _id -> (stats, وقت التحميل)
+        self._cache: Dict[object, tuple] = {}
+
+    async def write(self, events: List[dict]) -> bool:
+        """زيادة العدادات لدفعة أحداث مكتوبة، ثم النسخة المخزنة في الذاكرة (فلا تُحسب أحداث لم تصل إلى قاعدة البيانات)"""
+        increments: Dict[object, Dict[str, int]] = {}
+        for event in events:
+            for key in (event["chat_id"], self.GLOBAL):
+                counts = increments.setdefault(key, {})
+                counts[event["status"]] = counts.get(event["status"], 0) + 1
+        written = await self._repository.increment_counters(increments)
+        if not written:
+            logger.error(f"Failed to update captcha counters for {len(events)} events; run a rebuild to resync.")
+            return written
+        for key, counts in increments.items():
+            cached = self._cache.get(key)
+            if cached is not None:
+                for status, count in counts.items():
+                    cached[0][status] = cached[0].get(status, 0) + count
+        return written
+
+    async def get(self, chat_id: int = None) -> dict:
+        """إحصائيات الكابتشا لمجموعة أو للبوت كاملاً، بزمن ثابت بغض النظر عن حجم السجل"""
+        key = chat_id or self.GLOBAL
+        cached = self._cache.get(key)
+        if cached is not None and time.time() - cached[1] < self._cache_ttl:
+            return dict(cached[0])
+
+        doc = await self._repository.get_counters(key)
+        stats = dict.fromkeys(CAPTCHA_STATUSES, 0)
+        if doc:
+            stats.update({status: doc.get(status, 0) for status in CAPTCHA_STATUSES})
+        self._cache[key] = (stats, time.time())
+        return dict(stats)
+
+    async def rebuild(self) -> int:
+        """إعادة بناء جميع العدادات من سجل captcha_stats (عملية لمرة واحدة)"""
+        results = await self._repository.count_captcha_events()
+        if results is None:
+            return 0
+        counters: Dict[object, Dict[str, int]] = {self.GLOBAL: dict.fromkeys(CAPTCHA_STATUSES, 0)}
+        for chat_id, status, count in results:
+            counters.setdefault(chat_id, dict.fromkeys(CAPTCHA_STATUSES, 0))[status] = count
+            counters[self.GLOBAL][status] = counters[self.GLOBAL].get(status, 0) + count
+        await self._repository.replace_counters(counters)
+        self._cache.clear()
+        return len(counters) - 1
+
+
+class BotTotals:
+    """إجمالي المجموعات والمستخدمين من بيانات المجموعة الوصفية (estimated_document_count) مع لقطة مخزنة"""
+
+    def __init__(self, repository: MongoRepository, refresh_interval: float = 300.0):
+        self._repository = repository
+        self._refresh_interval = refresh_interval
+        self._snapshot = {"total_chats": 0, "total_users": 0}
+        self._refreshed_at = 0.0
+        self._refresh_lock = asyncio.Lock()
+
+    async def get(self) -> dict:
+        """إرجاع آخر لقطة، وتحديثها إذا انتهت صلاحيتها"""
+        if time.time() - self._refreshed_at >= self._refresh_interval:
+            async with self._refresh_lock:
+                # قد يكون طلب آخر حدّث اللقطة أثناء الانتظار
+                if time.time() - self._refreshed_at >= self._refresh_interval:
+                    await self.refresh()
+        return dict(self._snapshot)
+
+    async def refresh(self):
+        """تحديث اللقطة دون المرور على المستندات (users.user_id و chats.chat_id فريدان)"""
+        snapshot = await self._repository.estimated_totals()
+        if snapshot is not None:
+            self._snapshot = snapshot
+            self._refreshed_at = time.time()
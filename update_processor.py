@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+معالجة متوازية للتحديثات مقسمة حسب المحادثة
+تحديثات المحادثة الواحدة تُعالج بترتيب وصولها، والمحادثات المختلفة تُعالج بالتوازي
+"""
+
+import asyncio
+from typing import Dict, Optional
+
+from telegram.ext import BaseUpdateProcessor
+
+
+def update_chat_id(update) -> Optional[int]:
+    """معرف المحادثة التي يخصها التحديث، أو None للتحديثات التي لا تتبع محادثة"""
+    chat = getattr(update, "effective_chat", None)
+    return chat.id if chat is not None else None
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """معالج تحديثات لـ Application: قفل لكل محادثة وحد أقصى للتحديثات المنفذة فعلياً
+
+    max_pending يحد التحديثات المستلمة (المنتظرة والمنفذة)، و workers يحد المنفذة فعلياً،
+    حتى لا تحجز تحديثات محادثة مزدحمة تنتظر قفلها أماكن المحادثات الأخرى.
+    """
+
+    def __init__(self, workers: int = 32, max_pending: int = 4096):
+        super().__init__(max_pending)
+        self._running = asyncio.Semaphore(workers)
+        self._locks: Dict[int, asyncio.Lock] = {}
+        # عدد التحديثات التي تحمل القفل أو تنتظره لكل محادثة، لحذف الأقفال غير المستخدمة
+        self._holders: Dict[int, int] = {}
+
+    async def do_process_update(self, update, coroutine):
+        chat_id = update_chat_id(update)
+        if chat_id is None:
+            async with self._running:
+                await coroutine
+            return
+
+        lock = self._locks.get(chat_id)
+        if lock is None:
+            lock = self._locks[chat_id] = asyncio.Lock()
+        self._holders[chat_id] = self._holders.get(chat_id, 0) + 1
+        try:
+            # asyncio.Lock يوقظ المنتظرين بترتيب وصولهم، فيُحفظ ترتيب تحديثات المحادثة
+            async with lock:
+                async with self._running:
+                    await coroutine
+        finally:
+            self._holders[chat_id] -= 1
+            if not self._holders[chat_id]:
+                del self._holders[chat_id]
+                del self._locks[chat_id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
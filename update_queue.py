@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+طابور تحديثات الويب هوك
+يُرد على Telegram فور إضافة التحديث، ويعالجه عدد ثابت من العمال بمعزل عن زمن الاستجابة
+تحديثات المحادثة الواحدة تُعالج بالترتيب لدى عامل واحد، والمحادثات المختلفة بالتوازي
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Dict, List
+
+from update_processor import update_chat_id
+
+logger = logging.getLogger(__name__)
+
+# سياسات امتلاء الطابور:
+# REJECT: رفض التحديث الجديد بـ 503 فيعيد Telegram إرساله لاحقاً (لا يُفقد شيء)
+# DROP_OLDEST: إهمال أقدم تحديث لصالح الجديد (أولوية للحداثة على حساب الفقد)
+REJECT, DROP_OLDEST = "reject", "drop_oldest"
+OVERFLOW_POLICIES = (REJECT, DROP_OLDEST)
+
+
+class UpdateQueue:
+    """طابور محدود السعة مع عمال يستدعون application.process_update، مقسم حسب المحادثة"""
+
+    def __init__(self, application, workers: int = 8, max_size: int = 10000, overflow: str = REJECT):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow}")
+        self._application = application
+        self._workers = workers
+        self._max_size = max_size
+        self._overflow = overflow
+        # (وقت الإضافة، التحديث)
+        self._items: deque = deque()
+        # المحادثات قيد المعالجة -> تحديثاتها التالية؛ يعالجها العامل نفسه بالترتيب
+        self._active: Dict[int, deque] = {}
+        self._parked = 0
+        self._not_empty = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self._closed = False
+        self._busy = 0
+        self._accepted = 0
+        self._processed = 0
+        self._failed = 0
+        self._dropped = 0
+        self._rejected = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def start(self):
+        """تشغيل العمال على حلقة الأحداث الحالية"""
+        self._closed = False
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self._workers)]
+
+    async def stop(self, timeout: float = 10.0):
+        """إيقاف استقبال التحديثات، ومعالجة ما تبقى خلال timeout ثانية، ثم إيقاف العمال"""
+        self._closed = True
+        deadline = time.monotonic() + timeout
+        while (self._items or self._parked or self._busy) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if len(self):
+            logger.warning(f"Dropping {len(self)} queued updates on shutdown.")
+            self._dropped += len(self)
+            self._items.clear()
+            for backlog in self._active.values():
+                backlog.clear()
+            self._parked = 0
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def put(self, update) -> bool:
+        """إضافة تحديث دون انتظار؛ تُرجع False إذا رُفض (الطابور ممتلئ أو متوقف)"""
+        if self._closed:
+            self._rejected += 1
+            return False
+        if len(self) >= self._max_size:
+            if self._overflow == REJECT or not self._items:
+                self._rejected += 1
+                return False
+            self._items.popleft()
+            self._dropped += 1
+            if self._dropped % 1000 == 1:
+                logger.warning(f"Update queue full ({self._max_size}); dropped {self._dropped} oldest updates so far.")
+        self._items.append((time.monotonic(), update))
+        self._accepted += 1
+        self._not_empty.set()
+        return True
+
+    def __len__(self):
+        return len(self._items) + self._parked
+
+    @property
+    def oldest_age(self) -> float:
+        """عمر أقدم تحديث ينتظر المعالجة بالثواني"""
+        heads = [backlog[0][0] for backlog in self._active.values() if backlog]
+        if self._items:
+            heads.append(self._items[0][0])
+        if not heads:
+            return 0.0
+        return time.monotonic() - min(heads)
+
+    def snapshot(self) -> dict:
+        """حالة الطابور: العمق وعمر أقدم تحديث وزمن الانتظار والعدادات"""
+        started = self._processed + self._failed
+        return {
+            "depth": len(self),
+            "active_chats": len(self._active),
+            "max_size": self._max_size,
+            "overflow": self._overflow,
+            "workers": self._workers,
+            "busy": self._busy,
+            "oldest_age_ms": self.oldest_age * 1000,
+            "avg_wait_ms": self._wait_total / started * 1000 if started else 0.0,
+            "max_wait_ms": self._wait_max * 1000,
+            "accepted": self._accepted,
+            "processed": self._processed,
+            "failed": self._failed,
+            "dropped": self._dropped,
+            "rejected": self._rejected,
+        }
+
+    async def _work(self):
+        while True:
+            while not self._items:
+                self._not_empty.clear()
+                await self._not_empty.wait()
+            enqueued_at, update = self._items.popleft()
+            chat_id = update_chat_id(update)
+            if chat_id is None:
+                await self._process(enqueued_at, update)
+                continue
+
+            backlog = self._active.get(chat_id)
+            if backlog is not None:
+                # المحادثة لدى عامل آخر؛ يكمل ذلك العامل تحديثاتها بعد الحالي
+                backlog.append((enqueued_at, update))
+                self._parked += 1
+                continue
+
+            backlog = self._active[chat_id] = deque()
+            try:
+                await self._process(enqueued_at, update)
+                while backlog:
+                    self._parked -= 1
+                    await self._process(*backlog.popleft())
+            finally:
+                del self._active[chat_id]
+
+    async def _process(self, enqueued_at: float, update):
+        wait = time.monotonic() - enqueued_at
+        self._wait_total += wait
+        self._wait_max = max(self._wait_max, wait)
+
+        self._busy += 1
+        try:
+            await self._application.process_update(update)
+            self._processed += 1
+        except Exception as e:
+            # أخطاء المعالجات تصل إلى معالج أخطاء Application؛ هنا فقط ما يفلت منه
+            self._failed += 1
+            logger.error(f"Failed to process update: {e}")
+        finally:
+            self._busy -= 1
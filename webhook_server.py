@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+مدخل ويب هوك أصلي (ASGI) يعمل على نفس حلقة أحداث البوت
+التحديثات تُوضع في طابور ويُرد على Telegram فوراً بدلاً من معالجتها داخل طلب HTTP
+"""
+
+import contextlib
+import json
+import logging
+import signal
+import threading
+import time
+
+import uvicorn
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookApp:
+    """تطبيق ASGI بسيط: / و /health ومسار الويب هوك"""
+
+    def __init__(self, application, webhook_path: str, updates=None):
+        self._application = application
+        self._webhook_path = webhook_path
+        # طابور التحديثات (UpdateQueue)؛ إن لم يُحدد تُستخدم application.update_queue
+        self._updates = updates
+        self._started_at = time.time()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return
+
+        path = scope["path"]
+        method = scope["method"]
+        if path == self._webhook_path:
+            if method != "POST":
+                await self._respond(send, 405, b"")
+                return
+            status = await self._handle_update(await self._read_body(receive))
+            await self._respond(send, status, b"")
+        elif path == "/" and method in ("GET", "HEAD"):
+            uptime_minutes = (time.time() - self._started_at) / 60
+            await self._respond(send, 200, f"Bot is running! Uptime: {uptime_minutes:.2f} minutes.".encode())
+        elif path == "/health" and method in ("GET", "HEAD"):
+            await self._respond(send, 200, b"OK")
+        else:
+            await self._respond(send, 404, b"Not Found")
+
+    async def _handle_update(self, body: bytes) -> int:
+        try:
+            update = Update.de_json(json.loads(body), self._application.bot)
+        except Exception as e:
+            logger.error(f"Invalid webhook payload: {e}")
+            return 400
+        if self._updates is None:
+            await self._application.update_queue.put(update)
+        elif not self._updates.put(update):
+            # الطابور ممتلئ: 503 يجعل Telegram يعيد إرسال التحديث لاحقاً
+            return 503
+        return 200
+
+    @staticmethod
+    async def _read_body(receive) -> bytes:
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        return b"".join(chunks)
+
+    @staticmethod
+    async def _respond(send, status: int, body: bytes):
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"text/plain; charset=utf-8"),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+class WebhookServer(uvicorn.Server):
+    """uvicorn.Server لا يعيد إرسال SIGTERM/SIGINT بعد توقفه، فتكتمل خطوات الإيقاف التي تلي serve()
+    (تفريغ الطوابير والكتابة إلى قاعدة البيانات) قبل خروج العملية.
+    يستبدل capture_signals من uvicorn (ليس جزءاً من واجهته الموثقة)، لذلك نسخة uvicorn مثبتة في requirements.txt"""
+
+    @contextlib.contextmanager
+    def capture_signals(self):
+        if threading.current_thread() is not threading.main_thread():
+            yield
+            return
+        original_handlers = {sig: signal.signal(sig, self.handle_exit) for sig in (signal.SIGINT, signal.SIGTERM)}
+        try:
+            yield
+        finally:
+            for sig, handler in original_handlers.items():
+                signal.signal(sig, handler)
+
+    def handle_exit(self, sig, frame):
+        logger.info(f"Received signal {signal.Signals(sig).name}; finishing shutdown.")
+        super().handle_exit(sig, frame)
+
+
+async def serve(app, host: str, port: int):
+    """تشغيل خادم uvicorn داخل حلقة الأحداث الحالية حتى يتلقى إشارة إيقاف، ثم العودة دون إنهاء العملية"""
+    config = uvicorn.Config(app, host=host, port=port, lifespan="off", access_log=False, log_level="info")
+    await WebhookServer(config).serve()